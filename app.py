@@ -1,25 +1,36 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, send_from_directory, g, session, Response
 # CORREÇÃO: LoginManager deve ser importado
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from database import db
+from database import db, configurar_sqlite, descrever_pragmas, somente_leitura, PRAGMAS_SQLITE, OPCOES_ENGINE
 from sqlalchemy import func, or_, asc
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import contains_eager, selectinload
 # Importação dos modelos atualizados (incluindo PagamentoVenda)
 from models import Usuario, Produto, Venda, ItemVenda, MovimentoCaixa, PagamentoVenda
+from models import ResumoVendaDia, ResumoPagamentoDia, ResumoProdutoDia, Tarefa
+# Índice em memória dos produtos (leituras do scanner no PDV)
+from catalogo import catalogo, proxima_versao, proxima_versao_estoque
+from migracoes import aplicar_migracoes
+from exportacao import tarefa_exportar_vendas
+from importacao import tarefa_importar_produtos
+from tarefas import enfileirar, situacao, novo_id, caminho_arquivo, marcar_interrompidas
+from eventos import publicar, assinar, Fluxo
+import metricas
+from backup import tarefa_backup, listar_backups, pasta_backups, iniciar_agendamento
+from sessao_usuario import carregar_usuario, guardar_na_sessao, usuario_alterado, cache_usuarios, CHAVE_SESSAO
+from resumos import estornar_venda, trocar_pagamento, reconstruir_resumos
+from registro_vendas import (VendaRecusada, EstoqueAlterado, uuid_da_venda, vendas_por_uuid,
+                             carregar_produtos, preparar_venda, gravar_vendas, estoque_insuficiente,
+                             momento_da_venda, diferenca_relogio, devolver_estoque)
 # Importações de data/hora atualizadas (agora usando APENAS HORA LOCAL)
 from datetime import datetime, timedelta, date, time
+from time import monotonic
+import json
 import os
+import threading
 # NOVAS IMPORTAÇÕES PARA UPLOAD E NOME DE ARQUIVO SEGURO
 from werkzeug.utils import secure_filename
-
-# =======================================================
-#               INÍCIO DAS NOVAS IMPORTAÇÕES (EXCEL)
-# =======================================================
-import pandas as pd
-import io
-from flask import make_response
-# =======================================================
-#                FIM DAS NOVAS IMPORTAÇÕES
-# =======================================================
+# O openpyxl (Excel) só é importado dentro das tarefas de importação/exportação
 
 
 # --- CONFIGURAÇÕES DE UPLOAD ---
@@ -27,6 +38,12 @@ from flask import make_response
 UPLOAD_FOLDER_REL = 'static/uploads/produtos'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
+# Cupons por página no relatório de cupons (carregamento incremental)
+CUPONS_POR_PAGINA = 50
+
+# Colunas de cada linha do catálogo enviado ao PDV (/api/catalogo)
+COLUNAS_CATALOGO = ['id', 'codigo_barras', 'nome', 'preco_venda', 'estoque_atual', 'imagem_url']
+
 def allowed_file(filename):
     """Verifica se a extensão do arquivo é permitida"""
     return '.' in filename and \
@@ -42,8 +59,46 @@ def create_app():
     
     # Configurações
     app.config['SECRET_KEY'] = 'chave-secreta-desenvolvimento'
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///loja.db'
+    # PDV_DATABASE_URI troca o banco (ex: benchmarks em bench/ com um banco sintético)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('PDV_DATABASE_URI', 'sqlite:///loja.db')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Perfil de desempenho do SQLite (database.py): PRAGMAs de cada conexão,
+    # pool de conexões e engine somente leitura para os relatórios
+    app.config['SQLITE_PRAGMAS'] = dict(PRAGMAS_SQLITE)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(OPCOES_ENGINE)
+    app.config['SQLITE_LEITURA_SEPARADA'] = True
+    # Backups em instance/backups (backup.py): intervalo do automático (0 desliga) e quantos guardar
+    app.config['BACKUP_INTERVALO_HORAS'] = 24
+    app.config['BACKUP_MANTER'] = 10
+    # Métricas por rota em /metrics (metricas.py); SQL acima deste tempo vai para o log (0 desliga)
+    app.config['METRICAS_ATIVAS'] = True
+    app.config['METRICAS_SQL_LENTA_MS'] = 0
+    # Usuário logado lido da sessão assinada (sem consulta ao banco por requisição).
+    # Desligado: o Flask-Login carrega o Usuario do banco em toda requisição.
+    app.config['USUARIO_NA_SESSAO'] = True
+    # /vendas/finalizar_lote: vendas aceitas por requisição e gravadas por transação
+    app.config['VENDAS_LOTE_MAXIMO'] = 500
+    app.config['VENDAS_LOTE_POR_COMMIT'] = 100
+    # Número das vendas: 'global' (1, 2, 3...), 'dia' (20261017-0001) ou 'caixa' (<movimento>-0001)
+    app.config['NUMERACAO_VENDAS'] = 'global'
+    # Servidor de produção (python -m pdv serve): endereço, processos, threads por
+    # processo e segundos que o desligamento espera as requisições em andamento
+    app.config['SERVIDOR_HOST'] = '0.0.0.0'
+    app.config['SERVIDOR_PORTA'] = 5000
+    app.config['SERVIDOR_WORKERS'] = os.cpu_count() or 1
+    app.config['SERVIDOR_THREADS'] = 8
+    app.config['SERVIDOR_ENCERRAMENTO_SEGUNDOS'] = 30
+    # Dashboards em tempo real (SSE) por processo: cada um ocupa uma thread do
+    # servidor enquanto aberto. Acima do limite, o dashboard consulta
+    # /dashboard/resumo a cada DASHBOARD_INTERVALO_CONSULTA segundos
+    app.config['DASHBOARD_FLUXOS_MAXIMO'] = 2
+    app.config['DASHBOARD_INTERVALO_CONSULTA'] = 20
+    # PDV_CONFIG (JSON {"CHAVE": valor}, montado por python -m pdv serve -c) altera
+    # as configurações acima antes de o banco, as métricas e os backups as lerem
+    for chave, valor in json.loads(os.environ.get('PDV_CONFIG') or '{}').items():
+        if chave not in app.config:
+            raise ValueError(f'Configuração desconhecida: {chave}')
+        app.config[chave] = valor
     
     # --- CONFIGURAÇÕES DE UPLOAD ---
     # Caminho absoluto para salvar os arquivos
@@ -57,6 +112,8 @@ def create_app():
 
     # Inicializações
     db.init_app(app)
+    configurar_sqlite(app)
+    metricas.instalar(app)
     
     return app
 
@@ -72,6 +129,8 @@ login_manager.login_message = 'Por favor, faça login para acessar esta página.
 @login_manager.user_loader
 def load_user(user_id):
     """Carrega o usuário a partir do ID na sessão"""
+    if app.config['USUARIO_NA_SESSAO']:
+        return carregar_usuario(int(user_id))
     # CORREÇÃO: Usando a nova sintaxe do SQLAlchemy
     return db.session.get(Usuario, int(user_id))
 
@@ -114,18 +173,56 @@ def _get_int_val(key, default=0):
 # FUNÇÃO AUXILIAR PARA VERIFICAR CAIXA ABERTO
 # =============================================================================
 
+# --- CACHE DO ESTADO DO CAIXA ---
+# "Caixa aberto?" é perguntado em toda página (inject_context) e em cada leitura
+# do scanner. O movimento fica memorizado na requisição (flask.g) e o ID dele,
+# por usuário, por alguns segundos; abrir_caixa/fechar_caixa atualizam na hora.
+# Só "aberto" é aproveitado do cache: com vários workers o caixa pode ter sido
+# aberto em outro processo (e um caixa fechado em outro é recusado ao gravar).
+CACHE_CAIXA_SEGUNDOS = 15
+_cache_caixas = {}  # usuario_id -> (expira_em, movimento_id ou None)
+_cache_caixas_lock = threading.Lock()
+
 def get_caixa_aberto():
-    """Retorna se o caixa está aberto para o usuário atual"""
+    """Retorna se o caixa está aberto para o usuário atual (uma consulta por requisição)"""
     if not current_user.is_authenticated:
         return False, None
     
-    movimento_atual = MovimentoCaixa.query.filter_by(
-        usuario_id=current_user.id, 
-        status='aberto'
-    ).first()
+    if '_movimento_aberto' not in g:
+        g._movimento_aberto = MovimentoCaixa.query.filter_by(
+            usuario_id=current_user.id, 
+            status='aberto'
+        ).first()
+        _guardar_caixa_cache(current_user.id, g._movimento_aberto.id if g._movimento_aberto else None)
     
+    movimento_atual = g._movimento_aberto
     return movimento_atual is not None, movimento_atual
 
+def caixa_aberto_id():
+    """
+    ID do movimento de caixa aberto do usuário atual (ou None).
+    Lido do cache por usuário: sem consulta ao banco enquanto o cache for válido.
+    """
+    if not current_user.is_authenticated:
+        return None
+
+    with _cache_caixas_lock:
+        item = _cache_caixas.get(current_user.id)
+    if item and item[1] is not None and item[0] > monotonic():
+        return item[1]
+
+    caixa_aberto, movimento_atual = get_caixa_aberto()
+    return movimento_atual.id if caixa_aberto else None
+
+def _guardar_caixa_cache(usuario_id, movimento_id):
+    with _cache_caixas_lock:
+        _cache_caixas[usuario_id] = (monotonic() + CACHE_CAIXA_SEGUNDOS, movimento_id)
+
+def atualizar_cache_caixa(usuario_id, movimento_id):
+    """Chamado após abrir/fechar o caixa (depois do commit): o novo estado vale na hora"""
+    _guardar_caixa_cache(usuario_id, movimento_id)
+    g.pop('_movimento_aberto', None)
+
 # =============================================================================
 # ROTAS DE AUTENTICAÇÃO
 # =============================================================================
@@ -162,6 +259,8 @@ def login():
         # Verifica se usuário existe e senha está correta
         if usuario and usuario.check_senha(senha):
             login_user(usuario)
+            if app.config['USUARIO_NA_SESSAO']:
+                guardar_na_sessao(usuario)
             
             # Redireciona para a página que tentava acessar ou dashboard/vendas
             next_page = request.args.get('next')
@@ -182,6 +281,7 @@ def login():
 def logout():
     """Rota para logout do usuário"""
     logout_user()
+    session.pop(CHAVE_SESSAO, None)
     flash('Logout realizado com sucesso!', 'info')
     return redirect(url_for('login'))
 
@@ -215,6 +315,86 @@ def inject_context():
 # =============================================================================
 #           INÍCIO DA ROTA MODIFICADA (DASHBOARD) - AJUSTE PARA MULTIPAGAMENTO
 # =============================================================================
+def _consulta_status_caixas(usuario_id=None):
+    """
+    Último movimento de caixa de cada operador ativo (ou só de 'usuario_id'),
+    com o total em dinheiro recebido nele, em UMA consulta: o último movimento
+    vem de uma subconsulta correlacionada (índice usuario_id + data_abertura).
+    """
+    ultimo_id = db.session.query(MovimentoCaixa.id).filter(
+        MovimentoCaixa.usuario_id == Usuario.id
+    ).order_by(MovimentoCaixa.data_abertura.desc()).limit(1).correlate(Usuario).scalar_subquery()
+
+    consulta = db.session.query(
+        Usuario.id.label('usuario_id'),
+        Usuario.nome,
+        MovimentoCaixa.status,
+        MovimentoCaixa.data_abertura,
+        MovimentoCaixa.data_fechamento,
+        MovimentoCaixa.saldo_inicial,
+        MovimentoCaixa.saldo_final,
+        MovimentoCaixa.total_dinheiro
+    ).outerjoin(
+        MovimentoCaixa, MovimentoCaixa.id == ultimo_id
+    ).filter(
+        Usuario.perfil.in_(['caixa', 'admin']),
+        Usuario.ativo == True
+    )
+    if usuario_id is not None:
+        consulta = consulta.filter(Usuario.id == usuario_id)
+    # A consulta (não a lista) para o planos_consulta.py verificar o mesmo SQL
+    return consulta.order_by(Usuario.nome)
+
+def _status_caixa(linha):
+    """Monta o item do painel 'Monitoramento de Caixas' a partir de uma linha de _consulta_status_caixas()"""
+    if linha.status is None:
+        # Operador nunca abriu um caixa
+        return {
+            'usuario_id': linha.usuario_id,
+            'nome': linha.nome,
+            'status': 'nunca_aberto',
+            'data': None,
+            'diferenca': 0.0,
+            'saldo_esperado': 0.0,
+            'saldo_informado': 0.0,
+            'mostrar_diferenca': False
+        }
+
+    diferenca = 0.0
+    saldo_esperado = 0.0
+    saldo_final_informado = 0.0
+    mostrar_diferenca = False
+    
+    # Se o último movimento está fechado, calcula a diferença
+    if linha.status == 'fechado':
+        # Saldo esperado (Dinheiro) = Saldo Inicial + Pagamentos em Dinheiro do período
+        saldo_esperado = (linha.saldo_inicial or 0) + linha.total_dinheiro
+        saldo_final_informado = linha.saldo_final or 0
+        diferenca = saldo_final_informado - saldo_esperado
+
+        # Verifica se a diferença é (praticamente) zero.
+        if abs(diferenca) > 0.001:
+            mostrar_diferenca = True
+    
+    return {
+        'usuario_id': linha.usuario_id,
+        'nome': linha.nome,
+        'status': linha.status,
+        'data': linha.data_fechamento if linha.status == 'fechado' else linha.data_abertura,
+        'diferenca': diferenca,
+        'saldo_esperado': saldo_esperado, 
+        'saldo_informado': saldo_final_informado,
+        'mostrar_diferenca': mostrar_diferenca
+    }
+
+def _publicar_status_caixa(usuario_id):
+    """Envia aos dashboards abertos o novo item do painel do operador (após abrir/fechar o caixa)"""
+    for linha in _consulta_status_caixas(usuario_id):
+        publicar('caixa', {
+            'usuario_id': usuario_id,
+            'html': render_template('_status_operador.html', op_status=_status_caixa(linha), usuario_logado_id=None)
+        })
+
 @app.route('/dashboard')
 @login_required
 def dashboard():
@@ -228,20 +408,13 @@ def dashboard():
     # Estatísticas para o dashboard
     hoje = date.today()
     
-    # Total vendido hoje (Valor total da Venda é uma property calculada em models.py)
-    # Usando func.date para comparar apenas a data
-    vendas_hoje = Venda.query.filter(
-        db.func.date(Venda.data_venda) == hoje,
-        Venda.status == 'finalizada'
-    ).all()
-    # Usa a propriedade 'valor_total' do modelo Venda
-    total_hoje = sum(venda.valor_total for venda in vendas_hoje) 
+    # Total vendido hoje: lido do resumo diário (uma linha por operador)
+    total_hoje = db.session.query(func.coalesce(func.sum(ResumoVendaDia.valor_total), 0.0)).filter(
+        ResumoVendaDia.dia == hoje
+    ).scalar()
     
-    # Quantidade de produtos com estoque baixo
-    estoque_baixo = Produto.query.filter(
-        Produto.estoque_atual <= Produto.estoque_minimo,
-        Produto.ativo == True
-    ).count()
+    # Quantidade de produtos com estoque baixo (índice em memória do PDV)
+    estoque_baixo = catalogo.contar_estoque_baixo()
     
     # Total de produtos ativos
     total_produtos = Produto.query.filter_by(ativo=True).count()
@@ -256,68 +429,8 @@ def dashboard():
         MovimentoCaixa.data_abertura < hoje_meia_noite_local
     ).order_by(MovimentoCaixa.data_abertura.desc()).all()
     
-    # Status de todos os caixas
-    status_caixas = []
-    operadores = Usuario.query.filter(
-        Usuario.perfil.in_(['caixa', 'admin']),
-        Usuario.ativo == True
-    ).order_by(Usuario.nome).all()
-
-    for op in operadores:
-        ultimo_movimento = MovimentoCaixa.query.filter_by(usuario_id=op.id).order_by(MovimentoCaixa.data_abertura.desc()).first()
-        
-        if ultimo_movimento:
-            diferenca = 0.0
-            saldo_esperado = 0.0
-            saldo_final_informado = 0.0
-            mostrar_diferenca = False
-            
-            # Se o último movimento está fechado, calcula a diferença
-            if ultimo_movimento.status == 'fechado':
-                
-                # 1. Soma APENAS os pagamentos em DINHEIRO daquele período usando o novo modelo
-                total_dinheiro_movimento = db.session.query(func.sum(PagamentoVenda.valor)).join(Venda).filter(
-                    Venda.usuario_id == op.id,
-                    Venda.status == 'finalizada',
-                    PagamentoVenda.forma_pagamento == 'dinheiro',
-                    PagamentoVenda.data_pagamento >= ultimo_movimento.data_abertura,
-                    PagamentoVenda.data_pagamento <= ultimo_movimento.data_fechamento 
-                ).scalar() or 0.0
-                
-                # 2. Calcula o saldo esperado (Dinheiro)
-                #    (Saldo Inicial + Pagamentos em Dinheiro)
-                saldo_esperado = (ultimo_movimento.saldo_inicial or 0) + total_dinheiro_movimento
-
-                # Pega o saldo que foi informado no fechamento
-                saldo_final_informado = ultimo_movimento.saldo_final or 0
-                
-                # Calcula a diferença
-                diferenca = saldo_final_informado - saldo_esperado
-
-                # Verifica se a diferença é (praticamente) zero.
-                if abs(diferenca) > 0.001:
-                    mostrar_diferenca = True
-            
-            status_caixas.append({
-                'nome': op.nome,
-                'status': ultimo_movimento.status,
-                'data': ultimo_movimento.data_fechamento if ultimo_movimento.status == 'fechado' else ultimo_movimento.data_abertura,
-                'diferenca': diferenca,
-                'saldo_esperado': saldo_esperado, 
-                'saldo_informado': saldo_final_informado,
-                'mostrar_diferenca': mostrar_diferenca
-            })
-        else:
-            # Operador nunca abriu um caixa
-            status_caixas.append({
-                'nome': op.nome,
-                'status': 'nunca_aberto',
-                'data': None,
-                'diferenca': 0.0,
-                'saldo_esperado': 0.0,
-                'saldo_informado': 0.0,
-                'mostrar_diferenca': False
-            })
+    # Status de todos os caixas: uma única consulta para todos os operadores
+    status_caixas = [_status_caixa(linha) for linha in _consulta_status_caixas()]
 
     return render_template('dashboard.html',
                          total_hoje=total_hoje,
@@ -325,39 +438,103 @@ def dashboard():
                          total_produtos=total_produtos,
                          movimento_atual=movimento_atual,
                          caixas_esquecidos=caixas_esquecidos,
-                         status_caixas=status_caixas)
+                         status_caixas=status_caixas,
+                         hoje=hoje,
+                         intervalo_consulta=app.config['DASHBOARD_INTERVALO_CONSULTA'])
 # =============================================================================
 #           FIM DA ROTA MODIFICADA (DASHBOARD)
 # =============================================================================
 
+@app.route('/dashboard/stream')
+@login_required
+def dashboard_stream():
+    """
+    Atualizações do dashboard em tempo real (Server-Sent Events): vendas,
+    cancelamentos e abertura/fechamento de caixas, publicados após o commit.
+    """
+    if not current_user.is_admin():
+        return jsonify({'error': 'Acesso não autorizado!'}), 403
+
+    # Cada fluxo prende uma thread do servidor: acima do limite, o dashboard
+    # recebe 503 (o EventSource não reconecta) e passa a usar /dashboard/resumo
+    fila = assinar(app.config['DASHBOARD_FLUXOS_MAXIMO'])
+    if fila is None:
+        return jsonify({'error': 'Limite de dashboards em tempo real atingido.'}), 503
+
+    # O fluxo não usa o banco: a conexão não fica presa enquanto a tela estiver aberta
+    return Response(Fluxo(fila), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/dashboard/resumo')
+@login_required
+def dashboard_resumo():
+    """
+    Os mesmos dados dos eventos do dashboard, de uma vez (JSON): usado no
+    lugar de /dashboard/stream quando o limite de fluxos foi atingido.
+    """
+    if not current_user.is_admin():
+        return jsonify({'error': 'Acesso não autorizado!'}), 403
+
+    hoje = date.today()
+    total_hoje = db.session.query(func.coalesce(func.sum(ResumoVendaDia.valor_total), 0.0)).filter(
+        ResumoVendaDia.dia == hoje
+    ).scalar()
+    return jsonify({
+        'dia': hoje.isoformat(),
+        'total_hoje': total_hoje,
+        'estoque_baixo': catalogo.contar_estoque_baixo(),
+        'caixas': [{
+            'usuario_id': linha.usuario_id,
+            'html': render_template('_status_operador.html', op_status=_status_caixa(linha), usuario_logado_id=None)
+        } for linha in _consulta_status_caixas()],
+    })
+
+@app.route('/metrics')
+@login_required
+def metrics():
+    """Métricas de desempenho por rota (latência, consultas SQL) no formato do Prometheus"""
+    if not current_user.is_admin():
+        return Response('Acesso não autorizado.\n', status=403, mimetype='text/plain')
+    return Response(metricas.texto_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/backup_database')
 @login_required
 def backup_database():
     """
-    Permite que o administrador baixe o arquivo do banco de dados.
+    Gera um backup do banco de dados em segundo plano (cópia consistente,
+    sem parar as vendas) e leva à página que oferece o download.
     """
     if not current_user.is_admin():
         flash('Acesso não autorizado!', 'danger')
         return redirect(url_for('dashboard'))
 
-    try:
-        # O banco de dados está na pasta 'instance'
-        db_path = os.path.join(app.instance_path, 'loja.db')
-        
-        if not os.path.exists(db_path):
-            flash('Erro: Arquivo do banco de dados não encontrado.', 'danger')
-            return redirect(url_for('dashboard'))
+    tarefa_id = enfileirar('backup_banco', current_user.id, tarefa_backup)
+    flash('Backup iniciado. O arquivo ficará disponível para download abaixo.', 'info')
+    return redirect(url_for('tarefa_acompanhar', tarefa_id=tarefa_id))
 
-        # Gera um nome de arquivo com a data
-        data_hoje = datetime.now().strftime('%Y-%m-%d_%H%M')
-        nome_arquivo_backup = f'backup_loja_{data_hoje}.db'
+@app.route('/backups')
+@login_required
+def backups():
+    """Lista dos backups guardados (automáticos e gerados pelo dashboard)"""
+    if not current_user.is_admin():
+        flash('Acesso não autorizado!', 'danger')
+        return redirect(url_for('dashboard'))
 
-        return send_file(db_path, as_attachment=True, download_name=nome_arquivo_backup)
+    return render_template('backups.html',
+                           lista_backups=listar_backups(),
+                           intervalo_horas=app.config['BACKUP_INTERVALO_HORAS'],
+                           manter=app.config['BACKUP_MANTER'])
 
-    except Exception as e:
-        flash(f'Erro ao gerar o backup: {e}', 'danger')
+@app.route('/backups/<nome>')
+@login_required
+def backup_arquivo(nome):
+    """Baixa um backup guardado (enviado em partes, sem carregar o arquivo na memória)"""
+    if not current_user.is_admin():
+        flash('Acesso não autorizado!', 'danger')
         return redirect(url_for('dashboard'))
 
+    return send_from_directory(pasta_backups(), nome, as_attachment=True)
+
 
 # =============================================================================
 # ROTAS DO MÓDULO DE CAIXA
@@ -389,6 +566,8 @@ def abrir_caixa():
         
         db.session.add(novo_caixa)
         db.session.commit()
+        atualizar_cache_caixa(current_user.id, novo_caixa.id)
+        _publicar_status_caixa(current_user.id)
         
         flash('Caixa aberto com sucesso!', 'success')
         return redirect(url_for('vendas'))
@@ -396,6 +575,16 @@ def abrir_caixa():
     return render_template('abrir_caixa.html')
 
 
+def _totais_caixa(movimento):
+    """Totais por forma de pagamento do movimento de caixa (fechamento e cupom de fechamento)"""
+    return {
+        'dinheiro': movimento.total_dinheiro,
+        'cartao': movimento.total_cartao,
+        'pix': movimento.total_pix,
+        'outros': movimento.total_outros,
+        'total_geral': movimento.total_geral
+    }
+
 # =============================================================================
 #           INÍCIO DA ROTA MODIFICADA (FECHAR CAIXA) - AJUSTE PARA MULTIPAGAMENTO
 # =============================================================================
@@ -423,16 +612,8 @@ def fechar_caixa():
         # 1. Define o momento exato do fechamento UMA VEZ (em HORA LOCAL)
         momento_fechamento = datetime.now() 
         
-        # 2. Calcula total de vendas para a mensagem (opcional)
-        vendas_periodo_post = Venda.query.filter(
-            Venda.data_venda >= movimento_atual.data_abertura, 
-            Venda.data_venda <= momento_fechamento, 
-            Venda.usuario_id == current_user.id,
-            Venda.status == 'finalizada'
-        ).all()
-        
-        # O valor total da venda agora é uma propriedade calculada
-        total_vendas_geral = sum(venda.valor_total for venda in vendas_periodo_post)
+        # 2. Total de vendas para a mensagem (acumulado no próprio movimento)
+        total_vendas_geral = movimento_atual.valor_vendas
         
         # Atualiza movimento de caixa
         movimento_atual.data_fechamento = momento_fechamento
@@ -440,6 +621,8 @@ def fechar_caixa():
         movimento_atual.status = 'fechado'
         
         db.session.commit()
+        atualizar_cache_caixa(current_user.id, None)
+        _publicar_status_caixa(current_user.id)
         
         flash(f'Caixa fechado com sucesso! Total de vendas: R$ {total_vendas_geral:.2f}', 'success')
         if current_user.is_admin():
@@ -448,60 +631,14 @@ def fechar_caixa():
             return redirect(url_for('vendas'))
     
     # --- LÓGICA DO MÉTODO GET (Apenas para exibir a tela) ---
-    
-    # 1. Query base das vendas no período (abertura local até agora local)
-    query_vendas = Venda.query.filter(
-        Venda.usuario_id == current_user.id,
-        Venda.status == 'finalizada',
-        Venda.data_venda >= movimento_atual.data_abertura,
-        Venda.data_venda <= datetime.now() 
-    )
-    
-    # 2. Total de Vendas (para contagem)
-    total_vendas_count = query_vendas.count()
-
-    # 3. Agrupa os totais por forma de pagamento (usando PagamentoVenda)
-    vendas_agrupadas = db.session.query(
-        PagamentoVenda.forma_pagamento,
-        func.sum(PagamentoVenda.valor).label('total')
-    ).join(Venda).filter(
-        Venda.usuario_id == current_user.id,
-        Venda.status == 'finalizada',
-        PagamentoVenda.data_pagamento >= movimento_atual.data_abertura,
-        PagamentoVenda.data_pagamento <= datetime.now()
-    ).group_by(PagamentoVenda.forma_pagamento).all()
-
-    # Prepara o dicionário de totais
-    totais = {
-        'dinheiro': 0.0,
-        'cartao': 0.0,
-        'pix': 0.0,
-        'total_geral': 0.0
-    }
-    
-    for forma, total in vendas_agrupadas:
-        forma_str = str(forma).lower()
-        
-        # Filtra apenas as formas permitidas no PDV
-        if forma_str in ['dinheiro', 'cartao', 'pix']:
-            totais[forma_str] = float(total or 0.0)
-        
-        # O total geral deve somar todas as formas, mesmo as descontinuadas
-        totais['total_geral'] += float(total or 0.0)
+    # Totais acumulados no movimento a cada venda: nada a percorrer no período
+    totais = _totais_caixa(movimento_atual)
+    if not totais['outros']:
+        del totais['outros']  # Só exibe "Outros" se houver pagamentos em formas descontinuadas
+    total_vendas_count = movimento_atual.qtd_vendas
 
     # O 'saldo_esperado' é o (Saldo Inicial + Vendas em Dinheiro)
     saldo_esperado_dinheiro = (movimento_atual.saldo_inicial or 0) + totais['dinheiro']
-    
-    # Certifica-se que todos os totais importantes existem para o template
-    default_totais = {
-        'dinheiro': 0.0,
-        'cartao': 0.0,
-        'pix': 0.0
-    }
-    # Atualiza com os valores calculados, mantendo as chaves necessárias
-    for key in default_totais.keys():
-        default_totais[key] = totais.get(key, 0.0)
-    default_totais['total_geral'] = totais['total_geral']
 
     return render_template('fechar_caixa.html',
                          caixa_aberto=movimento_atual,
@@ -563,7 +700,8 @@ def produtos_novo():
             categoria=request.form.get('categoria'),
             estoque_atual=_get_int_val('estoque_atual'),
             estoque_minimo=_get_int_val('estoque_minimo'),
-            ativo=True
+            ativo=True,
+            versao=proxima_versao()  # Catálogo dos PDVs: entra na próxima sincronização
             # O model usará datetime.now() para data_criacao
         )
         
@@ -580,6 +718,7 @@ def produtos_novo():
         
         db.session.add(novo_produto)
         db.session.commit()
+        catalogo.atualizar(novo_produto)
         
         flash('Produto criado com sucesso!', 'success')
         return redirect(url_for('produtos'))
@@ -617,8 +756,18 @@ def produtos_editar(id):
         produto.preco_venda = _get_float_val('preco_venda')
         produto.preco_custo = _get_float_val('preco_custo')
         produto.categoria = request.form.get('categoria')
-        produto.estoque_atual = _get_int_val('estoque_atual')
+        # Estoque: aplica a diferença para o valor exibido no formulário sobre o valor
+        # atual do banco (UPDATE relativo): as vendas feitas enquanto o formulário
+        # estava aberto não são desfeitas, e sem alteração o estoque nem é gravado
+        estoque_exibido = request.form.get('estoque_exibido', type=int)
+        if estoque_exibido is None:
+            estoque_exibido = produto.estoque_atual or 0
+        diferenca = _get_int_val('estoque_atual') - estoque_exibido
+        if diferenca:
+            produto.estoque_atual = func.coalesce(Produto.estoque_atual, 0) + diferenca
+            produto.estoque_versao = proxima_versao_estoque()  # Índice dos outros processos
         produto.estoque_minimo = _get_int_val('estoque_minimo')
+        produto.versao = proxima_versao()
         # O model usará datetime.now() para data_atualizacao (onupdate)
 
         # --- Lógica de Upload da Imagem ---
@@ -634,6 +783,7 @@ def produtos_editar(id):
         # -----------------------------------
 
         db.session.commit()
+        catalogo.atualizar(produto)
         flash('Produto atualizado com sucesso!', 'success')
         return redirect(url_for('produtos'))
 
@@ -657,7 +807,9 @@ def produtos_deletar(id):
     try:
         # Em vez de deletar, desativamos
         produto.ativo = False
+        produto.versao = proxima_versao()  # Os PDVs o removem na próxima sincronização
         db.session.commit()
+        catalogo.remover(produto.id)
         flash(f'Produto "{produto.nome}" foi desativado.', 'success')
 
     except Exception as e:
@@ -692,59 +844,18 @@ def produtos_importar():
 
         # Verifica a extensão
         if file and file.filename.endswith('.xlsx'):
-            try:
-                df = pd.read_excel(file)
+            # Modo atualizar: códigos existentes têm preço, custo e estoque atualizados
+            atualizar_existentes = request.form.get('atualizar_existentes') == 'on'
 
-                # Verifica as colunas obrigatórias
-                colunas_necessarias = ['codigo_barras', 'nome', 'preco_venda', 'preco_custo']
-                if not all(col in df.columns for col in colunas_necessarias):
-                    flash(f'Arquivo faltando colunas obrigatórias. Verifique o cabeçalho.', 'danger')
-                    return redirect(url_for('produtos_importar'))
+            # Salva o upload e processa em segundo plano (a requisição volta na hora)
+            tarefa_id = novo_id()
+            caminho = caminho_arquivo(tarefa_id, 'xlsx')
+            file.save(caminho)
+            enfileirar('importacao_produtos', current_user.id, tarefa_importar_produtos,
+                       caminho, atualizar_existentes, tarefa_id=tarefa_id)
 
-                sucessos = 0
-                erros_existentes = 0
-                pulados_vazios = 0
-                
-                # Itera sobre o DataFrame
-                for index, row in df.iterrows():
-                    cod_barras = str(row['codigo_barras'])
-                    
-                    # Pula linha se o código de barras for vazio ou NaN
-                    if not cod_barras or pd.isna(cod_barras) or cod_barras.lower() == 'nan':
-                        pulados_vazios += 1
-                        continue # Pula para a próxima iteração
-
-                    # Verifica se o produto já existe
-                    produto_existente = Produto.query.filter_by(codigo_barras=cod_barras).first()
-                    if produto_existente:
-                        erros_existentes += 1
-                        continue # Pula se o código de barras já existe
-
-                    # Cria o novo produto
-                    novo_produto = Produto(
-                        codigo_barras=cod_barras,
-                        nome=str(row['nome']),
-                        preco_venda=float(row['preco_venda']),
-                        preco_custo=float(row['preco_custo']),
-                        # Colunas opcionais (com valores padrão se não existirem)
-                        estoque_atual=int(row.get('estoque_atual', 0) or 0),
-                        estoque_minimo=int(row.get('estoque_minimo', 0) or 0),
-                        descricao=str(row.get('descricao', '')) if pd.notna(row.get('descricao')) else '',
-                        categoria=str(row.get('categoria', '')) if pd.notna(row.get('categoria')) else '',
-                        ativo=True
-                    )
-                    db.session.add(novo_produto)
-                    sucessos += 1
-                
-                # Se o loop terminar sem erros, commita tudo
-                db.session.commit()
-                flash(f'Importação concluída: {sucessos} produtos cadastrados, {erros_existentes} já existiam, {pulados_vazios} linhas puladas (cód. barras vazio).', 'success')
-                return redirect(url_for('produtos'))
-
-            except Exception as e:
-                db.session.rollback()
-                flash(f'Erro ao processar o arquivo: {e}. Verifique se as colunas e os tipos de dados (ex: números) estão corretos.', 'danger')
-                return redirect(url_for('produtos_importar'))
+            flash('Importação iniciada. Acompanhe o andamento abaixo.', 'info')
+            return redirect(url_for('tarefa_acompanhar', tarefa_id=tarefa_id))
 
         else:
             flash('Formato de arquivo inválido. Por favor, envie um arquivo .xlsx', 'danger')
@@ -809,6 +920,7 @@ def usuarios_novo():
         
         db.session.add(novo_usuario)
         db.session.commit()
+        cache_usuarios.invalidar()
         
         flash('Usuário criado com sucesso!', 'success')
         return redirect(url_for('usuarios'))
@@ -851,7 +963,9 @@ def usuarios_editar(id):
         else:
             flash('Usuário atualizado com sucesso (senha mantida)!', 'success')
 
+        usuario_alterado(usuario)
         db.session.commit()
+        cache_usuarios.invalidar()
         return redirect(url_for('usuarios'))
 
     # Método GET: exibe o formulário preenchido com dados do usuário
@@ -879,7 +993,9 @@ def usuarios_deletar(id):
     try:
         # Em vez de deletar, é uma boa prática desativar
         usuario.ativo = False
+        usuario_alterado(usuario)
         db.session.commit()
+        cache_usuarios.invalidar()
         flash(f'Usuário "{usuario.nome}" foi desativado.', 'success')
 
     except Exception as e:
@@ -932,8 +1048,36 @@ def get_filtro_datas(request):
         
     return data_inicio_str, data_fim_str, data_inicio, data_fim
 
+def _produtos_mais_vendidos_por_forma(data_inicio, data_fim, caixa_id, forma_pgto):
+    """Top 10 produtos das vendas finalizadas que CONTÊM a forma de pagamento (agregado dos itens)"""
+    return _consulta_produtos_por_forma(data_inicio, data_fim, caixa_id, forma_pgto).all()
+
+def _consulta_produtos_por_forma(data_inicio, data_fim, caixa_id, forma_pgto):
+    """Consulta de _produtos_mais_vendidos_por_forma() (também verificada pelo planos_consulta.py)"""
+    query_produtos = db.session.query(
+        Produto.nome,
+        Produto.codigo_barras,
+        db.func.sum(ItemVenda.quantidade).label('total_quantidade'),
+        db.func.sum(ItemVenda.subtotal).label('total_arrecadado')
+    ).join(ItemVenda, ItemVenda.produto_id == Produto.id)\
+     .join(Venda, Venda.id == ItemVenda.venda_id)\
+     .filter(
+        Venda.status == 'finalizada', # <-- APENAS FINALIZADAS
+        Venda.data_venda.between(data_inicio, data_fim),
+        Venda.pagamentos.any(PagamentoVenda.forma_pagamento == forma_pgto)
+     )
+    
+    # Aplica filtro de caixa
+    if caixa_id > 0:
+        query_produtos = query_produtos.filter(Venda.usuario_id == caixa_id)
+
+    return query_produtos.group_by(Produto.id)\
+                         .order_by(db.func.sum(ItemVenda.quantidade).desc())\
+                         .limit(10)
+
 @app.route('/relatorios')
 @login_required
+@somente_leitura
 def relatorios():
     """Rota para relatórios (Apenas Admin)"""
     if not current_user.is_admin():
@@ -956,72 +1100,66 @@ def relatorios():
     caixas = Usuario.query.order_by(Usuario.nome).all()
     nome_filtro = "Geral (Todos os Caixas)"
 
-    # Query base para vendas finalizadas no período
-    base_query = Venda.query.filter(
-        Venda.status == 'finalizada',
-        Venda.data_venda.between(data_inicio, data_fim)
-    )
-
-    # Aplica filtro de caixa se um específico foi selecionado
     if caixa_selecionado > 0:
-        base_query = base_query.filter(Venda.usuario_id == caixa_selecionado)
         usuario_filtro = db.session.get(Usuario, caixa_selecionado)
         if usuario_filtro:
             nome_filtro = f"Caixa: {usuario_filtro.nome}"
 
-    # Query para total vendido e número de vendas
-    vendas_filtradas = base_query.all()
-    total_vendido = sum(v.valor_total for v in vendas_filtradas)
-    num_vendas = len(vendas_filtradas)
+    # --- 1. Totais e pagamentos: lidos dos resumos diários (O(dias), não O(vendas)) ---
+    dia_inicio, dia_fim = data_inicio.date(), data_fim.date()
+
+    query_totais = db.session.query(
+        func.coalesce(func.sum(ResumoVendaDia.num_vendas), 0),
+        func.coalesce(func.sum(ResumoVendaDia.valor_total), 0.0)
+    ).filter(ResumoVendaDia.dia.between(dia_inicio, dia_fim))
+
+    # Aplica filtro de caixa se um específico foi selecionado
+    if caixa_selecionado > 0:
+        query_totais = query_totais.filter(ResumoVendaDia.usuario_id == caixa_selecionado)
+
+    num_vendas, total_vendido = query_totais.one()
     ticket_medio = (total_vendido / num_vendas) if num_vendas > 0 else 0
 
     # Query para pagamentos (para aplicar o filtro de forma de pagamento)
     query_pagamentos_agrupados = db.session.query(
-        PagamentoVenda.forma_pagamento,
-        func.sum(PagamentoVenda.valor).label('total_pago')
-    ).join(Venda).filter(
-        Venda.status == 'finalizada',
-        Venda.data_venda.between(data_inicio, data_fim)
-    )
+        ResumoPagamentoDia.forma_pagamento,
+        func.sum(ResumoPagamentoDia.valor).label('total_pago')
+    ).filter(ResumoPagamentoDia.dia.between(dia_inicio, dia_fim))
     
     # Aplica filtro de caixa para pagamentos
     if caixa_selecionado > 0:
-        query_pagamentos_agrupados = query_pagamentos_agrupados.filter(Venda.usuario_id == caixa_selecionado)
+        query_pagamentos_agrupados = query_pagamentos_agrupados.filter(ResumoPagamentoDia.usuario_id == caixa_selecionado)
 
     # Aplica filtro de forma de pagamento para o resumo (se não for 'todos')
     if forma_pgto_selecionada != 'todos':
-        query_pagamentos_agrupados = query_pagamentos_agrupados.filter(PagamentoVenda.forma_pagamento == forma_pgto_selecionada)
-
+        query_pagamentos_agrupados = query_pagamentos_agrupados.filter(ResumoPagamentoDia.forma_pagamento == forma_pgto_selecionada)
 
-    pagamentos_agrupados = query_pagamentos_agrupados.group_by(PagamentoVenda.forma_pagamento).all()
+    # Formas que zeraram (ex: pagamento corrigido para outra forma) não aparecem
+    pagamentos_agrupados = query_pagamentos_agrupados.group_by(ResumoPagamentoDia.forma_pagamento)\
+                                                     .having(func.abs(func.sum(ResumoPagamentoDia.valor)) > 0.001).all()
 
     # --- 2. Consulta de Produtos Mais Vendidos (APENAS VENDAS FINALIZADAS) ---
-    query_produtos = db.session.query(
-        Produto.nome,
-        Produto.codigo_barras,
-        db.func.sum(ItemVenda.quantidade).label('total_quantidade'),
-        db.func.sum(ItemVenda.subtotal).label('total_arrecadado')
-    ).join(ItemVenda, ItemVenda.produto_id == Produto.id)\
-     .join(Venda, Venda.id == ItemVenda.venda_id)\
-     .filter(
-        Venda.status == 'finalizada', # <-- APENAS FINALIZADAS
-        Venda.data_venda.between(data_inicio, data_fim)
-     )
-    
-    # Aplica filtro de caixa
-    if caixa_selecionado > 0:
-        query_produtos = query_produtos.filter(Venda.usuario_id == caixa_selecionado)
-
-    # Aplica filtro de forma de pagamento (se a venda CONTÉM o pagamento)
-    if forma_pgto_selecionada != 'todos':
-        query_produtos = query_produtos.join(PagamentoVenda, PagamentoVenda.venda_id == Venda.id)\
-                                       .filter(PagamentoVenda.forma_pagamento == forma_pgto_selecionada)
-
-
-    produtos_vendidos = query_produtos.group_by(Produto.id)\
-                                      .order_by(db.func.sum(ItemVenda.quantidade).desc())\
-                                      .limit(10)\
-                                      .all()
+    if forma_pgto_selecionada == 'todos':
+        # Sem filtro de pagamento: resumo diário por produto
+        query_produtos = db.session.query(
+            Produto.nome,
+            Produto.codigo_barras,
+            func.sum(ResumoProdutoDia.quantidade).label('total_quantidade'),
+            func.sum(ResumoProdutoDia.valor).label('total_arrecadado')
+        ).join(ResumoProdutoDia, ResumoProdutoDia.produto_id == Produto.id)\
+         .filter(ResumoProdutoDia.dia.between(dia_inicio, dia_fim))
+
+        if caixa_selecionado > 0:
+            query_produtos = query_produtos.filter(ResumoProdutoDia.usuario_id == caixa_selecionado)
+
+        produtos_vendidos = query_produtos.group_by(Produto.id)\
+                                          .having(func.sum(ResumoProdutoDia.quantidade) > 0)\
+                                          .order_by(func.sum(ResumoProdutoDia.quantidade).desc())\
+                                          .limit(10)\
+                                          .all()
+    else:
+        # "Vendas que CONTÊM a forma" não está no resumo: agrega os itens das vendas
+        produtos_vendidos = _produtos_mais_vendidos_por_forma(data_inicio, data_fim, caixa_selecionado, forma_pgto_selecionada)
 
     # --- 3. Consulta de Itens Vendidos (Detalhe) (TODOS OS STATUS) ---
     query_itens = db.session.query(
@@ -1069,6 +1207,7 @@ def relatorios():
 # =============================================================================
 @app.route('/relatorios/recebimentos_consolidados')
 @login_required
+@somente_leitura
 def relatorio_recebimentos_consolidados():
     """
     Nova Rota para relatório consolidado de recebimentos por Forma de Pagamento e por Caixa (Operador).
@@ -1084,18 +1223,15 @@ def relatorio_recebimentos_consolidados():
     caixas = Usuario.query.order_by(Usuario.nome).all()
     
     # 3. Consulta principal: Agrupar por FORMA DE PAGAMENTO e por OPERADOR
-    # O SQLalchemy precisa que a coluna PagamentoVenda.forma_pagamento seja acessível
-    # É necessário fazer 3 JOINS: PagamentoVenda -> Venda -> Usuario
-    
+    # Lida do resumo diário de pagamentos (O(dias x operadores x formas)),
+    # com JOIN apenas em Usuario para o nome do operador.
     query_recebimentos = db.session.query(
-        PagamentoVenda.forma_pagamento,
+        ResumoPagamentoDia.forma_pagamento,
         Usuario.nome.label('operador_nome'),
-        func.sum(PagamentoVenda.valor).label('total_pago')
-    ).join(Venda, Venda.id == PagamentoVenda.venda_id)\
-     .join(Usuario, Usuario.id == Venda.usuario_id)\
+        func.sum(ResumoPagamentoDia.valor).label('total_pago')
+    ).join(Usuario, Usuario.id == ResumoPagamentoDia.usuario_id)\
      .filter(
-        Venda.status == 'finalizada', # Apenas vendas finalizadas
-        PagamentoVenda.data_pagamento.between(data_inicio, data_fim)
+        ResumoPagamentoDia.dia.between(data_inicio.date(), data_fim.date())
      )
      
     # Aplica filtro de caixa (se selecionado)
@@ -1107,13 +1243,15 @@ def relatorio_recebimentos_consolidados():
         caixa_selecionado = 0
         
     if caixa_selecionado > 0:
-        query_recebimentos = query_recebimentos.filter(Venda.usuario_id == caixa_selecionado)
+        query_recebimentos = query_recebimentos.filter(ResumoPagamentoDia.usuario_id == caixa_selecionado)
     
     # Aplica agrupamento
     query_recebimentos = query_recebimentos.group_by(
-        PagamentoVenda.forma_pagamento, 
+        ResumoPagamentoDia.forma_pagamento, 
         Usuario.nome
-    ).order_by(Usuario.nome, PagamentoVenda.forma_pagamento).all()
+    ).having(
+        func.abs(func.sum(ResumoPagamentoDia.valor)) > 0.001
+    ).order_by(Usuario.nome, ResumoPagamentoDia.forma_pagamento).all()
 
 
     # 4. Processar resultados para o template (Calculando Totais e Agrupando por Operador)
@@ -1198,6 +1336,7 @@ def cupom_venda(venda_id):
 # =============================================================================
 @app.route('/relatorio_cupons')
 @login_required
+@somente_leitura
 def relatorio_cupons():
     """Rota para relatório de cupons/vendas individuais (Apenas Admin)"""
     if not current_user.is_admin():
@@ -1221,63 +1360,24 @@ def relatorio_cupons():
     # --- 5. Busca caixas e nome do filtro ---
     caixas = Usuario.query.order_by(Usuario.nome).all()
     nome_filtro = "Geral (Todos os Caixas)"
-
-    # --- 6. Consulta Principal (Vendas/Cupons) ---
-    # Começamos com a query base, já filtrando por status 'finalizada' e datas
-    base_query = db.session.query(Venda).join(Usuario).filter(
-        Venda.status == 'finalizada',
-        Venda.data_venda.between(data_inicio, data_fim)
-    )
-
-    # Aplica filtro de caixa se um específico foi selecionado
     if caixa_selecionado > 0:
-        base_query = base_query.filter(Venda.usuario_id == caixa_selecionado)
         usuario_filtro = db.session.get(Usuario, caixa_selecionado)
         if usuario_filtro:
             nome_filtro = f"Caixa: {usuario_filtro.nome}"
 
-    # Aplica filtro de forma de pagamento (se a venda CONTÉM o pagamento)
-    if forma_pgto_selecionada != 'todos':
-        # Faz um JOIN com PagamentoVenda para filtrar as vendas que têm aquele pagamento
-        base_query = base_query.join(PagamentoVenda, PagamentoVenda.venda_id == Venda.id)\
-                               .filter(PagamentoVenda.forma_pagamento == forma_pgto_selecionada)
-
-
-    # Executa a query para obter a lista de vendas (cupons)
-    vendas_lista = base_query.order_by(Venda.data_venda.desc()).all()
-    
-    # CORREÇÃO DE ERRO: Serialização explícita para evitar Undefined/Não-serializáveis no template.
-    vendas_lista_serializada = []
-    for venda in vendas_lista:
-        # Serializa os pagamentos aninhados
-        pagamentos_serializados = []
-        for p in venda.pagamentos:
-            pagamentos_serializados.append({
-                'forma': str(p.forma_pagamento),
-                'valor': float(p.valor or 0.0),
-                'data': p.data_pagamento.strftime('%Y-%m-%d %H:%M:%S') if p.data_pagamento else None
-            })
+    # --- 6. Primeira página dos cupons (as demais vêm de /api/relatorio_cupons) ---
+    filtros = _filtros_cupons(data_inicio, data_fim, caixa_selecionado, forma_pgto_selecionada)
+    vendas_lista, proximo = _pagina_cupons(filtros)
 
-        vendas_lista_serializada.append({
-            'id': venda.id,
-            'numero_venda': venda.numero_venda,
-            # Garante que data_venda seja string para serialização JSON
-            'data_venda': venda.data_venda.strftime('%Y-%m-%d %H:%M:%S'), 
-            'status': str(venda.status),
-            'operador': venda.operador.nome,
-            'valor_total': float(venda.valor_total),
-            'valor_pago': float(venda.valor_pago),
-            'troco': float(venda.troco),
-            'pagamentos': pagamentos_serializados,
-        })
-    # FIM CORREÇÃO DE ERRO
-    
-    # Calcula o total geral dos cupons filtrados (usando a propriedade dinâmica valor_total)
-    total_geral_cupons = sum(v.valor_total for v in vendas_lista)
+    # Total geral e quantidade de cupons filtrados (uma consulta agregada)
+    num_cupons, total_geral_cupons = db.session.query(
+        func.count(Venda.id), func.coalesce(func.sum(Venda.valor_total), 0.0)
+    ).filter(*filtros).one()
 
     return render_template('relatorio_cupons.html',
                          vendas_lista=vendas_lista,
-                         vendas_lista_serializada=vendas_lista_serializada, # Variável serializada para JS
+                         proximo=proximo,
+                         num_cupons=num_cupons,
                          total_geral_cupons=total_geral_cupons,
                          data_inicio=data_inicio_str,
                          data_fim=data_fim_str,
@@ -1286,6 +1386,114 @@ def relatorio_cupons():
                          nome_filtro=nome_filtro,
                          forma_pgto_selecionada=forma_pgto_selecionada
                          )
+
+@app.route('/api/relatorio_cupons')
+@login_required
+@somente_leitura
+def api_relatorio_cupons():
+    """
+    Próxima página do relatório de cupons (carregamento incremental).
+    Recebe os mesmos filtros da página e o cursor 'apos' devolvido na página anterior.
+    """
+    if not current_user.is_admin():
+        return jsonify({'error': 'Acesso não autorizado!'}), 403
+
+    data_inicio_str, data_fim_str, data_inicio, data_fim = get_filtro_datas(request)
+    try:
+        caixa_selecionado = int(request.args.get('caixa_id', '0'))
+    except ValueError:
+        caixa_selecionado = 0
+    forma_pgto_selecionada = request.args.get('forma_pgto', 'todos')
+
+    try:
+        cursor = _ler_cursor_cupons(request.args.get('apos'))
+    except ValueError:
+        return jsonify({'error': 'Cursor de paginação inválido.'}), 400
+
+    if cursor is not None:
+        # A data do cursor vira o limite superior do período (faixa do índice)
+        data_fim = min(data_fim, cursor[0])
+
+    filtros = _filtros_cupons(data_inicio, data_fim, caixa_selecionado, forma_pgto_selecionada)
+    vendas_lista, proximo = _pagina_cupons(filtros, cursor)
+
+    return jsonify({
+        'vendas': [{
+            'id': venda.id,
+            'numero_venda': venda.numero_venda,
+            'data_venda': venda.data_venda.strftime('%Y-%m-%d %H:%M:%S'),
+            'status': str(venda.status),
+            'operador': venda.operador.nome,
+            'valor_total': float(venda.valor_total),
+            'valor_pago': float(venda.valor_pago),
+            'troco': float(venda.troco),
+            'num_itens': venda.num_itens,
+            'pagamentos': [{
+                'forma': str(p.forma_pagamento),
+                'valor': float(p.valor or 0.0),
+                'data': p.data_pagamento.strftime('%Y-%m-%d %H:%M:%S') if p.data_pagamento else None
+            } for p in venda.pagamentos],
+        } for venda in vendas_lista],
+        # Linhas já renderizadas (mesmo template da página) para anexar à tabela
+        'html': render_template('_linhas_cupons.html', vendas_lista=vendas_lista,
+                                next_url=url_for('relatorio_cupons', inicio=data_inicio_str, fim=data_fim_str,
+                                                 caixa_id=caixa_selecionado, forma_pgto=forma_pgto_selecionada)),
+        'proximo': proximo,
+    })
+
+def _filtros_cupons(data_inicio, data_fim, caixa_id, forma_pgto):
+    """Condições (WHERE) do relatório de cupons, compartilhadas pela lista e pelo total"""
+    filtros = [
+        Venda.status == 'finalizada',
+        Venda.data_venda.between(data_inicio, data_fim),
+    ]
+    # Aplica filtro de caixa se um específico foi selecionado
+    if caixa_id > 0:
+        filtros.append(Venda.usuario_id == caixa_id)
+    # Aplica filtro de forma de pagamento (se a venda CONTÉM o pagamento).
+    # EXISTS em vez de JOIN para não repetir a venda (e não quebrar a paginação)
+    if forma_pgto != 'todos':
+        filtros.append(Venda.pagamentos.any(PagamentoVenda.forma_pagamento == forma_pgto))
+    return filtros
+
+def _ler_cursor_cupons(valor):
+    """'2024-05-01T10:00:00|123' -> (datetime, id). None/vazio = primeira página"""
+    if not valor:
+        return None
+    data_str, _, id_str = valor.rpartition('|')
+    return datetime.fromisoformat(data_str), int(id_str)
+
+def _pagina_cupons(filtros, cursor=None):
+    """
+    Uma página de cupons em ordem (data_venda, id) decrescente, paginada por
+    chave (keyset): a consulta continua da última venda vista, sem OFFSET.
+    Operador, itens e pagamentos vêm em consultas únicas (sem lazy load por venda).
+    Retorna (vendas, cursor da próxima página ou None).
+    """
+    vendas_lista = _consulta_cupons(filtros, cursor).all()
+
+    proximo = None
+    if len(vendas_lista) > CUPONS_POR_PAGINA:
+        vendas_lista = vendas_lista[:CUPONS_POR_PAGINA]
+        ultima = vendas_lista[-1]
+        proximo = f"{ultima.data_venda.isoformat()}|{ultima.id}"
+    return vendas_lista, proximo
+
+def _consulta_cupons(filtros, cursor=None):
+    """Consulta de uma página de _pagina_cupons() (uma venda a mais indica que há próxima página)"""
+    # Itens não são carregados: a quantidade vem do total gravado (Venda.num_itens)
+    consulta = Venda.query.join(Usuario).options(
+        contains_eager(Venda.operador),
+        selectinload(Venda.pagamentos),
+    ).filter(*filtros)
+
+    if cursor is not None:
+        # (data_venda, id) < cursor; o limite 'data_venda <= data do cursor' já vem nos filtros
+        data_cursor, id_cursor = cursor
+        consulta = consulta.filter(or_(Venda.data_venda < data_cursor, Venda.id < id_cursor))
+
+    return consulta.order_by(Venda.data_venda.desc(), Venda.id.desc()).limit(CUPONS_POR_PAGINA + 1)
+
 # =============================================================================
 #           FIM DA ROTA (CUPONS)
 # =============================================================================
@@ -1297,7 +1505,8 @@ def relatorio_cupons():
 @login_required
 def exportar_relatorio():
     """
-    Gera e baixa uma planilha Excel com os dados do relatório de vendas.
+    Gera uma planilha Excel (ou CSV, com ?formato=csv) com os dados do
+    relatório de vendas, como tarefa em segundo plano (download em /tarefas/<id>).
     """
     if not current_user.is_admin():
         flash('Acesso não autorizado!', 'danger')
@@ -1314,129 +1523,63 @@ def exportar_relatorio():
     except ValueError:
         caixa_selecionado = 0 
     forma_pgto_selecionada = request.args.get('forma_pgto', 'todos')
+    formato = request.args.get('formato', 'xlsx') # 'xlsx' (padrão) ou 'csv'
     # --- FIM DA LÓGICA DE FILTRO ---
 
+    # Gera o arquivo em segundo plano (a requisição volta na hora)
+    tarefa_id = enfileirar('exportacao_vendas', current_user.id, tarefa_exportar_vendas,
+                           data_inicio, data_fim, caixa_selecionado, forma_pgto_selecionada, formato)
 
-    # Consulta Venda e Itens de Venda
-    vendas_com_itens = Venda.query.filter(
-        Venda.status.in_(['finalizada', 'cancelada']), # Inclui canceladas para relatório de itens
-        Venda.data_venda.between(data_inicio, data_fim)
-    )
-
-    if caixa_selecionado > 0:
-        vendas_com_itens = vendas_com_itens.filter(Venda.usuario_id == caixa_selecionado)
-    
-    # Se há filtro de pagamento, filtramos as vendas antes de iterar
-    if forma_pgto_selecionada != 'todos':
-        vendas_com_itens = vendas_com_itens.join(PagamentoVenda, PagamentoVenda.venda_id == Venda.id)\
-                                           .filter(PagamentoVenda.forma_pagamento == forma_pgto_selecionada)
-
-
-    vendas_lista_final = vendas_com_itens.order_by(Venda.data_venda.desc()).all()
-
-
-    dados_para_planilha = []
-    for venda in vendas_lista_final:
-        # Pega as informações de pagamento uma única vez para a venda
-        pagamentos_info = {}
-        # CORREÇÃO: Apenas as formas principais permitidas no PDV
-        formas_colunas = {
-            'dinheiro': 0.0,
-            'cartao': 0.0,
-            'pix': 0.0,
-        }
-        outras_formas = []
-        
-        for p in venda.pagamentos:
-            forma_lower = p.forma_pagamento.lower()
-            valor = p.valor or 0.0
-            
-            if forma_lower in formas_colunas:
-                formas_colunas[forma_lower] += valor
-            else:
-                # Todas as outras (incluindo transferencia e cheque) vão para "Outras Formas"
-                outras_formas.append(f"{p.forma_pagamento.title()}: R$ {valor:.2f}")
-
-        row = {
-            'ID Venda': venda.id,
-            'Nº Venda': venda.numero_venda,
-            'Data Venda': venda.data_venda.strftime('%Y-%m-%d %H:%M:%S'),
-            'Status Venda': venda.status.title(),
-            'Operador': venda.operador.nome,
-            'Valor Total Venda (R$)': venda.valor_total,
-            'Valor Pago Total (R$)': venda.valor_pago,
-            'Troco Venda (R$)': venda.troco,
-            
-            # Detalhamento de Pagamentos (Apenas Dinheiro, Cartão e PIX como colunas principais)
-            'Dinheiro (R$)': formas_colunas['dinheiro'],
-            'Cartão (R$)': formas_colunas['cartao'],
-            'PIX (R$)': formas_colunas['pix'],
-            'Outras Formas': ", ".join(outras_formas), # Lista as outras formas em uma coluna
-            
-            'ID Item': '',
-            'ID Produto': '',
-            'Cód. Barras Produto': '',
-            'Produto': '',
-            'Quantidade': '',
-            'Preço Unit. (R$)': '',
-            'Subtotal Item (R$)': ''
-        }
-        dados_para_planilha.append(row.copy()) # Adiciona a linha da venda (header)
-        
-        # Adiciona as linhas dos itens de venda
-        for item in venda.itens:
-             item_row = row.copy() # Copia as informações da venda
-             
-             # Zera os totais (para que eles apareçam apenas na linha "Header" da venda)
-             item_row['Valor Total Venda (R$)'] = ''
-             item_row['Valor Pago Total (R$)'] = ''
-             item_row['Troco Venda (R$)'] = ''
-             item_row['Dinheiro (R$)'] = ''
-             item_row['Cartão (R$)'] = ''
-             item_row['PIX (R$)'] = ''
-             item_row['Outras Formas'] = ''
-             
-             # Preenche os detalhes do item
-             item_row['ID Item'] = item.id
-             item_row['ID Produto'] = item.produto.id
-             item_row['Cód. Barras Produto'] = item.produto.codigo_barras
-             item_row['Produto'] = item.produto.nome
-             item_row['Quantidade'] = item.quantidade
-             item_row['Preço Unit. (R$)'] = item.preco_unitario
-             item_row['Subtotal Item (R$)'] = item.subtotal
-             
-             dados_para_planilha.append(item_row)
-
-    if not dados_para_planilha:
-        flash('Nenhum dado encontrado para exportar.', 'warning')
-        return redirect(url_for('relatorios', **request.args))
-
-    # --- 4. GERA A PLANILHA EM MEMÓRIA ---
-    df = pd.DataFrame(dados_para_planilha)
-    
-    # Cria um buffer de Bytes em memória
-    output = io.BytesIO()
-    
-    # Escreve o DataFrame no buffer usando ExcelWriter
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Relatorio_Vendas', index=False)
-    
-    output.seek(0) # Volta ao início do buffer
-
-    # --- 5. CRIA A RESPOSTA E ENVIA O ARQUIVO ---
-    data_formatada = datetime.now().strftime('%Y%m%d_%H%M%S')
-    nome_arquivo = f"Relatorio_Det_Vendas_{data_formatada}.xlsx"
-    
-    response = make_response(output.read())
-    response.headers["Content-Disposition"] = f"attachment; filename={nome_arquivo}"
-    response.headers["Content-type"] = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    
-    return response
+    flash('Exportação iniciada. O arquivo ficará disponível para download abaixo.', 'info')
+    return redirect(url_for('tarefa_acompanhar', tarefa_id=tarefa_id))
 
 # =============================================================================
 #           FIM DA ROTA (EXPORTAR EXCEL)
 # =============================================================================
 
+# =============================================================================
+#           TAREFAS EM SEGUNDO PLANO (IMPORTAÇÃO / EXPORTAÇÃO)
+# =============================================================================
+def _tarefa_do_usuario(tarefa_id):
+    """Busca a tarefa; só o próprio usuário (ou um admin) pode vê-la. Retorna None se não puder."""
+    tarefa = db.session.get(Tarefa, tarefa_id)
+    if not tarefa or (tarefa.usuario_id != current_user.id and not current_user.is_admin()):
+        return None
+    return tarefa
+
+@app.route('/tarefas/<tarefa_id>')
+@login_required
+def tarefa_acompanhar(tarefa_id):
+    """Página que acompanha uma tarefa (consulta /jobs/<id> periodicamente)"""
+    tarefa = _tarefa_do_usuario(tarefa_id)
+    if not tarefa:
+        flash('Tarefa não encontrada.', 'danger')
+        return redirect(url_for('dashboard'))
+    return render_template('tarefa.html', tarefa=situacao(tarefa))
+
+@app.route('/jobs/<tarefa_id>')
+@login_required
+def api_tarefa(tarefa_id):
+    """Situação da tarefa: status, progresso, mensagem e resultado (JSON)"""
+    tarefa = _tarefa_do_usuario(tarefa_id)
+    if not tarefa:
+        return jsonify({'error': 'Tarefa não encontrada.'}), 404
+
+    dados = situacao(tarefa)
+    if dados['tem_arquivo']:
+        dados['download_url'] = url_for('tarefa_arquivo', tarefa_id=tarefa_id)
+    return jsonify(dados)
+
+@app.route('/jobs/<tarefa_id>/arquivo')
+@login_required
+def tarefa_arquivo(tarefa_id):
+    """Baixa o arquivo gerado por uma tarefa concluída"""
+    tarefa = _tarefa_do_usuario(tarefa_id)
+    if not tarefa or tarefa.status != 'concluida' or not tarefa.arquivo or not os.path.exists(tarefa.arquivo):
+        flash('Arquivo não disponível.', 'warning')
+        return redirect(url_for('dashboard'))
+    return send_file(tarefa.arquivo, as_attachment=True, download_name=tarefa.nome_arquivo)
+
 @app.route('/vendas/editar_pagamento/<int:venda_id>', methods=['POST'])
 @login_required
 def editar_pagamento(venda_id):
@@ -1483,7 +1626,11 @@ def editar_pagamento(venda_id):
         if forma_antiga == 'dinheiro' and pagamento_unico.valor > venda.valor_total:
              pagamento_unico.valor = venda.valor_total
         
-        # Recalcula as propriedades dinâmicas (valor_pago e troco) e salva.
+        # Atualiza os totais gravados na venda (valor_pago e troco) e salva.
+        venda.valor_pago = pagamento_unico.valor
+        venda.troco = max(0.0, venda.valor_pago - venda.valor_total)
+        # Move o valor para a nova forma no resumo diário de pagamentos
+        trocar_pagamento(venda, forma_antiga, valor_antigo, nova_forma, pagamento_unico.valor)
         db.session.commit()
         
         # A mensagem de flash deve ser mais informativa sobre o que realmente foi alterado
@@ -1523,17 +1670,33 @@ def vendas_cancelar(venda_id):
 
     try:
         # Inicia a transação
-        
-        # 1. Devolve os itens ao estoque
+
+        # 1. Marca como "cancelada" só se ainda não estiver: dois cancelamentos
+        #    simultâneos da mesma venda não devolvem o estoque duas vezes
+        marcadas = db.session.query(Venda).filter(Venda.id == venda.id, Venda.status != 'cancelada').update(
+            {'status': 'cancelada'}, synchronize_session='fetch')
+        if not marcadas:
+            db.session.rollback()
+            flash('Esta venda já foi cancelada.', 'info')
+            return redirect(url_for('relatorios', **request.args))
+
+        # 2. Devolve os itens ao estoque (UPDATE relativo: não sobrescreve baixas de outros caixas)
+        devolucoes = {}
         for item in venda.itens:
-            produto = item.produto # Carrega o produto associado
-            if produto:
-                produto.estoque_atual += item.quantidade
-        
-        # 2. Marca a venda como "cancelada"
-        venda.status = 'cancelada'
-        
+            if item.produto_id is not None:
+                devolucoes[item.produto_id] = devolucoes.get(item.produto_id, 0) + item.quantidade
+        devolver_estoque(devolucoes)
+
+        # 3. Retira a venda dos resumos diários
+        estornar_venda(venda)
+
         db.session.commit()
+
+        # Atualiza o estoque do índice do PDV
+        for produto_id, quantidade in devolucoes.items():
+            catalogo.ajustar_estoque(produto_id, quantidade)
+        publicar('venda', {'dia': venda.data_venda.date().isoformat(), 'valor': -venda.valor_total,
+                           'estoque_baixo': catalogo.contar_estoque_baixo()})
         flash(f'Venda #{venda.numero_venda} foi cancelada com sucesso. O estoque foi devolvido.', 'success')
 
     except Exception as e:
@@ -1562,50 +1725,9 @@ def cupom_fechamento():
             return redirect(url_for('dashboard'))
         return redirect(url_for('vendas'))
 
-    # --- Recalcula os totais para o cupom ---
-    
-    # 1. Query base das vendas no período (abertura local até agora local)
-    query_vendas = Venda.query.filter(
-        Venda.usuario_id == current_user.id,
-        Venda.status == 'finalizada',
-        Venda.data_venda >= movimento_atual.data_abertura,
-        Venda.data_venda <= datetime.now() 
-    )
-    
-    # 2. Total de Vendas (para contagem)
-    vendas_periodo = query_vendas.all()
-    total_vendas_count = len(vendas_periodo)
-
-    # 3. Agrupa os totais por forma de pagamento (usando PagamentoVenda)
-    vendas_agrupadas = db.session.query(
-        PagamentoVenda.forma_pagamento,
-        func.sum(PagamentoVenda.valor).label('total')
-    ).join(Venda).filter(
-        Venda.usuario_id == current_user.id,
-        Venda.status == 'finalizada',
-        PagamentoVenda.data_pagamento >= movimento_atual.data_abertura,
-        PagamentoVenda.data_pagamento <= datetime.now()
-    ).group_by(PagamentoVenda.forma_pagamento).all()
-
-    # 4. Prepara o dicionário de totais (incluindo tratamento de outras formas)
-    totais = {
-        'dinheiro': 0.0,
-        'cartao': 0.0,
-        'pix': 0.0,
-        'outros': 0.0,
-        'total_geral': 0.0
-    }
-    
-    for forma, total in vendas_agrupadas:
-        valor = float(total or 0.0)
-        totais['total_geral'] += valor
-        
-        forma_lower = str(forma).lower()
-        if forma_lower in totais and forma_lower != 'outros' and forma_lower != 'total_geral':
-            totais[forma_lower] = valor
-        elif forma_lower not in ['dinheiro', 'cartao', 'pix', 'total_geral']:
-             # Soma em 'outros' se não for uma das 3 principais
-            totais['outros'] += valor
+    # --- Totais do cupom: os mesmos acumulados no movimento (usados no fechamento) ---
+    totais = _totais_caixa(movimento_atual)
+    totais['total_vendas_count'] = movimento_atual.qtd_vendas
 
     # O "Saldo Esperado em Dinheiro"
     saldo_esperado_dinheiro = (movimento_atual.saldo_inicial or 0) + totais['dinheiro']
@@ -1628,50 +1750,35 @@ def api_buscar_produto(codigo):
     API para buscar produto pelo código de barras OU pelo ID.
     Chamado pelo JavaScript do PDV.
     """
-    # Verifica se o caixa está aberto
-    caixa_aberto, _ = get_caixa_aberto()
-    if not caixa_aberto:
+    # Verifica se o caixa está aberto (cache por usuário, sem consulta ao banco)
+    if caixa_aberto_id() is None:
         return jsonify({'error': 'Caixa está fechado!'}), 403
     
-    produto = None
-    
-    # 1. Tenta buscar pelo Código de Barras primeiro
-    produto = Produto.query.filter_by(codigo_barras=codigo, ativo=True).first()
-    
-    # 2. Se não encontrou, tenta buscar pelo ID (Código do Produto)
-    if not produto:
-        try:
-            # Tenta converter o código para um inteiro (ID)
-            produto_id = int(codigo)
-            produto = db.session.get(Produto, produto_id) # Usando a nova sintaxe
-            # Verifica se o produto encontrado por ID está ativo
-            if produto and not produto.ativo:
-                produto = None # Se não estiver ativo, trata como não encontrado
-        except ValueError:
-            # Se o código não for um número, ignora a busca por ID
-            pass
-
-    # 3. Verifica o resultado da busca
+    # 1. Busca no índice em memória: Código de Barras primeiro, depois ID (Código do Produto).
+    #    Apenas produtos ativos estão no índice.
+    produto = catalogo.buscar(codigo)
+
+    # 2. Verifica o resultado da busca
     if not produto:
         return jsonify({'error': 'Produto não encontrado'}), 404
         
-    if produto.estoque_atual <= 0:
-        return jsonify({'error': f'Produto sem estoque: {produto.nome}'}), 400
+    if produto['estoque_atual'] <= 0:
+        return jsonify({'error': f"Produto sem estoque: {produto['nome']}"}), 400
         
     # GERA A URL DA IMAGEM SE ELA EXISTIR
     imagem_path = None
     # CORREÇÃO: Verifica explicitamente se a imagem_url é uma string para evitar TypeError de objetos Undefined
-    if isinstance(produto.imagem_url, str) and produto.imagem_url:
+    if isinstance(produto['imagem_url'], str) and produto['imagem_url']:
         # Usa url_for para gerar o caminho correto
         # .replace('static/', '', 1) é usado porque a URL salva no BD é 'static/uploads/produtos/...'
         # mas url_for('static', filename=...) precisa apenas de 'uploads/produtos/...'
-        imagem_path = url_for('static', filename=produto.imagem_url.replace('static/', '', 1))
+        imagem_path = url_for('static', filename=produto['imagem_url'].replace('static/', '', 1))
         
     return jsonify({
-        'id': produto.id,
-        'nome': produto.nome,
-        'preco_venda': produto.preco_venda,
-        'estoque_atual': produto.estoque_atual,
+        'id': produto['id'],
+        'nome': produto['nome'],
+        'preco_venda': produto['preco_venda'],
+        'estoque_atual': produto['estoque_atual'],
         'imagem_url': imagem_path
     })
 
@@ -1684,9 +1791,8 @@ def api_buscar_produtos_por_nome():
     """
     API para buscar produtos por nome ou código de barras (para o modal F2).
     """
-    # Verifica se o caixa está aberto
-    caixa_aberto, _ = get_caixa_aberto()
-    if not caixa_aberto:
+    # Verifica se o caixa está aberto (cache por usuário, sem consulta ao banco)
+    if caixa_aberto_id() is None:
         return jsonify({'error': 'Caixa está fechado!'}), 403
         
     termo_busca = request.args.get('nome', '')
@@ -1694,34 +1800,25 @@ def api_buscar_produtos_por_nome():
     if len(termo_busca) < 2:
         return jsonify([]) # Retorna lista vazia se a busca for muito curta
 
-    # Cria o filtro (ilike não diferencia maiúsculas/minúsculas)
-    filtro_like = f"%{termo_busca}%"
-    
-    # Busca por nome OU código de barras
-    produtos_encontrados = Produto.query.filter(
-        or_(
-            Produto.nome.ilike(filtro_like),
-            Produto.codigo_barras.ilike(filtro_like)
-        ),
-        Produto.ativo == True
-    # CORREÇÃO: Adicionando Produto.id.asc() como ordenação secundária para garantir estabilidade
-    ).order_by(Produto.nome.asc(), Produto.id.asc()).limit(20).all() # Limita a 20 resultados
+    # Busca por nome OU código de barras no índice em memória
+    # (sem acentos, por início de palavra ou trecho, ordenado por relevância)
+    produtos_encontrados = catalogo.pesquisar(termo_busca, limite=20) # Limita a 20 resultados
 
     # Formata os resultados
     resultados_json = []
     for produto in produtos_encontrados:
         imagem_path = None
         # CORREÇÃO: Verifica explicitamente se a imagem_url é uma string para evitar TypeError de objetos Undefined
-        if isinstance(produto.imagem_url, str) and produto.imagem_url:
+        if isinstance(produto['imagem_url'], str) and produto['imagem_url']:
             # Usa url_for para gerar o caminho correto
-            imagem_path = url_for('static', filename=produto.imagem_url.replace('static/', '', 1))
+            imagem_path = url_for('static', filename=produto['imagem_url'].replace('static/', '', 1))
             
         resultados_json.append({
-            'id': produto.id,
-            'nome': produto.nome,
-            'codigo_barras': produto.codigo_barras,
-            'preco_venda': produto.preco_venda,
-            'estoque_atual': produto.estoque_atual,
+            'id': produto['id'],
+            'nome': produto['nome'],
+            'codigo_barras': produto['codigo_barras'],
+            'preco_venda': produto['preco_venda'],
+            'estoque_atual': produto['estoque_atual'],
             'imagem_url': imagem_path
         })
         
@@ -1730,6 +1827,75 @@ def api_buscar_produtos_por_nome():
 #           FIM DA NOVA ROTA
 # =============================================================================
 
+# =============================================================================
+#           CATÁLOGO DO PDV (CÓPIA LOCAL NO NAVEGADOR)
+# =============================================================================
+def _url_imagem_produto(caminho):
+    """Converte o caminho salvo no banco ('static/uploads/...') na URL da imagem"""
+    if isinstance(caminho, str) and caminho:
+        return url_for('static', filename=caminho.replace('static/', '', 1))
+    return None
+
+@app.route('/api/catalogo')
+@login_required
+def api_catalogo():
+    """
+    Catálogo de produtos ativos para o PDV guardar no navegador (IndexedDB) e
+    resolver as leituras do scanner sem ir ao servidor.
+    ?desde=<versão>: só o que mudou depois dela ('removidos' = desativados).
+    Responde 304 se o ETag (versão atual do catálogo) não mudou.
+    O estoque vem como estava no momento da cópia: as vendas não mudam a
+    versão, e a baixa real continua sendo validada em finalizar_venda.
+    """
+    versao_atual = db.session.query(func.coalesce(func.max(Produto.versao), 0)).scalar()
+    desde = request.args.get('desde', type=int)
+    if desde is not None and desde > versao_atual:
+        desde = None  # Versão que o banco não conhece (ex: backup restaurado): manda tudo
+
+    # O ETag identifica só a versão: quem já tem a versão atual não precisa de nada
+    etag = f'catalogo-{versao_atual}'
+    if etag in request.if_none_match:
+        resposta = app.response_class(status=304)
+        resposta.set_etag(etag)
+        return resposta
+
+    consulta = db.session.query(
+        Produto.id, Produto.codigo_barras, Produto.nome, Produto.preco_venda,
+        Produto.estoque_atual, Produto.imagem_url, Produto.ativo
+    )
+    if desde is None:
+        consulta = consulta.filter(Produto.ativo == True)
+    else:
+        consulta = consulta.filter(Produto.versao > desde)
+
+    produtos, removidos = [], []
+    for linha in consulta:
+        if not linha.ativo:
+            removidos.append(linha.id)
+            continue
+        produtos.append([linha.id, linha.codigo_barras, linha.nome, linha.preco_venda,
+                         linha.estoque_atual or 0, _url_imagem_produto(linha.imagem_url)])
+
+    resposta = jsonify({
+        'versao': versao_atual,
+        'completo': desde is None,
+        'colunas': COLUNAS_CATALOGO,
+        'produtos': produtos,
+        'removidos': removidos
+    })
+    resposta.set_etag(etag)
+    resposta.headers['Cache-Control'] = 'no-cache'
+    return resposta
+
+def _resposta_venda_duplicada(venda):
+    """Resposta de finalizar_venda para uma venda (mesmo uuid) que já foi gravada"""
+    return {
+        'success': f'Venda #{venda.numero_venda} já registrada.',
+        'venda_id': venda.id,
+        'numero_venda': venda.numero_venda,
+        'duplicada': True
+    }
+
 # =============================================================================
 #           INÍCIO DA ROTA ALTERADA (FINALIZAR VENDA) - MULTIPAGAMENTO
 # =============================================================================
@@ -1740,124 +1906,229 @@ def finalizar_venda():
     API para finalizar a venda.
     Recebe os dados do carrinho e múltiplos pagamentos via JSON.
     """
-    # Verifica se o caixa está aberto
-    caixa_aberto, movimento_atual = get_caixa_aberto()
-    if not caixa_aberto:
+    # Verifica se o caixa está aberto (cache por usuário, sem consulta ao banco)
+    movimento_id = caixa_aberto_id()
+    if movimento_id is None:
         return jsonify({'error': 'Caixa está fechado!'}), 403
 
     # Pega os dados enviados pelo JavaScript
-    data = request.get_json()
-    
-    if not data or 'itens' not in data or not data['itens']:
-        return jsonify({'error': 'Carrinho vazio'}), 400
-    
-    if 'pagamentos' not in data or not data['pagamentos']:
-        return jsonify({'error': 'Nenhuma forma de pagamento informada.'}), 400
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
 
+    uuid_venda = None
+    venda = None
     try:
-        # Inicia a transação
-        
-        valor_total_venda = 0
-        itens_venda_db = []
-        formas_permitidas_pdv = ['dinheiro', 'cartao', 'pix']
-        
-        # 1. Loop nos itens do carrinho para validar estoque e calcular total
-        for item_json in data['itens']:
-            produto = db.session.get(Produto, item_json['id']) 
-            quantidade = int(item_json['quantidade'])
-            
-            if not produto:
-                raise Exception(f'Produto ID {item_json["id"]} não encontrado.')
-                
-            # Verifica o estoque disponível no banco (Produto.estoque_atual)
-            if produto.estoque_atual < quantidade:
-                # Se for o caso, pode ser uma falha de concorrência ou cache. Rejeita.
-                raise Exception(f'Estoque insuficiente para {produto.nome}. (Disponível: {produto.estoque_atual})')
-
+        # Identificador gerado pelo PDV: reenvio (fila offline) da mesma venda não a duplica
+        uuid_venda = uuid_da_venda(data)
+        if uuid_venda:
+            venda_existente = vendas_por_uuid([uuid_venda]).get(uuid_venda)
+            if venda_existente:
+                return jsonify(_resposta_venda_duplicada(venda_existente))
+
+        # Valida e monta a venda (uma consulta IN para todos os produtos do carrinho)
+        produtos, estoque = carregar_produtos([data])
+        venda = preparar_venda(data, produtos, estoque)
+
+        # Grava (caixa, estoque, venda, itens, pagamentos, resumos) em uma única transação curta
+        momento = datetime.now()
+        gravar_vendas([venda], current_user.id, movimento_id, momento, app.config['NUMERACAO_VENDAS'])
+        db.session.commit()
 
-            # Atualiza estoque (apenas em memória por enquanto)
-            produto.estoque_atual -= quantidade
-            
-            # Calcula subtotal
-            preco_unitario = produto.preco_venda
-            subtotal = preco_unitario * quantidade
-            valor_total_venda += subtotal
-            
-            # Cria o ItemVenda
-            novo_item_venda = ItemVenda(
-                produto_id=produto.id,
-                quantidade=quantidade,
-                preco_unitario=preco_unitario,
-                subtotal=subtotal
-            )
-            itens_venda_db.append(novo_item_venda)
-
-        # 2. Cria a Venda principal e calcula o total
-        nova_venda = Venda(
-            numero_venda="PENDENTE", 
-            data_venda=datetime.now(),
-            status='finalizada',
-            usuario_id=current_user.id
-        )
-        nova_venda.itens = itens_venda_db
-        db.session.add(nova_venda)
+        _apos_gravar_vendas([venda], momento)
+        return jsonify(_resposta_venda(venda))
 
-        # 3. Processa e adiciona os pagamentos
-        pagamentos_db = []
-        valor_pago_total = 0.0
-        
-        # O flush aqui é necessário para que PagamentoVenda possa fazer referência à nova_venda.id, mas
-        # como Venda.id é gerado apenas no flush, e PagamentoVenda faz um backref, o flush pode ser após a venda ser adicionada.
-        db.session.flush()
+    except EstoqueAlterado as e:
+        db.session.rollback()
+        # Descobre qual produto ficou sem saldo para informar o operador
+        mensagem = estoque_insuficiente(venda['quantidades'])
+        if mensagem:
+            return jsonify({'error': mensagem}), 400
+        return jsonify({'error': str(e)}), e.status
 
-        for pagamento_json in data['pagamentos']:
-            forma = pagamento_json['forma_pagamento']
-            
-            # ALTERAÇÃO: Garante que a forma de pagamento enviada pelo PDV seja permitida
-            if forma not in formas_permitidas_pdv:
-                 # Isso só deve acontecer se o frontend foi modificado para enviar uma opção descontinuada.
-                 raise Exception(f"Forma de pagamento '{forma}' não é permitida no PDV.")
-            
-            valor = float(pagamento_json['valor'])
-            valor_pago_total += valor
-            
-            novo_pagamento = PagamentoVenda(
-                venda_id=nova_venda.id,
-                forma_pagamento=forma,
-                valor=valor,
-                data_pagamento=datetime.now()
-            )
-            pagamentos_db.append(novo_pagamento)
-        
-        db.session.add_all(pagamentos_db)
-        
-        # Validação do valor pago vs valor total da venda
-        if round(valor_pago_total, 2) < round(valor_total_venda, 2):
-            # Se o pagamento for insuficiente, cancela a transação e reverte o estoque.
-            db.session.rollback()
-            return jsonify({'error': 'Valor total pago insuficiente para o valor total da venda.'}), 400
-        
-        # O cálculo do troco é automático (propriedade dinâmica) no modelo Venda
-        
-        # 4. MÁGICA DO SEQUENCIAL: (O flush foi feito, agora atualiza numero_venda e comita)
-        nova_venda.numero_venda = str(nova_venda.id) 
-        
-        # 5. Salva tudo no banco definitivamente
-        db.session.commit()
-        
-        # Usa as propriedades dinâmicas para a resposta
-        troco_final = nova_venda.troco
+    except VendaRecusada as e:
+        db.session.rollback()
+        if e.status == 403:
+            get_caixa_aberto()  # Atualiza o cache com o estado real
+        return jsonify({'error': str(e)}), e.status
 
-        return jsonify({
-            'success': f'Venda finalizada com sucesso! Troco: R$ {troco_final:.2f}',
-            'venda_id': nova_venda.id,
-            'numero_venda': nova_venda.numero_venda
-        })
+    except IntegrityError:
+        db.session.rollback()
+        # A mesma venda chegou duas vezes ao mesmo tempo (reenvio da fila): vale a primeira
+        venda_existente = vendas_por_uuid([uuid_venda]).get(uuid_venda) if uuid_venda else None
+        if venda_existente:
+            return jsonify(_resposta_venda_duplicada(venda_existente))
+        return jsonify({'error': 'Conflito ao gravar a venda. Tente novamente.'}), 409
 
     except Exception as e:
         db.session.rollback() # Desfaz qualquer mudança no banco em caso de erro
-        # Retorna o erro específico (stock, valor pago, ou outro)
         return jsonify({'error': str(e)}), 400
+
+
+@app.route('/vendas/finalizar_lote', methods=['POST'])
+@login_required
+def finalizar_venda_lote():
+    """
+    Recebe várias vendas de uma vez: {'vendas': [venda, ...]}, cada uma no
+    formato de /vendas/finalizar (com 'uuid'). Usado no reenvio da fila offline
+    do PDV e em caixas com muito movimento.
+    O estoque é validado em ordem ao longo do lote: uma venda recusada não
+    impede as seguintes. A gravação é feita em transações de até
+    VENDAS_LOTE_POR_COMMIT vendas.
+    Vendas da fila offline trazem o caixa em que foram feitas ('movimento_id')
+    e o horário ('criada_em', relógio do PDV; o lote traz 'enviado_em' para
+    corrigir a diferença entre os relógios). Uma venda de outro caixa não é
+    gravada no caixa aberto agora: volta com status 403 e fica na fila.
+    Retorna {'resultados': [...]}, um por venda e na ordem recebida: a resposta
+    de /vendas/finalizar, ou {'error', 'status'} para as recusadas.
+    """
+    movimento_id = caixa_aberto_id()
+    if movimento_id is None:
+        return jsonify({'error': 'Caixa está fechado!'}), 403
+
+    data = request.get_json(silent=True)
+    vendas_json = data.get('vendas') if isinstance(data, dict) else None
+    if not isinstance(vendas_json, list) or not vendas_json:
+        return jsonify({'error': 'Nenhuma venda informada.'}), 400
+    if len(vendas_json) > app.config['VENDAS_LOTE_MAXIMO']:
+        return jsonify({'error': f"Lote com mais de {app.config['VENDAS_LOTE_MAXIMO']} vendas."}), 400
+
+    agora = datetime.now()
+    try:
+        diferenca = diferenca_relogio(data.get('enviado_em'), agora)
+    except VendaRecusada as e:
+        return jsonify({'error': str(e)}), e.status
+    abertura_caixa = None
+
+    resultados = [None] * len(vendas_json)
+    pendentes = []   # [(índice, uuid, dados, momento da venda)] a gravar, na ordem recebida
+    repetidas = []   # [(índice, índice da primeira com o mesmo uuid)]
+    de_outro_caixa = []  # [(índice, uuid)] feitas em um caixa que não é o aberto agora
+    primeira_com_uuid = {}
+    for indice, dados in enumerate(vendas_json):
+        try:
+            uuid_venda = uuid_da_venda(dados) if isinstance(dados, dict) else None
+        except VendaRecusada as e:
+            resultados[indice] = {'error': str(e), 'status': e.status}
+            continue
+        if uuid_venda in primeira_com_uuid:
+            repetidas.append((indice, primeira_com_uuid[uuid_venda]))
+            continue
+        if uuid_venda:
+            primeira_com_uuid[uuid_venda] = indice
+
+        # Caixa e horário em que a venda foi feita (venda da fila offline)
+        momento = agora
+        if isinstance(dados, dict):
+            if dados.get('movimento_id', movimento_id) != movimento_id:
+                de_outro_caixa.append((indice, uuid_venda))
+                continue
+            if dados.get('criada_em') is not None and abertura_caixa is None:
+                abertura_caixa = db.session.get(MovimentoCaixa, movimento_id).data_abertura
+            try:
+                momento = momento_da_venda(dados, diferenca, abertura_caixa, agora)
+            except VendaRecusada as e:
+                resultados[indice] = {'uuid': uuid_venda, 'error': str(e), 'status': e.status}
+                continue
+        pendentes.append((indice, uuid_venda, dados, momento))
+
+    # Venda de outro caixa só é aceita se já estava gravada (resposta perdida no envio)
+    ja_gravadas = vendas_por_uuid([uuid_venda for _, uuid_venda in de_outro_caixa if uuid_venda])
+    for indice, uuid_venda in de_outro_caixa:
+        if uuid_venda in ja_gravadas:
+            resultados[indice] = dict(_resposta_venda_duplicada(ja_gravadas[uuid_venda]), uuid=uuid_venda)
+        else:
+            resultados[indice] = {'uuid': uuid_venda, 'status': 403,
+                                  'error': 'Venda feita em outro caixa: não pode entrar no caixa aberto agora.'}
+
+    por_commit = app.config['VENDAS_LOTE_POR_COMMIT']
+    for inicio in range(0, len(pendentes), por_commit):
+        bloco = pendentes[inicio:inicio + por_commit]
+        try:
+            _gravar_bloco_de_vendas(bloco, movimento_id, resultados)
+        except VendaRecusada as e:
+            # Caixa fechado: nenhuma venda restante do lote pode ser gravada
+            db.session.rollback()
+            get_caixa_aberto()  # Atualiza o cache com o estado real
+            for indice, uuid_venda, _, _ in pendentes[inicio:]:
+                resultados[indice] = {'uuid': uuid_venda, 'error': str(e), 'status': e.status}
+            break
+
+    # A mesma venda repetida no lote: mesma resposta da primeira
+    for indice, primeira in repetidas:
+        resultado = dict(resultados[primeira])
+        if 'venda_id' in resultado:
+            resultado['duplicada'] = True
+        resultados[indice] = resultado
+
+    return jsonify({'resultados': resultados})
+
+
+def _gravar_bloco_de_vendas(bloco, movimento_id, resultados):
+    """
+    Valida e grava (um commit) um bloco do lote [(índice, uuid, dados, momento da venda)],
+    preenchendo 'resultados'. Se outro caixa esgotar um produto no meio do
+    caminho, refaz a validação com o estoque atualizado.
+    """
+    for _ in range(3):
+        ja_gravadas = vendas_por_uuid([uuid_venda for _, uuid_venda, _, _ in bloco if uuid_venda])
+        produtos, estoque = carregar_produtos([dados for _, _, dados, _ in bloco])
+
+        aceitas, respostas = [], {}
+        for indice, uuid_venda, dados, momento_venda in bloco:
+            if uuid_venda in ja_gravadas:
+                respostas[indice] = dict(_resposta_venda_duplicada(ja_gravadas[uuid_venda]), uuid=uuid_venda)
+                continue
+            try:
+                venda = preparar_venda(dados, produtos, estoque)
+            except VendaRecusada as e:
+                respostas[indice] = {'uuid': uuid_venda, 'error': str(e), 'status': e.status}
+                continue
+            venda['data_venda'] = momento_venda
+            aceitas.append((indice, venda))
+
+        if aceitas:
+            momento = datetime.now()
+            try:
+                gravar_vendas([venda for _, venda in aceitas], current_user.id, movimento_id, momento,
+                              app.config['NUMERACAO_VENDAS'])
+                db.session.commit()
+            except (EstoqueAlterado, IntegrityError):
+                # Estoque baixado (ou uuid gravado) por outra requisição: valida de novo
+                db.session.rollback()
+                continue
+            _apos_gravar_vendas([venda for _, venda in aceitas], momento)
+            for indice, venda in aceitas:
+                respostas[indice] = dict(_resposta_venda(venda), uuid=venda['uuid'])
+
+        for indice, resposta in respostas.items():
+            resultados[indice] = resposta
+        return
+
+    for indice, uuid_venda, _, _ in bloco:
+        resultados[indice] = {'uuid': uuid_venda, 'error': str(EstoqueAlterado()), 'status': 409}
+
+
+def _resposta_venda(venda):
+    """Resposta de uma venda gravada (venda preparada por registro_vendas)"""
+    return {
+        'success': f"Venda finalizada com sucesso! Troco: R$ {venda['troco']:.2f}",
+        'venda_id': venda['venda_id'],
+        'numero_venda': venda['numero_venda']
+    }
+
+
+def _apos_gravar_vendas(vendas, momento):
+    """Depois do commit: baixa o estoque no índice do PDV e avisa os dashboards (um evento por dia das vendas)"""
+    por_dia = {}
+    for venda in vendas:
+        for produto_id, quantidade in venda['quantidades'].items():
+            catalogo.ajustar_estoque(produto_id, -quantidade)
+        dia = (venda.get('data_venda') or momento).date()
+        por_dia[dia] = por_dia.get(dia, 0) + venda['valor_total']
+    estoque_baixo = catalogo.contar_estoque_baixo()
+    for dia, valor in por_dia.items():
+        publicar('venda', {'dia': dia.isoformat(), 'valor': valor, 'estoque_baixo': estoque_baixo})
 # =============================================================================
 #           FIM DA ROTA ALTERADA (FINALIZAR VENDA)
 # =============================================================================
@@ -1955,18 +2226,63 @@ def init_db():
             print("Caixa: caixa@loja.com / caixa123")
             print("=" * 50)
 
-if __name__ == '__main__':
-    # Garante que o init_db() rode dentro do contexto da app
+def preparar_banco():
+    """Cria as tabelas novas e aplica as migrações pendentes (bancos já existentes)"""
+    db.create_all()
+    aplicar_migracoes()
+
+@app.cli.command('reconstruir-resumos')
+def reconstruir_resumos_cli():
+    """Recalcula os resumos diários a partir do histórico: flask --app app reconstruir-resumos"""
+    preparar_banco()
+    reconstruir_resumos()
+    db.session.commit()
+    print(f"Resumos reconstruídos: {ResumoVendaDia.query.count()} dia(s)/operador(es).")
+
+@app.cli.command('verificar-planos')
+def verificar_planos_cli():
+    """Confere (EXPLAIN QUERY PLAN) se os relatórios usam índices: flask --app app verificar-planos"""
+    from planos_consulta import verificar_planos
+    preparar_banco()
+    falhas = verificar_planos()
+    if falhas:
+        print(f"{len(falhas)} consulta(s) com varredura completa de tabela.")
+        raise SystemExit(1)
+    print("Todas as consultas monitoradas usam índices.")
+
+def inicializar():
+    """
+    Prepara o banco e os caches antes de atender: cria o banco (se não existir)
+    ou aplica as migrações, marca as tarefas interrompidas e monta o índice de
+    produtos. Roda uma vez por inicialização (no pdv serve, antes de criar os workers).
+    """
     with app.app_context():
         # Verifica se o banco de dados já existe antes de inicializar
-        # CORREÇÃO: o app.instance_path é o local correto para o 'loja.db'
-        db_path = os.path.join(app.instance_path, 'loja.db')
+        db_path = db.engine.url.database
         if not os.path.exists(db_path):
             print(f"Banco de dados não encontrado em {db_path}. Inicializando...")
             # Cria o diretório 'instance' se não existir
-            os.makedirs(app.instance_path, exist_ok=True)
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
             init_db()
         else:
             print(f"Banco de dados encontrado em {db_path}. Pulando inicialização.")
+
+        # Atualiza o esquema de bancos criados por versões anteriores
+        preparar_banco()
+        print(descrever_pragmas())
+
+        # Tarefas que estavam rodando quando o processo anterior terminou
+        marcar_interrompidas()
+
+        # Monta o índice de produtos do PDV antes de atender o primeiro scan
+        catalogo.carregar()
+
+if __name__ == '__main__':
+    # Servidor de desenvolvimento (modo debug); em produção: python -m pdv serve
+    inicializar()
+
+    # Backup automático (só no processo que atende: o reloader do modo debug roda este bloco duas vezes)
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        iniciar_agendamento(app)
             
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(debug=True, host=app.config['SERVIDOR_HOST'], port=app.config['SERVIDOR_PORTA'])
@@ -0,0 +1,197 @@
+import gzip
+import os
+import shutil
+import sqlite3
+import threading
+import traceback
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import current_app
+
+from database import db
+from tarefas import ErroTarefa, informar_progresso
+
+try:
+    import fcntl
+except ImportError:  # Windows: um único processo atende (waitress)
+    fcntl = None
+
+
+# =============================================================================
+# BACKUP DO BANCO DE DADOS
+# Cópia consistente do SQLite com o banco em uso, pela API de backup online:
+# a cópia é feita em passos de poucas páginas dentro de uma transação de
+# leitura (em WAL, uma fotografia do banco), então as vendas continuam sendo
+# gravadas durante a cópia. O arquivo é compactado (gzip) e guardado em
+# instance/backups, que mantém só os BACKUP_MANTER mais recentes.
+# Além do backup pedido no dashboard, um agendador gera um a cada
+# BACKUP_INTERVALO_HORAS (com vários workers, cada um tem o seu agendador,
+# e uma trava de arquivo faz só o primeiro gerar o backup do período).
+# =============================================================================
+
+# Páginas copiadas por passo (4 KiB cada) e pausa entre os passos (s)
+PAGINAS_POR_PASSO = 1024
+PAUSA_ENTRE_PASSOS = 0.005
+
+PREFIXO = 'loja_'
+EXTENSAO = '.db.gz'
+
+_lock_backup = threading.Lock()
+
+
+def pasta_backups():
+    """Pasta (dentro de 'instance') com os backups gerados."""
+    pasta = os.path.join(current_app.instance_path, 'backups')
+    os.makedirs(pasta, exist_ok=True)
+    return pasta
+
+
+def _caminho_banco():
+    url = db.engine.url
+    if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:':
+        raise ErroTarefa('O backup só está disponível para banco SQLite em arquivo.')
+    return url.database
+
+
+def listar_backups():
+    """Backups guardados, do mais recente ao mais antigo: [{'nome', 'tamanho', 'data'}]."""
+    pasta = pasta_backups()
+    backups = []
+    for nome in os.listdir(pasta):
+        if nome.startswith(PREFIXO) and nome.endswith(EXTENSAO):
+            info = os.stat(os.path.join(pasta, nome))
+            backups.append({'nome': nome, 'tamanho': info.st_size,
+                            'data': datetime.fromtimestamp(info.st_mtime)})
+    backups.sort(key=lambda backup: backup['nome'], reverse=True)
+    return backups
+
+
+def _copiar_banco(origem_caminho, destino_caminho, ao_progredir=None):
+    """Cópia consistente de 'origem_caminho' (em uso) para um arquivo SQLite novo."""
+    origem = sqlite3.connect(f'file:{origem_caminho}?mode=ro', uri=True)
+    destino = sqlite3.connect(destino_caminho)
+    try:
+        # Transação de leitura aberta durante toda a cópia: todos os passos
+        # enxergam o mesmo estado do banco, e a cópia não recomeça a cada venda gravada
+        origem.execute('BEGIN')
+        origem.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchall()
+
+        def progresso(status, restantes, total):
+            if ao_progredir and total:
+                ao_progredir((total - restantes) / total)
+
+        origem.backup(destino, pages=PAGINAS_POR_PASSO, progress=progresso, sleep=PAUSA_ENTRE_PASSOS)
+        origem.rollback()
+        # A cópia é um arquivo único (sem -wal/-shm) para poder ser restaurada direto
+        destino.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        destino.close()
+        origem.close()
+
+
+def _compactar(caminho, destino):
+    with open(caminho, 'rb') as entrada, gzip.open(destino, 'wb', compresslevel=6) as saida:
+        shutil.copyfileobj(entrada, saida, 1024 * 1024)
+
+
+def _rotacionar(manter):
+    """Apaga os backups além dos 'manter' mais recentes."""
+    pasta = pasta_backups()
+    for backup in listar_backups()[manter:]:
+        os.remove(os.path.join(pasta, backup['nome']))
+
+
+def gerar_backup(ao_progredir=None):
+    """
+    Gera um backup compactado em instance/backups e aplica a rotação.
+    Retorna o caminho do arquivo. Um backup por vez (no processo).
+    """
+    origem = _caminho_banco()
+    pasta = pasta_backups()
+    with _lock_backup:
+        nome = f"{PREFIXO}{datetime.now().strftime('%Y%m%d_%H%M%S')}{EXTENSAO}"
+        destino = os.path.join(pasta, nome)
+        temporario = os.path.join(pasta, f'.{nome}.tmp')
+        try:
+            _copiar_banco(origem, temporario, lambda fracao: ao_progredir and ao_progredir(0.8 * fracao))
+            if ao_progredir:
+                ao_progredir(0.8)
+            _compactar(temporario, destino + '.tmp')
+            os.replace(destino + '.tmp', destino)
+        finally:
+            for arquivo in (temporario, destino + '.tmp'):
+                if os.path.exists(arquivo):
+                    os.remove(arquivo)
+        _rotacionar(current_app.config['BACKUP_MANTER'])
+    return destino
+
+
+def tarefa_backup(tarefa_id):
+    """Tarefa em segundo plano (botão de backup do dashboard)."""
+    def ao_progredir(fracao):
+        informar_progresso(tarefa_id, 95 * fracao, 'Copiando o banco de dados...' if fracao < 0.8 else 'Compactando...')
+
+    caminho = gerar_backup(ao_progredir)
+    nome = os.path.basename(caminho)
+    return {
+        'mensagem': f'Backup gerado: {nome}.',
+        'resultado': {'backup': nome, 'tamanho': os.path.getsize(caminho)},
+        'arquivo': caminho,
+        'nome_arquivo': nome,
+    }
+
+
+# =============================================================================
+# AGENDAMENTO
+# =============================================================================
+
+def _backup_em_dia(intervalo_horas):
+    backups = listar_backups()
+    if not backups:
+        return False
+    idade = datetime.now() - backups[0]['data']
+    return idade.total_seconds() < intervalo_horas * 3600
+
+
+@contextmanager
+def _trava_entre_processos():
+    """Um agendador por vez: o processo seguinte espera e encontra o backup em dia."""
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(pasta_backups(), '.agendador.lock'), 'w') as arquivo:
+        fcntl.flock(arquivo, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(arquivo, fcntl.LOCK_UN)
+
+
+def _agendador(app, parar):
+    intervalo = app.config['BACKUP_INTERVALO_HORAS']
+    while not parar.is_set():
+        with app.app_context():
+            try:
+                # Outro processo (ou a execução anterior) pode já ter feito o backup do período
+                with _trava_entre_processos():
+                    if not _backup_em_dia(intervalo):
+                        print(f'Backup automático gerado: {gerar_backup()}')
+            except Exception:
+                traceback.print_exc()
+            finally:
+                db.session.remove()
+        # Confere de novo em um décimo do intervalo (no máximo de hora em hora)
+        parar.wait(min(intervalo * 360, 3600))
+
+
+def iniciar_agendamento(app):
+    """
+    Inicia o backup automático (thread em segundo plano) se BACKUP_INTERVALO_HORAS > 0.
+    Retorna o Event que encerra o agendador, ou None.
+    """
+    if not app.config['BACKUP_INTERVALO_HORAS']:
+        return None
+    parar = threading.Event()
+    threading.Thread(target=_agendador, args=(app, parar), name='backup', daemon=True).start()
+    return parar
@@ -0,0 +1,9 @@
+"""
+Benchmarks do PDV (rodar a partir da raiz do repositório):
+
+    python -m bench.gerar_dados --banco /tmp/bench.db --meses 6
+    python -m bench.executar --banco /tmp/bench.db --saida resultado.json
+    python -m bench.comparar antes.json depois.json
+    python -m bench.carga --banco /tmp/bench.db --operadores 1 2 4 8 16
+    python -m bench.inicializacao --limite-ms 800
+"""
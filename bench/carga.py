@@ -0,0 +1,398 @@
+"""
+Simulador de carga do caixa: N operadores simultâneos, cada um com a sua
+sessão e o seu caixa aberto, repetindo "3 leituras + finalizar" contra um
+servidor de verdade (processo separado, HTTP local) sobre uma cópia de um
+banco gerado por bench.gerar_dados.
+
+    python -m bench.carga --banco /tmp/bench.db --operadores 1 2 4 8 16 --duracao 20
+    python -m bench.carga --banco /tmp/bench.db --operadores 16 --servidor pdv --workers 4
+
+Cada valor de --operadores é uma rodada (banco e servidor novos). Mostra
+vendas/s sustentadas, latências, retentativas por banco travado, taxa de
+erros e, ao final de cada rodada, confere o estoque e os totais dos caixas
+gravados contra as vendas confirmadas aos operadores. --disputados deixa
+pouco estoque nos produtos mais vendidos para forçar a disputa pelo
+último item (e revelar venda além do estoque).
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from datetime import datetime
+
+from bench.executar import percentil
+from bench.gerar_dados import SENHA_OPERADORES
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LEITURAS_POR_VENDA = 3
+TENTATIVAS_TRAVADO = 5  # Reenvios da mesma venda (mesmo uuid) quando o banco está travado
+TIMEOUT_HTTP = 30
+
+
+def _argumentos():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--banco', required=True, help='Banco gerado por bench.gerar_dados (não é alterado)')
+    parser.add_argument('--operadores', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--duracao', type=float, default=20.0, help='Segundos de carga por rodada')
+    parser.add_argument('--servidor', choices=['flask', 'pdv'], default='flask',
+                        help="'flask': servidor de desenvolvimento com threads; 'pdv': python -m pdv serve")
+    parser.add_argument('--workers', type=int, default=1, help='Processos do servidor (só com --servidor pdv)')
+    parser.add_argument('--threads', type=int, default=8, help='Threads por processo (só com --servidor pdv)')
+    parser.add_argument('--disputados', type=int, default=0,
+                        help='Quantos dos produtos mais vendidos ficam com pouco estoque')
+    parser.add_argument('--estoque-disputado', type=int, default=100)
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--saida', help='Arquivo JSON do resultado')
+    return parser.parse_args()
+
+
+# =============================================================================
+# BANCO E SERVIDOR
+# =============================================================================
+
+def _preparar_modelo(args, pasta):
+    """
+    Cópia do banco usada em todas as rodadas: operadores que faltarem para a
+    maior rodada e, com --disputados, pouco estoque nos produtos mais vendidos.
+    Retorna (caminho, códigos de barras na ordem de popularidade).
+    """
+    from werkzeug.security import generate_password_hash
+
+    modelo = os.path.join(pasta, 'modelo.db')
+    with sqlite3.connect(os.path.abspath(args.banco)) as origem, sqlite3.connect(modelo) as destino:
+        origem.backup(destino)
+
+    conexao = sqlite3.connect(modelo)
+    with conexao:
+        existentes = {email for (email,) in conexao.execute("SELECT email FROM usuarios WHERE perfil = 'caixa'")}
+        senha_hash = generate_password_hash(SENHA_OPERADORES)
+        for numero in range(1, max(args.operadores) + 1):
+            email = f'operador{numero}@loja.com'
+            if email not in existentes:
+                conexao.execute(
+                    "INSERT INTO usuarios (nome, email, senha_hash, perfil, ativo, data_criacao, versao) "
+                    "VALUES (?, ?, ?, 'caixa', 1, ?, 1)", (f'Operador {numero}', email, senha_hash, datetime.now()))
+        # Nenhum caixa aberto: cada operador abre o seu no início da rodada
+        conexao.execute("UPDATE movimento_caixa SET status = 'fechado', data_fechamento = ? WHERE status = 'aberto'",
+                        (datetime.now(),))
+
+        # Popularidade real do banco gerado (os mais vendidos primeiro)
+        populares = [codigo for (codigo,) in conexao.execute(
+            'SELECT p.codigo_barras FROM produtos p LEFT JOIN itens_venda i ON i.produto_id = p.id '
+            'WHERE p.ativo = 1 AND p.estoque_atual > 0 GROUP BY p.id ORDER BY COUNT(i.id) DESC, p.id')]
+        if args.disputados:
+            conexao.executemany('UPDATE produtos SET estoque_atual = ? WHERE codigo_barras = ?',
+                                [(args.estoque_disputado, codigo) for codigo in populares[:args.disputados]])
+    conexao.close()
+    return modelo, populares
+
+
+def _porta_livre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _iniciar_servidor(args, banco, porta, log):
+    """Servidor em outro processo, lendo o banco da cópia da rodada."""
+    ambiente = dict(os.environ, PDV_DATABASE_URI=f'sqlite:///{banco}')
+    if args.servidor == 'pdv':
+        comando = [sys.executable, '-m', 'pdv', 'serve', '--host', '127.0.0.1', '--port', str(porta),
+                   '--workers', str(args.workers), '--threads', str(args.threads),
+                   '-c', 'BACKUP_INTERVALO_HORAS=0']
+    else:
+        comando = [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--host', '127.0.0.1', '--port', str(porta),
+                   '--with-threads', '--no-reload', '--no-debugger']
+    processo = subprocess.Popen(comando, cwd=RAIZ, env=ambiente, stdout=log, stderr=subprocess.STDOUT)
+    limite = time.monotonic() + 60
+    while time.monotonic() < limite:
+        if processo.poll() is not None:
+            raise RuntimeError(f'O servidor terminou ao iniciar (código {processo.returncode}); veja {log.name}')
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{porta}/login', timeout=2).close()
+            return processo
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            time.sleep(0.2)
+    processo.kill()
+    raise RuntimeError(f'O servidor não respondeu em 60s; veja {log.name}')
+
+
+def _parar_servidor(processo):
+    processo.terminate()
+    try:
+        processo.wait(10)
+    except subprocess.TimeoutExpired:
+        processo.kill()
+        processo.wait()
+
+
+# =============================================================================
+# OPERADOR SIMULADO
+# =============================================================================
+
+class Operador(threading.Thread):
+    def __init__(self, numero, url_base, populares, pesos, semente, inicio, fim):
+        super().__init__(name=f'operador{numero}', daemon=True)
+        self.numero = numero
+        self.url_base = url_base
+        self.populares = populares
+        self.pesos = pesos
+        self.rnd = random.Random(semente)
+        self.inicio, self.fim = inicio, fim  # Barreira de largada e prazo (time.monotonic)
+        self.http = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.vendas = 0
+        self.vendido = {}        # produto_id -> quantidade confirmada pelo servidor
+        self.latencias = {'leitura': [], 'finalizar': []}
+        self.travados = 0        # Reenvios por banco travado
+        self.sem_estoque = 0     # Leituras/vendas recusadas por falta de estoque (esperado com --disputados)
+        self.erros = {}          # tipo -> quantidade
+        self.tentativas = 0
+
+    def _pedir(self, caminho, dados=None, json_corpo=None):
+        """(status, corpo JSON ou None)"""
+        cabecalhos = {}
+        corpo = None
+        if json_corpo is not None:
+            corpo = json.dumps(json_corpo).encode()
+            cabecalhos['Content-Type'] = 'application/json'
+        elif dados is not None:
+            corpo = urllib.parse.urlencode(dados).encode()
+        pedido = urllib.request.Request(self.url_base + caminho, data=corpo, headers=cabecalhos)
+        try:
+            with self.http.open(pedido, timeout=TIMEOUT_HTTP) as resposta:
+                status, conteudo = resposta.status, resposta.read()
+        except urllib.error.HTTPError as e:
+            status, conteudo = e.code, e.read()
+        try:
+            return status, json.loads(conteudo)
+        except ValueError:
+            return status, None
+
+    def _erro(self, tipo):
+        self.erros[tipo] = self.erros.get(tipo, 0) + 1
+
+    def entrar(self):
+        self._pedir('/login', dados={'email': f'operador{self.numero}@loja.com', 'senha': SENHA_OPERADORES})
+        self._pedir('/caixa/abrir', dados={'saldo_inicial': '100'})
+
+    def _vender(self):
+        itens, total = [], 0.0
+        for codigo in self.rnd.choices(self.populares, cum_weights=self.pesos, k=LEITURAS_POR_VENDA):
+            inicio = time.perf_counter()
+            status, produto = self._pedir(f'/api/produto/{codigo}')
+            self.latencias['leitura'].append((time.perf_counter() - inicio) * 1000)
+            if status == 400 and produto and 'estoque' in produto.get('error', ''):
+                self.sem_estoque += 1
+                continue
+            if status != 200:
+                self._erro(f'leitura HTTP {status}')
+                continue
+            itens.append({'id': produto['id'], 'quantidade': 1})
+            total += produto['preco_venda']
+        if not itens:
+            return
+
+        venda = {'uuid': str(uuid.UUID(int=self.rnd.getrandbits(128))), 'itens': itens,
+                 'pagamentos': [{'forma_pagamento': 'dinheiro', 'valor': round(total + 0.005, 2)}]}
+        self.tentativas += 1
+        for tentativa in range(TENTATIVAS_TRAVADO + 1):
+            inicio = time.perf_counter()
+            status, resposta = self._pedir('/vendas/finalizar', json_corpo=venda)
+            self.latencias['finalizar'].append((time.perf_counter() - inicio) * 1000)
+            erro = (resposta or {}).get('error', '')
+            if status == 200:
+                # 'duplicada' num reenvio: a tentativa anterior gravou, mas a resposta não chegou
+                if not resposta.get('duplicada') or tentativa:
+                    self.vendas += 1
+                    for item in itens:
+                        self.vendido[item['id']] = self.vendido.get(item['id'], 0) + item['quantidade']
+                return
+            if 'locked' in erro or 'busy' in erro:
+                # Mesmo uuid: se a primeira tentativa chegou a gravar, o servidor responde 'duplicada'
+                self.travados += 1
+                time.sleep(0.05 * (2 ** tentativa) * self.rnd.random())
+                continue
+            if status == 400 and 'estoque' in erro.lower():
+                self.sem_estoque += 1
+                return
+            self._erro(f'finalizar HTTP {status}: {erro[:60]}')
+            return
+        self._erro('finalizar: banco travado após retentativas')
+
+    def run(self):
+        while time.monotonic() < self.inicio:
+            time.sleep(0.001)
+        while time.monotonic() < self.fim:
+            try:
+                self._vender()
+            except (urllib.error.URLError, ConnectionError, socket.timeout) as e:
+                self._erro(f'conexão: {type(e).__name__}')
+
+
+# =============================================================================
+# CONFERÊNCIA
+# =============================================================================
+
+def _conferir(banco, estoque_inicial, ultima_venda, operadores):
+    """Divergências entre o banco e o que foi confirmado aos operadores (lista de textos)."""
+    problemas = []
+    conexao = sqlite3.connect(banco)
+    try:
+        estoque_final = dict(conexao.execute('SELECT id, estoque_atual FROM produtos'))
+        vendido_banco = dict(conexao.execute(
+            "SELECT i.produto_id, SUM(i.quantidade) FROM itens_venda i JOIN vendas v ON v.id = i.venda_id "
+            "WHERE v.id > ? AND v.status = 'finalizada' GROUP BY i.produto_id", (ultima_venda,)))
+        vendas_banco = conexao.execute('SELECT COUNT(*) FROM vendas WHERE id > ?', (ultima_venda,)).fetchone()[0]
+        caixas = conexao.execute(
+            "SELECT m.id, m.qtd_vendas, m.valor_vendas, COUNT(v.id), COALESCE(SUM(v.valor_total), 0) "
+            "FROM movimento_caixa m LEFT JOIN vendas v ON v.movimento_caixa_id = m.id "
+            "WHERE m.status = 'aberto' GROUP BY m.id").fetchall()
+    finally:
+        conexao.close()
+
+    vendido_cliente = {}
+    for operador in operadores:
+        for produto_id, quantidade in operador.vendido.items():
+            vendido_cliente[produto_id] = vendido_cliente.get(produto_id, 0) + quantidade
+
+    vendas_cliente = sum(operador.vendas for operador in operadores)
+    if vendas_banco != vendas_cliente:
+        problemas.append(f'{vendas_banco} vendas gravadas, {vendas_cliente} confirmadas aos operadores')
+    for produto_id, inicial in estoque_inicial.items():
+        final = estoque_final.get(produto_id)
+        baixado = vendido_banco.get(produto_id, 0)
+        if final is not None and final < 0:
+            problemas.append(f'produto {produto_id}: estoque negativo ({final})')
+        if final != inicial - baixado:
+            problemas.append(f'produto {produto_id}: estoque {final}, esperado {inicial} - {baixado} vendidos')
+        if baixado != vendido_cliente.get(produto_id, 0):
+            problemas.append(f'produto {produto_id}: {baixado} gravados, {vendido_cliente.get(produto_id, 0)} confirmados')
+    for movimento_id, qtd, valor, qtd_vendas, valor_vendas in caixas:
+        if qtd != qtd_vendas or abs(valor - valor_vendas) > 0.01:
+            problemas.append(f'caixa {movimento_id}: totais {qtd}/{valor:.2f}, vendas {qtd_vendas}/{valor_vendas:.2f}')
+    return problemas
+
+
+# =============================================================================
+# RODADAS
+# =============================================================================
+
+def rodada(args, modelo, populares, quantidade, pasta):
+    banco = os.path.join(pasta, f'rodada_{quantidade}.db')
+    with sqlite3.connect(modelo) as origem, sqlite3.connect(banco) as destino:
+        origem.backup(destino)
+    conexao = sqlite3.connect(banco)
+    estoque_inicial = dict(conexao.execute('SELECT id, estoque_atual FROM produtos'))
+    ultima_venda = conexao.execute('SELECT COALESCE(MAX(id), 0) FROM vendas').fetchone()[0]
+    conexao.close()
+
+    # Popularidade de Zipf sobre a ordem real de vendas do banco
+    pesos, soma = [], 0.0
+    for posicao in range(1, len(populares) + 1):
+        soma += 1.0 / (posicao ** 1.1)
+        pesos.append(soma)
+
+    porta = _porta_livre()
+    with open(os.path.join(pasta, f'servidor_{quantidade}.log'), 'w') as log:
+        servidor = _iniciar_servidor(args, banco, porta, log)
+        try:
+            url_base = f'http://127.0.0.1:{porta}'
+            inicio = time.monotonic() + 1.0
+            operadores = [Operador(numero, url_base, populares, pesos, args.semente * 1000 + numero,
+                                   inicio, inicio + args.duracao)
+                          for numero in range(1, quantidade + 1)]
+            for operador in operadores:
+                operador.entrar()
+            for operador in operadores:
+                operador.start()
+            for operador in operadores:
+                operador.join()
+            duracao = time.monotonic() - inicio
+        finally:
+            _parar_servidor(servidor)
+
+    problemas = _conferir(banco, estoque_inicial, ultima_venda, operadores)
+    vendas = sum(operador.vendas for operador in operadores)
+    tentativas = sum(operador.tentativas for operador in operadores)
+    erros = {}
+    for operador in operadores:
+        for tipo, total in operador.erros.items():
+            erros[tipo] = erros.get(tipo, 0) + total
+    latencias = {}
+    for tipo in ('leitura', 'finalizar'):
+        valores = sorted(ms for operador in operadores for ms in operador.latencias[tipo])
+        latencias[tipo] = {'p50': percentil(valores, 50), 'p95': percentil(valores, 95),
+                           'p99': percentil(valores, 99), 'max': valores[-1] if valores else None}
+    return {
+        'operadores': quantidade,
+        'duracao_s': duracao,
+        'vendas': vendas,
+        'vendas_por_s': vendas / duracao,
+        'vendas_por_operador': [operador.vendas for operador in operadores],
+        'latencia_ms': latencias,
+        'retentativas_travado': sum(operador.travados for operador in operadores),
+        'recusas_sem_estoque': sum(operador.sem_estoque for operador in operadores),
+        'erros': erros,
+        'taxa_erros': sum(erros.values()) / tentativas if tentativas else 0.0,
+        'divergencias': problemas,
+    }
+
+
+def _fmt(valor):
+    return '-' if valor is None else f'{valor:.1f}'
+
+
+def main():
+    args = _argumentos()
+    if not os.path.exists(args.banco):
+        sys.exit(f'{args.banco} não existe (gere com: python -m bench.gerar_dados --banco {args.banco}).')
+
+    pasta = tempfile.mkdtemp(prefix='carga_pdv_')
+    resultados = []
+    try:
+        modelo, populares = _preparar_modelo(args, pasta)
+        print(f"{'oper.':>5} {'vendas/s':>9} {'vendas':>7} {'fin p50':>8} {'fin p95':>8} {'fin p99':>8} "
+              f"{'leit p95':>8} {'travado':>8} {'s/estq':>7} {'erros':>7}  conferência")
+        for quantidade in args.operadores:
+            resultado = rodada(args, modelo, populares, quantidade, pasta)
+            resultados.append(resultado)
+            finalizar, leitura = resultado['latencia_ms']['finalizar'], resultado['latencia_ms']['leitura']
+            print(f"{quantidade:>5} {resultado['vendas_por_s']:>9.1f} {resultado['vendas']:>7} "
+                  f"{_fmt(finalizar['p50']):>8} {_fmt(finalizar['p95']):>8} {_fmt(finalizar['p99']):>8} "
+                  f"{_fmt(leitura['p95']):>8} {resultado['retentativas_travado']:>8} "
+                  f"{resultado['recusas_sem_estoque']:>7} {resultado['taxa_erros']:>6.1%}  "
+                  f"{'ok' if not resultado['divergencias'] else str(len(resultado['divergencias'])) + ' divergência(s)'}")
+            for tipo, total in sorted(resultado['erros'].items()):
+                print(f'        erro: {tipo} ({total}x)')
+            for problema in resultado['divergencias'][:20]:
+                print(f'        divergência: {problema}')
+    finally:
+        shutil.rmtree(pasta, ignore_errors=True)
+
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            json.dump({'gerado_em': datetime.now().isoformat(timespec='seconds'), 'banco': os.path.abspath(args.banco),
+                       'duracao_por_rodada_s': args.duracao, 'disputados': args.disputados,
+                       'estoque_disputado': args.estoque_disputado, 'rodadas': resultados},
+                      arquivo, indent=2, ensure_ascii=False)
+        print(f'Resultado gravado em {args.saida}')
+    if any(resultado['divergencias'] for resultado in resultados):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
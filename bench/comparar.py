@@ -0,0 +1,82 @@
+"""
+Compara dois resultados de bench.executar (antes e depois de uma mudança):
+vazão, latência p50/p95/p99 e consultas por requisição, por cenário e por
+tipo de requisição, com a variação percentual.
+
+    python -m bench.comparar antes.json depois.json
+"""
+import argparse
+import json
+
+# Variações menores que isto (em %) são tratadas como ruído e não marcadas
+LIMIAR_RUIDO = 5.0
+
+
+def _variacao(antes, depois, maior_e_melhor=False):
+    if antes is None or depois is None:
+        return '      -'
+    if not antes:
+        return '      =' if not depois else '   novo'
+    percentual = (depois - antes) / antes * 100
+    marca = ' '
+    if abs(percentual) >= LIMIAR_RUIDO:
+        melhorou = percentual > 0 if maior_e_melhor else percentual < 0
+        marca = '+' if melhorou else '!'
+    return f'{percentual:+6.1f}%{marca}'
+
+
+def _linha(rotulo, antes, depois):
+    colunas = [f'  {rotulo:28}']
+    for chave in ('p50', 'p95', 'p99'):
+        a = antes['latencia_ms'][chave] if antes else None
+        d = depois['latencia_ms'][chave] if depois else None
+        colunas.append(f"{_fmt(a):>9} -> {_fmt(d):>9} {_variacao(a, d)}")
+    a = antes['consultas_por_requisicao']['media'] if antes else None
+    d = depois['consultas_por_requisicao']['media'] if depois else None
+    colunas.append(f"{_fmt(a, 1):>7} -> {_fmt(d, 1):>7} {_variacao(a, d)}")
+    return '  '.join(colunas)
+
+
+def _fmt(valor, casas=2):
+    return '-' if valor is None else f'{valor:.{casas}f}'
+
+
+def comparar(antes, depois):
+    for nome_arquivo, resultado in (('antes ', antes), ('depois', depois)):
+        banco = resultado['banco']
+        print(f"{nome_arquivo}: commit {resultado.get('commit') or '?'} em {resultado['gerado_em']}, "
+              f"{banco['vendas']} vendas / {banco['produtos']} produtos, escala {resultado['escala']}")
+    if antes['banco']['vendas'] != depois['banco']['vendas'] or antes['escala'] != depois['escala']:
+        print('ATENÇÃO: bancos ou escalas diferentes; a comparação não é direta.')
+    print(f"(latências em ms; '+' melhorou, '!' piorou, variações abaixo de {LIMIAR_RUIDO:.0f}% são ruído)\n")
+
+    cabecalho = f"  {'':28}  {'p50':^28}  {'p95':^28}  {'p99':^28}  {'SQL/req':^24}"
+    for cenario in list(dict.fromkeys(list(antes['cenarios']) + list(depois['cenarios']))):
+        ca, cd = antes['cenarios'].get(cenario), depois['cenarios'].get(cenario)
+        if not ca or not cd:
+            print(f"{cenario}: só no resultado {'depois' if cd else 'antes'}\n")
+            continue
+        print(f"{cenario}: {ca['operacoes_por_s']:.1f} -> {cd['operacoes_por_s']:.1f} op/s "
+              f"{_variacao(ca['operacoes_por_s'], cd['operacoes_por_s'], maior_e_melhor=True)}")
+        print(cabecalho)
+        print(_linha('(todas)', ca, cd))
+        rotulos = list(dict.fromkeys(list(ca['por_requisicao']) + list(cd['por_requisicao'])))
+        for rotulo in rotulos:
+            print(_linha(rotulo, ca['por_requisicao'].get(rotulo), cd['por_requisicao'].get(rotulo)))
+        print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('antes')
+    parser.add_argument('depois')
+    args = parser.parse_args()
+    with open(args.antes, encoding='utf-8') as arquivo:
+        antes = json.load(arquivo)
+    with open(args.depois, encoding='utf-8') as arquivo:
+        depois = json.load(arquivo)
+    comparar(antes, depois)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+"""
+Executa os cenários de benchmark sobre uma cópia de um banco gerado por
+bench.gerar_dados e grava o resultado em JSON (vazão, latência p50/p95/p99
+e consultas SQL por requisição), para comparar com bench.comparar.
+
+    python -m bench.executar --banco /tmp/bench.db --saida resultado.json
+    python -m bench.executar --banco /tmp/bench.db --cenarios checkout busca_f2 --escala 2
+
+As requisições passam pelo cliente de testes do Flask (mesmo processo, sem
+rede): mede o custo do app e do banco, não o do servidor HTTP.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+from bench.gerar_dados import EMAIL_ADMIN, SENHA_ADMIN, SENHA_OPERADORES
+
+CENARIOS = ['checkout', 'busca_f2', 'fechamento_caixa', 'relatorios_30d', 'exportacao_excel']
+
+
+def _argumentos():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--banco', required=True, help='Banco gerado por bench.gerar_dados (não é alterado)')
+    parser.add_argument('--cenarios', nargs='+', choices=CENARIOS, default=CENARIOS)
+    parser.add_argument('--escala', type=float, default=1.0, help='Multiplica o número de operações de cada cenário')
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--saida', help='Arquivo JSON do resultado (padrão: só imprime o resumo)')
+    return parser.parse_args()
+
+
+def percentil(valores_ordenados, p):
+    """Percentil pelo método do posto mais próximo (valores já ordenados)."""
+    if not valores_ordenados:
+        return None
+    posicao = max(0, min(len(valores_ordenados) - 1, int(round(p / 100.0 * len(valores_ordenados) + 0.5)) - 1))
+    return valores_ordenados[posicao]
+
+
+def resumir(amostras):
+    """amostras: [(ms, consultas)] -> latências e consultas por requisição"""
+    latencias = sorted(ms for ms, _ in amostras)
+    consultas = [quantidade for _, quantidade in amostras]
+    return {
+        'requisicoes': len(amostras),
+        'latencia_ms': {
+            'p50': percentil(latencias, 50), 'p95': percentil(latencias, 95), 'p99': percentil(latencias, 99),
+            'media': sum(latencias) / len(latencias), 'max': latencias[-1],
+        },
+        'consultas_por_requisicao': {'media': sum(consultas) / len(consultas), 'max': max(consultas)},
+    }
+
+
+class Medidor:
+    """Cliente do Flask que mede cada requisição (tempo e comandos SQL) por rótulo."""
+
+    def __init__(self, app, contador):
+        self.cliente = app.test_client()
+        self.contador = contador
+        self.amostras = {}
+
+    def login(self, email, senha):
+        resposta = self.cliente.post('/login', data={'email': email, 'senha': senha})
+        assert resposta.status_code == 302, f'login falhou para {email}'
+
+    def __call__(self, rotulo, metodo, url, esperado=(200,), **kwargs):
+        consultas_antes = self.contador[0]
+        inicio = time.perf_counter()
+        resposta = self.cliente.open(url, method=metodo, **kwargs)
+        duracao_ms = (time.perf_counter() - inicio) * 1000
+        if resposta.status_code not in esperado:
+            raise RuntimeError(f'{metodo} {url}: HTTP {resposta.status_code} {resposta.get_data(as_text=True)[:200]}')
+        self.amostras.setdefault(rotulo, []).append((duracao_ms, self.contador[0] - consultas_antes))
+        return resposta
+
+
+def _abrir_caixa(medidor):
+    if medidor.cliente.get('/caixa/abrir').status_code == 200:
+        medidor.cliente.post('/caixa/abrir', data={'saldo_inicial': '100'})
+
+
+# =============================================================================
+# CENÁRIOS
+# Cada um retorna o número de operações (vendas, buscas, fechamentos...)
+# =============================================================================
+
+def cenario_checkout(app, contador, contexto, escala):
+    """Caixa com leitor: 1 a 8 scans por venda e a finalização."""
+    medir = Medidor(app, contador)
+    medir.login('operador1@loja.com', SENHA_OPERADORES)
+    _abrir_caixa(medir)
+    rnd = contexto['rnd']
+    vendas = int(200 * escala)
+    for _ in range(vendas):
+        itens, total = [], 0.0
+        for codigo in rnd.sample(contexto['codigos'], rnd.randint(1, 8)):
+            produto = medir('scan', 'GET', f'/api/produto/{codigo}').get_json()
+            quantidade = rnd.choice([1, 1, 1, 2])
+            itens.append({'id': produto['id'], 'quantidade': quantidade})
+            total += produto['preco_venda'] * quantidade
+        medir('finalizar', 'POST', '/vendas/finalizar', json={
+            'uuid': str(uuid.UUID(int=rnd.getrandbits(128))),
+            'itens': itens,
+            'pagamentos': [{'forma_pagamento': 'pix', 'valor': round(total + 0.005, 2)}],
+        })
+    return vendas, medir.amostras
+
+
+def cenario_busca_f2(app, contador, contexto, escala):
+    """Digitação na busca por nome (F2): uma requisição por letra, a partir da 2ª."""
+    medir = Medidor(app, contador)
+    medir.login('operador2@loja.com', SENHA_OPERADORES)
+    _abrir_caixa(medir)
+    buscas = 0
+    for nome in contexto['rnd'].sample(contexto['nomes'], int(50 * escala)):
+        for tamanho in range(2, min(len(nome), 10) + 1):
+            medir('busca', 'GET', '/api/produtos/buscar', query_string={'nome': nome[:tamanho]})
+            buscas += 1
+    return buscas, medir.amostras
+
+
+def cenario_fechamento_caixa(app, contador, contexto, escala):
+    """Conferência e fechamento do caixa (e reabertura para o próximo ciclo)."""
+    medir = Medidor(app, contador)
+    medir.login('operador3@loja.com', SENHA_OPERADORES)
+    ciclos = int(20 * escala)
+    for _ in range(ciclos):
+        _abrir_caixa(medir)
+        medir('fechar_conferencia', 'GET', '/caixa/fechar')
+        medir('cupom_fechamento', 'GET', '/caixa/cupom_fechamento')
+        medir('fechar', 'POST', '/caixa/fechar', esperado=(302,), data={'saldo_final': '100'})
+    return ciclos, medir.amostras
+
+
+def cenario_relatorios_30d(app, contador, contexto, escala):
+    """Relatórios do administrador para os últimos 30 dias."""
+    medir = Medidor(app, contador)
+    medir.login(EMAIL_ADMIN, SENHA_ADMIN)
+    periodo = {'inicio': (date.today() - timedelta(days=29)).isoformat(), 'fim': date.today().isoformat()}
+    rodadas = int(10 * escala)
+    for _ in range(rodadas):
+        medir('dashboard', 'GET', '/dashboard')
+        medir('relatorios', 'GET', '/relatorios', query_string=periodo)
+        medir('relatorio_cupons', 'GET', '/relatorio_cupons', query_string=periodo)
+        medir('recebimentos_consolidados', 'GET', '/relatorios/recebimentos_consolidados', query_string=periodo)
+    return rodadas, medir.amostras
+
+
+def cenario_exportacao_excel(app, contador, contexto, escala):
+    """Exportação em Excel dos últimos 30 dias: do pedido ao arquivo pronto (tarefa em segundo plano)."""
+    medir = Medidor(app, contador)
+    medir.login(EMAIL_ADMIN, SENHA_ADMIN)
+    periodo = {'inicio': (date.today() - timedelta(days=29)).isoformat(), 'fim': date.today().isoformat(),
+               'formato': 'xlsx'}
+    exportacoes = max(1, int(2 * escala))
+    for _ in range(exportacoes):
+        consultas_antes = contador[0]
+        inicio = time.perf_counter()
+        resposta = medir.cliente.get('/relatorios/exportar', query_string=periodo)
+        tarefa_id = resposta.location.rsplit('/', 1)[1]
+        while True:
+            situacao = medir.cliente.get(f'/jobs/{tarefa_id}').get_json()
+            if situacao['status'] in ('concluida', 'erro'):
+                break
+            time.sleep(0.02)
+        if situacao['status'] == 'erro':
+            raise RuntimeError(f"exportação falhou: {situacao['mensagem']}")
+        medir.amostras.setdefault('exportar_xlsx', []).append(
+            ((time.perf_counter() - inicio) * 1000, contador[0] - consultas_antes))
+    return exportacoes, medir.amostras
+
+
+# =============================================================================
+# EXECUÇÃO
+# =============================================================================
+
+def _commit_atual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def executar(args):
+    # Cópia descartável: os cenários gravam vendas e fecham caixas
+    pasta = tempfile.mkdtemp(prefix='bench_pdv_')
+    banco = os.path.join(pasta, 'bench.db')
+    with sqlite3.connect(os.path.abspath(args.banco)) as origem, sqlite3.connect(banco) as destino:
+        origem.backup(destino)
+    os.environ['PDV_DATABASE_URI'] = f'sqlite:///{banco}'
+
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    import app as modulo_app
+    from catalogo import catalogo
+    from database import db
+    from models import Produto, Venda
+
+    contador = [0]
+    event.listen(Engine, 'before_cursor_execute', lambda *_: contador.__setitem__(0, contador[0] + 1))
+
+    app = modulo_app.app
+    with app.app_context():
+        modulo_app.preparar_banco()
+        catalogo.carregar()
+        produtos = db.session.query(Produto.codigo_barras, Produto.nome).filter(
+            Produto.ativo == True, Produto.estoque_atual > 1000).all()
+        contexto = {
+            'rnd': random.Random(args.semente),
+            'codigos': [codigo for codigo, _ in produtos],
+            'nomes': [nome for _, nome in produtos],
+        }
+        banco_info = {
+            'arquivo': os.path.abspath(args.banco),
+            'tamanho_mb': round(os.path.getsize(args.banco) / 1048576, 1),
+            'produtos': Produto.query.count(),
+            'vendas': Venda.query.count(),
+        }
+
+    resultado = {
+        'gerado_em': datetime.now().isoformat(timespec='seconds'),
+        'commit': _commit_atual(),
+        'ambiente': {'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+                     'plataforma': platform.platform()},
+        'banco': banco_info,
+        'escala': args.escala,
+        'cenarios': {},
+    }
+    try:
+        for nome in args.cenarios:
+            funcao = globals()[f'cenario_{nome}']
+            inicio = time.perf_counter()
+            operacoes, amostras = funcao(app, contador, contexto, args.escala)
+            duracao = time.perf_counter() - inicio
+            todas = [amostra for lista in amostras.values() for amostra in lista]
+            resultado['cenarios'][nome] = dict(
+                resumir(todas),
+                operacoes=operacoes,
+                duracao_s=duracao,
+                operacoes_por_s=operacoes / duracao,
+                requisicoes_por_s=len(todas) / duracao,
+                por_requisicao={rotulo: resumir(lista) for rotulo, lista in amostras.items()},
+            )
+            dados = resultado['cenarios'][nome]
+            print(f"{nome:18} {operacoes:6} op  {dados['operacoes_por_s']:9.1f} op/s  "
+                  f"p50 {dados['latencia_ms']['p50']:8.2f} ms  p95 {dados['latencia_ms']['p95']:8.2f} ms  "
+                  f"p99 {dados['latencia_ms']['p99']:8.2f} ms  {dados['consultas_por_requisicao']['media']:5.1f} SQL/req")
+    finally:
+        shutil.rmtree(pasta, ignore_errors=True)
+
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            json.dump(resultado, arquivo, indent=2, ensure_ascii=False)
+        print(f'Resultado gravado em {args.saida}')
+    return resultado
+
+
+def main():
+    args = _argumentos()
+    if not os.path.exists(args.banco):
+        sys.exit(f'{args.banco} não existe (gere com: python -m bench.gerar_dados --banco {args.banco}).')
+    executar(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+"""
+Gera um banco SQLite sintético para os benchmarks: produtos, operadores,
+meses de movimentos de caixa e vendas (itens e pagamentos), com resumos e
+totais dos caixas reconstruídos como em produção.
+
+    python -m bench.gerar_dados --banco /tmp/bench.db --produtos 5000 --operadores 8 --meses 6
+
+As distribuições são fixas pela semente (--semente): o mesmo comando gera
+sempre o mesmo banco.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+# Usuários criados (senhas usadas por bench.executar)
+EMAIL_ADMIN, SENHA_ADMIN = 'admin@loja.com', 'admin123'
+SENHA_OPERADORES = 'caixa123'
+
+CATEGORIAS = {
+    'Alimentos': ['Arroz', 'Feijão', 'Macarrão', 'Farinha', 'Açúcar', 'Café', 'Óleo', 'Biscoito', 'Leite', 'Milho'],
+    'Bebidas': ['Refrigerante', 'Suco', 'Água Mineral', 'Cerveja', 'Chá', 'Energético', 'Achocolatado'],
+    'Limpeza': ['Detergente', 'Sabão em Pó', 'Desinfetante', 'Amaciante', 'Esponja', 'Água Sanitária'],
+    'Higiene': ['Sabonete', 'Shampoo', 'Creme Dental', 'Desodorante', 'Papel Higiênico', 'Condicionador'],
+    'Mercearia': ['Salgadinho', 'Chocolate', 'Bala', 'Pipoca', 'Amendoim', 'Torrada', 'Geleia'],
+}
+MARCAS = ['Bom Dia', 'Da Casa', 'Nordeste', 'Pirambu', 'Serrano', 'Estrela', 'Primor', 'Vale Verde', 'Sol', 'Mar Azul']
+EMBALAGENS = ['200g', '500g', '1kg', '2kg', '350ml', '1L', '2L', '90g', 'un', 'pct 6un']
+
+# Vendas: formas de pagamento (a última é dinheiro + pix) e chance de cancelamento
+PESOS_PAGAMENTO = [('dinheiro', 40), ('cartao', 35), ('pix', 20), ('dividido', 5)]
+CHANCE_CANCELAMENTO = 0.01
+
+LINHAS_POR_LOTE = 20000
+
+
+def _argumentos():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--banco', required=True, help='Arquivo SQLite a criar')
+    parser.add_argument('--produtos', type=int, default=5000)
+    parser.add_argument('--operadores', type=int, default=8)
+    parser.add_argument('--meses', type=int, default=6)
+    parser.add_argument('--vendas-por-dia', type=int, default=600, help='Média de vendas por dia (todos os caixas)')
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--substituir', action='store_true', help='Apaga o arquivo se ele já existir')
+    return parser.parse_args()
+
+
+def _gerar_produtos(rnd, quantidade):
+    produtos = []
+    nomes_usados = set()
+    for indice in range(quantidade):
+        categoria = rnd.choice(list(CATEGORIAS))
+        nome = f'{rnd.choice(CATEGORIAS[categoria])} {rnd.choice(MARCAS)} {rnd.choice(EMBALAGENS)}'
+        if nome in nomes_usados:
+            nome = f'{nome} {indice}'
+        nomes_usados.add(nome)
+        preco = round(min(max(rnd.lognormvariate(2.0, 0.8), 0.99), 150.0), 2)
+        produtos.append({
+            'id': indice + 1,
+            'codigo_barras': f'789{indice:010d}',
+            'nome': nome,
+            'descricao': None,
+            'preco_venda': preco,
+            'preco_custo': round(preco * rnd.uniform(0.55, 0.8), 2),
+            'categoria': categoria,
+            # Estoque alto para os cenários de venda não esgotarem; ~5% abaixo do mínimo (dashboard)
+            'estoque_atual': rnd.randint(0, 9) if rnd.random() < 0.05 else 1_000_000,
+            'estoque_minimo': 10,
+            'ativo': True,
+            'data_criacao': datetime(2020, 1, 1),
+            'data_atualizacao': datetime(2020, 1, 1),
+            'imagem_url': None,
+            'versao': 0,
+        })
+    return produtos
+
+
+def _pagamentos(rnd, valor_total):
+    """[(forma, valor)] e valor pago (dinheiro arredondado para cima: gera troco)"""
+    forma = rnd.choices([f for f, _ in PESOS_PAGAMENTO], [p for _, p in PESOS_PAGAMENTO])[0]
+    if forma == 'dinheiro':
+        cedula = next(c for c in (2, 5, 10, 20, 50, 100, 200, 10_000) if c >= valor_total)
+        pago = rnd.choice([valor_total, float(cedula)]) if valor_total < 200 else valor_total
+        return [('dinheiro', round(pago, 2))]
+    if forma == 'dividido':
+        parte = round(valor_total * rnd.uniform(0.2, 0.8), 2)
+        return [('dinheiro', parte), ('pix', round(valor_total - parte, 2))]
+    return [(forma, round(valor_total, 2))]
+
+
+def gerar(args):
+    from database import db
+    from models import Usuario, Produto, Venda, ItemVenda, PagamentoVenda, MovimentoCaixa, Sequencia
+    from resumos import reconstruir_resumos
+    from sqlalchemy import insert, update
+    import app as modulo_app
+
+    rnd = random.Random(args.semente)
+    inicio = time.perf_counter()
+
+    with modulo_app.app.app_context():
+        modulo_app.preparar_banco()
+
+        # Usuários (o hash da senha é lento: um por usuário)
+        admin = Usuario(nome='Administrador', email=EMAIL_ADMIN, perfil='admin')
+        admin.set_senha(SENHA_ADMIN)
+        db.session.add(admin)
+        operadores = []
+        for numero in range(1, args.operadores + 1):
+            operador = Usuario(nome=f'Operador {numero}', email=f'operador{numero}@loja.com', perfil='caixa')
+            operador.set_senha(SENHA_OPERADORES)
+            db.session.add(operador)
+            operadores.append(operador)
+        db.session.flush()
+        ids_operadores = [operador.id for operador in operadores]
+
+        produtos = _gerar_produtos(rnd, args.produtos)
+        db.session.execute(insert(Produto.__table__), produtos)
+
+        # Popularidade de Zipf: poucos produtos concentram a maior parte das vendas
+        pesos = [1.0 / (posicao ** 1.1) for posicao in range(1, len(produtos) + 1)]
+        por_popularidade = produtos[:]
+        rnd.shuffle(por_popularidade)
+        acumulado, soma = [], 0.0
+        for peso in pesos:
+            soma += peso
+            acumulado.append(soma)
+
+        movimentos, vendas, itens, pagamentos = [], [], [], []
+        venda_id = item_id = pagamento_id = movimento_id = 0
+
+        def gravar_lote(final=False):
+            for modelo, linhas in ((MovimentoCaixa, movimentos), (Venda, vendas),
+                                   (ItemVenda, itens), (PagamentoVenda, pagamentos)):
+                if linhas and (final or len(linhas) >= LINHAS_POR_LOTE):
+                    db.session.execute(insert(modelo.__table__), linhas)
+                    linhas.clear()
+
+        ultimo_dia = date.today() - timedelta(days=1)
+        dias = args.meses * 30
+        for deslocamento in range(dias, 0, -1):
+            dia = ultimo_dia - timedelta(days=deslocamento - 1)
+            # Fim de semana mais movimentado
+            fator_dia = 1.3 if dia.weekday() >= 5 else 1.0
+            presentes = [op for op in ids_operadores if rnd.random() < 0.8] or ids_operadores[:1]
+            vendas_dia = max(1, int(rnd.gauss(args.vendas_por_dia * fator_dia, args.vendas_por_dia * 0.15)))
+
+            for usuario_id in presentes:
+                movimento_id += 1
+                abertura = datetime.combine(dia, datetime.min.time()) + timedelta(hours=8, minutes=rnd.randint(0, 30))
+                fechamento = abertura + timedelta(hours=10)
+                movimentos.append({
+                    'id': movimento_id, 'usuario_id': usuario_id, 'status': 'fechado',
+                    'data_abertura': abertura, 'data_fechamento': fechamento,
+                    'saldo_inicial': 100.0, 'saldo_final': None,
+                })
+
+                for _ in range(vendas_dia // len(presentes)):
+                    venda_id += 1
+                    momento = abertura + timedelta(seconds=rnd.randint(60, 10 * 3600 - 60))
+                    num_linhas = min(25, 1 + int(rnd.expovariate(0.35)))
+                    valor_total = 0.0
+                    num_itens = 0
+                    for produto in rnd.choices(por_popularidade, cum_weights=acumulado, k=num_linhas):
+                        quantidade = rnd.choices([1, 2, 3, 4, 6], [80, 12, 4, 2, 2])[0]
+                        subtotal = produto['preco_venda'] * quantidade
+                        item_id += 1
+                        itens.append({'id': item_id, 'venda_id': venda_id, 'produto_id': produto['id'],
+                                      'quantidade': quantidade, 'preco_unitario': produto['preco_venda'],
+                                      'subtotal': subtotal})
+                        valor_total += subtotal
+                        num_itens += quantidade
+
+                    valor_pago = 0.0
+                    for forma, valor in _pagamentos(rnd, valor_total):
+                        pagamento_id += 1
+                        pagamentos.append({'id': pagamento_id, 'venda_id': venda_id, 'forma_pagamento': forma,
+                                           'valor': valor, 'data_pagamento': momento})
+                        valor_pago += valor
+                    vendas.append({
+                        'id': venda_id, 'numero_venda': str(venda_id), 'data_venda': momento,
+                        'status': 'cancelada' if rnd.random() < CHANCE_CANCELAMENTO else 'finalizada',
+                        'usuario_id': usuario_id, 'uuid': None, 'movimento_caixa_id': movimento_id,
+                        'valor_total': valor_total, 'valor_pago': valor_pago,
+                        'troco': max(0.0, valor_pago - valor_total), 'num_itens': num_itens,
+                    })
+            gravar_lote()
+        gravar_lote(final=True)
+
+        # Resumos diários e totais dos caixas, como depois da migração de um banco real
+        reconstruir_resumos()
+        db.session.execute(update(Sequencia.__table__).where(Sequencia.nome == 'vendas').values(valor=venda_id))
+        db.session.commit()
+
+    duracao = time.perf_counter() - inicio
+    print(f'{args.banco}: {args.produtos} produtos, {args.operadores} operadores, {movimento_id} movimentos, '
+          f'{venda_id} vendas, {item_id} itens, {pagamento_id} pagamentos em {duracao:.1f}s '
+          f'({os.path.getsize(args.banco) / 1048576:.1f} MB)')
+
+
+def main():
+    args = _argumentos()
+    args.banco = os.path.abspath(args.banco)
+    if os.path.exists(args.banco):
+        if not args.substituir:
+            sys.exit(f'{args.banco} já existe (use --substituir).')
+        for sufixo in ('', '-wal', '-shm'):
+            if os.path.exists(args.banco + sufixo):
+                os.remove(args.banco + sufixo)
+    # Antes de importar o app: o create_app() lê o banco da variável de ambiente
+    os.environ['PDV_DATABASE_URI'] = f'sqlite:///{args.banco}'
+    gerar(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Mede a inicialização do PDV: tempo de 'import app' e memória residente
+do processo logo depois, em processos Python novos (sem cache de módulos).
+Também confere que nenhum módulo pesado (pandas, numpy, openpyxl) foi
+carregado só por importar o app; eles ficam para as tarefas que os usam.
+
+    python -m bench.inicializacao
+    python -m bench.inicializacao --repeticoes 20 --limite-ms 800 --saida inicio.json
+
+Sai com código 1 se um módulo pesado for carregado ou se a mediana passar de
+--limite-ms (para não regredir sem perceber).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Módulos que não devem ser carregados na importação do app
+MODULOS_PESADOS = ['pandas', 'numpy', 'openpyxl']
+
+# Executado em cada processo filho: mede o import e informa em JSON
+_MEDICAO = r'''
+import json, sys, time
+inicio = time.perf_counter()
+import app
+duracao_ms = (time.perf_counter() - inicio) * 1000
+try:
+    import resource
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1048576 if sys.platform == 'darwin' else 1024)
+except ImportError:
+    rss_mb = None
+print(json.dumps({
+    'import_ms': duracao_ms,
+    'rss_mb': rss_mb,
+    'modulos': len(sys.modules),
+    'pesados': [nome for nome in %r if nome in sys.modules],
+}))
+'''
+
+
+def _argumentos():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeticoes', type=int, default=10)
+    parser.add_argument('--limite-ms', type=float, help='Falha se a mediana do import passar disto')
+    parser.add_argument('--saida', help='Arquivo JSON do resultado (padrão: só imprime o resumo)')
+    return parser.parse_args()
+
+
+def medir_uma_vez(raiz, banco):
+    ambiente = dict(os.environ, PDV_DATABASE_URI=f'sqlite:///{banco}')
+    saida = subprocess.run([sys.executable, '-c', _MEDICAO % (MODULOS_PESADOS,)], cwd=raiz, env=ambiente,
+                           capture_output=True, text=True)
+    if saida.returncode != 0:
+        raise RuntimeError(f'import app falhou:\n{saida.stderr}')
+    return json.loads(saida.stdout.strip().splitlines()[-1])
+
+
+def executar(args):
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory(prefix='bench_pdv_') as pasta:
+        banco = os.path.join(pasta, 'inicio.db')
+        medir_uma_vez(raiz, banco)  # Aquecimento: .pyc e cache de disco
+        medicoes = [medir_uma_vez(raiz, banco) for _ in range(args.repeticoes)]
+
+    tempos = sorted(medicao['import_ms'] for medicao in medicoes)
+    memorias = [medicao['rss_mb'] for medicao in medicoes if medicao['rss_mb'] is not None]
+    pesados = sorted({nome for medicao in medicoes for nome in medicao['pesados']})
+    resultado = {
+        'repeticoes': args.repeticoes,
+        'import_ms': {'mediana': statistics.median(tempos), 'min': tempos[0], 'max': tempos[-1]},
+        'rss_mb': statistics.median(memorias) if memorias else None,
+        'modulos': medicoes[-1]['modulos'],
+        'pesados_carregados': pesados,
+    }
+    print(f"import app: mediana {resultado['import_ms']['mediana']:.0f} ms "
+          f"(min {tempos[0]:.0f}, max {tempos[-1]:.0f}) em {args.repeticoes} processos")
+    if resultado['rss_mb'] is not None:
+        print(f"memória residente após o import: {resultado['rss_mb']:.1f} MB, {resultado['modulos']} módulos")
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            json.dump(resultado, arquivo, indent=2, ensure_ascii=False)
+        print(f'Resultado gravado em {args.saida}')
+
+    falhas = []
+    if pesados:
+        falhas.append(f"módulos pesados carregados no import: {', '.join(pesados)}")
+    if args.limite_ms is not None and resultado['import_ms']['mediana'] > args.limite_ms:
+        falhas.append(f"mediana acima do limite de {args.limite_ms:.0f} ms")
+    for falha in falhas:
+        print(f'FALHA: {falha}')
+    return resultado, not falhas
+
+
+def main():
+    _, ok = executar(_argumentos())
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
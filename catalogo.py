@@ -0,0 +1,540 @@
+import bisect
+import heapq
+import itertools
+import re
+import threading
+import unicodedata
+from operator import itemgetter
+from time import monotonic
+
+from sqlalchemy import func, select
+
+from database import db
+from models import Produto
+
+
+_RE_TOKEN = re.compile(r'[a-z0-9]+')
+
+
+def normalizar(texto):
+    """Converte para minúsculas e remove acentos ('Café em Pó' -> 'cafe em po')."""
+    decomposto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in decomposto if not unicodedata.combining(c)).lower()
+
+
+_VAZIO = frozenset()
+
+# Quantas consultas a conjunto valem a conferência de um candidato no nome/código
+# (busca com várias palavras, ver CatalogoProdutos._casamentos_dentro)
+_CUSTO_CONFERENCIA = 20
+
+
+def proxima_versao():
+    """
+    Expressão SQL da próxima versão do catálogo (MAX(versao) + 1), para atribuir
+    a Produto.versao ao criar/alterar/desativar. É avaliada dentro do próprio
+    INSERT/UPDATE, já com a trava de escrita do SQLite: duas alterações
+    simultâneas não recebem a mesma versão.
+    """
+    return select(func.coalesce(func.max(Produto.versao), 0) + 1).scalar_subquery()
+
+
+def proxima_versao_estoque():
+    """
+    Como proxima_versao(), para Produto.estoque_versao: atribuída nas baixas e
+    devoluções de estoque das vendas, que não mudam a versão do catálogo.
+    """
+    return select(func.coalesce(func.max(Produto.estoque_versao), 0) + 1).scalar_subquery()
+
+
+def _versoes():
+    """
+    (MAX(versao), MAX(estoque_versao)) dos produtos. Cada MAX fica na sua
+    subconsulta: assim o SQLite lê só a ponta do índice de cada coluna.
+    """
+    return tuple(db.session.execute(select(
+        select(func.coalesce(func.max(Produto.versao), 0)).scalar_subquery(),
+        select(func.coalesce(func.max(Produto.estoque_versao), 0)).scalar_subquery(),
+    )).one())
+
+
+def _trigramas(texto):
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class CatalogoProdutos:
+    """
+    Índice em memória dos produtos ATIVOS, por código de barras e por ID.
+    Usado pelo PDV para responder às leituras do scanner sem ir ao banco.
+
+    Também mantém um índice de busca textual (F2): palavras normalizadas
+    (sem acento) para busca por prefixo, trigramas para trechos no meio do
+    nome, e os códigos de barras ordenados para busca pelo início ou final.
+
+    O índice é carregado uma vez (na inicialização ou no primeiro uso) e
+    mantido pelas rotas que alteram produtos: cadastro, edição, desativação,
+    importação e as baixas/devoluções de estoque das vendas.
+
+    Com vários processos (workers do pdv serve), cada um tem o seu índice: a
+    cada 'intervalo_sincronizacao' segundos ele aplica o que os outros
+    alteraram (produtos com versão maior que a dele) e relê o estoque dos
+    produtos com baixas/devoluções mais novas (Produto.estoque_versao).
+    """
+
+    # Segundos entre as conferências de Produto.versao (0 desliga)
+    intervalo_sincronizacao = 5
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._por_id = {}
+        self._por_codigo = {}
+        # Índice de busca: id -> (nome normalizado, id), token -> ids, trigrama -> ids
+        # e listas ordenadas de (nome, id), (código, id) e (código invertido, id)
+        self._textos = {}
+        self._ordem = []
+        self._tokens = {}
+        self._tokens_ordenados = []
+        self._trigramas = {}
+        self._codigos = []
+        self._codigos_invertidos = []
+        # IDs com estoque_atual <= estoque_minimo (contador do dashboard)
+        self._estoque_baixo = set()
+        self._carregado = False
+        # Maiores Produto.versao e Produto.estoque_versao já aplicadas ao índice e quando conferir de novo
+        self._versao = 0
+        self._versao_estoque = 0
+        self._proxima_sincronizacao = 0.0
+
+    @staticmethod
+    def _entrada(produto):
+        """Cria o registro (dict) guardado no índice a partir de um Produto."""
+        return {
+            'id': produto.id,
+            'codigo_barras': produto.codigo_barras,
+            'nome': produto.nome,
+            'preco_venda': produto.preco_venda,
+            'estoque_atual': produto.estoque_atual or 0,
+            'estoque_minimo': produto.estoque_minimo or 0,
+            'imagem_url': produto.imagem_url,
+        }
+
+    def carregar(self):
+        """(Re)constrói o índice completo a partir do banco."""
+        # Lidas antes dos produtos: o que mudar entre as duas consultas é reaplicado na sincronização
+        versao, versao_estoque = _versoes()
+        linhas = db.session.query(
+            Produto.id, Produto.codigo_barras, Produto.nome, Produto.preco_venda,
+            Produto.estoque_atual, Produto.estoque_minimo, Produto.imagem_url
+        ).filter(Produto.ativo == True).all()
+
+        with self._lock:
+            self._por_id = {}
+            self._por_codigo = {}
+            self._textos = {}
+            self._tokens = {}
+            self._trigramas = {}
+            self._estoque_baixo = set()
+            for linha in linhas:
+                self._inserir_sem_lock(self._entrada(linha))
+            self._tokens_ordenados = sorted(self._tokens)
+            self._ordem = sorted(self._textos.values())
+            self._codigos = sorted((normalizar(e['codigo_barras']), i) for i, e in self._por_id.items())
+            self._codigos_invertidos = sorted((c[::-1], i) for c, i in self._codigos)
+            self._versao = versao
+            self._versao_estoque = versao_estoque
+            self._proxima_sincronizacao = monotonic() + self.intervalo_sincronizacao
+            self._carregado = True
+
+    def invalidar(self):
+        """Descarta o índice; ele será recarregado no próximo uso."""
+        with self._lock:
+            self._carregado = False
+
+    def _garantir_carregado(self):
+        if not self._carregado:
+            with self._lock:
+                if not self._carregado:
+                    self.carregar()
+        elif self.intervalo_sincronizacao and monotonic() >= self._proxima_sincronizacao:
+            self.sincronizar()
+
+    def sincronizar(self):
+        """
+        Aplica ao índice os produtos alterados por outros processos (versão
+        maior que a do índice) e o estoque atual dos produtos vendidos ou
+        devolvidos desde a última conferência (versão de estoque maior). O
+        estoque em memória fica até 'intervalo_sincronizacao' segundos
+        defasado; o saldo real continua sendo validado em finalizar_venda.
+        """
+        with self._lock:
+            if monotonic() < self._proxima_sincronizacao:
+                return  # Outra thread acabou de conferir
+            self._proxima_sincronizacao = monotonic() + self.intervalo_sincronizacao
+            versao_indice = self._versao
+            versao_estoque_indice = self._versao_estoque
+
+        versao, versao_estoque = _versoes()
+        if versao < versao_indice or versao_estoque < versao_estoque_indice:
+            self.carregar()  # Banco restaurado de um backup: recomeça do zero
+            return
+
+        if versao > versao_indice:
+            alterados = db.session.query(
+                Produto.id, Produto.codigo_barras, Produto.nome, Produto.preco_venda, Produto.estoque_atual,
+                Produto.estoque_minimo, Produto.imagem_url, Produto.ativo
+            ).filter(Produto.versao > versao_indice).all()
+            with self._lock:
+                for produto in alterados:
+                    self.atualizar(produto)
+                self._versao = max(self._versao, versao)
+
+        if versao_estoque > versao_estoque_indice:
+            # Valor absoluto do banco (já inclui as baixas deste processo, somadas antes em ajustar_estoque)
+            estoques = db.session.query(Produto.id, Produto.estoque_atual).filter(
+                Produto.estoque_versao > versao_estoque_indice
+            ).all()
+            with self._lock:
+                for produto_id, estoque_atual in estoques:
+                    entrada = self._por_id.get(produto_id)
+                    if entrada is not None:
+                        entrada['estoque_atual'] = estoque_atual or 0
+                        self._marcar_estoque_sem_lock(entrada)
+                self._versao_estoque = max(self._versao_estoque, versao_estoque)
+
+    def buscar(self, codigo):
+        """
+        Busca um produto ativo pelo código de barras e, se não achar,
+        pelo ID (Código do Produto). Retorna o dict do índice ou None.
+        """
+        self._garantir_carregado()
+
+        entrada = self._por_codigo.get(codigo)
+        if entrada is None:
+            try:
+                entrada = self._por_id.get(int(codigo))
+            except ValueError:
+                # Se o código não for um número, ignora a busca por ID
+                pass
+        return entrada
+
+    def atualizar(self, produto):
+        """Insere/atualiza um produto no índice (ou o remove, se inativo)."""
+        if not self._carregado:
+            return  # Será lido do banco na próxima carga completa
+
+        with self._lock:
+            self._remover_sem_lock(produto.id)
+            if produto.ativo:
+                novos = self._inserir_sem_lock(self._entrada(produto))
+                for token in novos:
+                    bisect.insort(self._tokens_ordenados, token)
+                bisect.insort(self._ordem, self._textos[produto.id])
+                codigo = normalizar(produto.codigo_barras)
+                bisect.insort(self._codigos, (codigo, produto.id))
+                bisect.insort(self._codigos_invertidos, (codigo[::-1], produto.id))
+
+    def remover(self, produto_id):
+        """Remove um produto do índice (ex: desativado)."""
+        if not self._carregado:
+            return
+
+        with self._lock:
+            self._remover_sem_lock(produto_id)
+
+    def ajustar_estoque(self, produto_id, delta):
+        """
+        Soma 'delta' ao estoque em memória (negativo na venda, positivo no
+        estorno). Os outros processos recebem a alteração pela versão de estoque.
+        """
+        with self._lock:
+            entrada = self._por_id.get(produto_id)
+            if entrada is not None:
+                entrada['estoque_atual'] += delta
+                self._marcar_estoque_sem_lock(entrada)
+
+    def contar_estoque_baixo(self):
+        """Quantidade de produtos ativos com estoque no mínimo ou abaixo (sem ir ao banco)."""
+        self._garantir_carregado()
+        return len(self._estoque_baixo)
+
+    def _marcar_estoque_sem_lock(self, entrada):
+        if entrada['estoque_atual'] <= entrada['estoque_minimo']:
+            self._estoque_baixo.add(entrada['id'])
+        else:
+            self._estoque_baixo.discard(entrada['id'])
+
+    def _inserir_sem_lock(self, entrada):
+        """
+        Indexa uma entrada nos dicionários. As listas ordenadas ficam a cargo
+        de quem chama; retorna os tokens que ainda não existiam no índice.
+        """
+        produto_id = entrada['id']
+        self._por_id[produto_id] = entrada
+        self._por_codigo[entrada['codigo_barras']] = entrada
+        self._marcar_estoque_sem_lock(entrada)
+
+        texto = normalizar(entrada['nome'])
+        self._textos[produto_id] = (texto, produto_id)
+
+        novos = []
+        for token in set(_RE_TOKEN.findall(texto)):
+            ids = self._tokens.get(token)
+            if ids is None:
+                ids = self._tokens[token] = set()
+                novos.append(token)
+            ids.add(produto_id)
+        for trigrama in _trigramas(texto):
+            self._trigramas.setdefault(trigrama, set()).add(produto_id)
+
+        return novos
+
+    def _remover_sem_lock(self, produto_id):
+        antiga = self._por_id.pop(produto_id, None)
+        if antiga is None:
+            return
+        self._estoque_baixo.discard(produto_id)
+        if self._por_codigo.get(antiga['codigo_barras']) is antiga:
+            del self._por_codigo[antiga['codigo_barras']]
+
+        texto, _ = self._textos.pop(produto_id)
+        pos = bisect.bisect_left(self._ordem, (texto, produto_id))
+        if pos < len(self._ordem) and self._ordem[pos] == (texto, produto_id):
+            del self._ordem[pos]
+        for token in set(_RE_TOKEN.findall(texto)):
+            ids = self._tokens[token]
+            ids.discard(produto_id)
+            if not ids:
+                del self._tokens[token]
+                pos = bisect.bisect_left(self._tokens_ordenados, token)
+                del self._tokens_ordenados[pos]
+        for trigrama in _trigramas(texto):
+            ids = self._trigramas[trigrama]
+            ids.discard(produto_id)
+            if not ids:
+                del self._trigramas[trigrama]
+
+        codigo = normalizar(antiga['codigo_barras'])
+        for lista, chave in ((self._codigos, codigo), (self._codigos_invertidos, codigo[::-1])):
+            pos = bisect.bisect_left(lista, (chave, produto_id))
+            del lista[pos]
+
+    def _ids_por_prefixo(self, termo):
+        """Une os produtos de todos os tokens que começam com 'termo'."""
+        inicio = bisect.bisect_left(self._tokens_ordenados, termo)
+        fim = bisect.bisect_left(self._tokens_ordenados, termo + '\uffff', inicio)
+        return set().union(*(self._tokens[t] for t in self._tokens_ordenados[inicio:fim]))
+
+    @staticmethod
+    def _faixa(lista, prefixo):
+        """Fatia de uma lista ordenada de (chave, id) cujas chaves começam com 'prefixo'."""
+        inicio = bisect.bisect_left(lista, (prefixo,))
+        fim = bisect.bisect_left(lista, (prefixo + '\uffff',), inicio)
+        return lista[inicio:fim]
+
+    def _casamentos(self, termo, dentro=None):
+        """
+        Classifica os produtos que casam com uma palavra da busca em três níveis:
+        (exatos, por prefixo, demais). Exato: palavra igual a uma palavra do nome
+        ou ao código de barras. Prefixo: início de uma palavra do nome ou do
+        código. Demais: trecho no meio do nome (trigramas) ou do código.
+        Com 'dentro' (candidatos das palavras anteriores), só esses produtos
+        são classificados (_casamentos_dentro).
+        """
+        if dentro is not None:
+            return self._casamentos_dentro(termo, dentro)
+
+        exatos = self._tokens.get(termo, _VAZIO)
+        prefixo = self._ids_por_prefixo(termo)
+
+        faixa = self._faixa(self._codigos, termo)
+        prefixo.update(map(itemgetter(1), faixa))
+        if faixa and faixa[0][0] == termo:
+            exatos = exatos.union(i for codigo, i in faixa if codigo == termo)
+
+        demais = set(map(itemgetter(1), self._faixa(self._codigos_invertidos, termo[::-1])))
+        if len(termo) >= 3:
+            conjuntos = sorted((self._trigramas.get(t, _VAZIO) for t in _trigramas(termo)), key=len)
+            if conjuntos[0]:
+                textos = self._textos
+                candidatos = conjuntos[0].intersection(*conjuntos[1:]) - prefixo
+                demais.update(i for i in candidatos if termo in textos[i][0])
+        demais -= prefixo
+
+        if not prefixo and not demais:
+            # Último recurso: trecho no meio do código de barras (números) ou, com
+            # menos de 3 letras (sem trigramas), no meio do nome: percorre o catálogo
+            if termo.isdigit():
+                demais = {i for codigo, i in self._codigos if termo in codigo}
+            if len(termo) < 3:
+                demais |= {i for texto, i in self._ordem if termo in texto}
+
+        return exatos, prefixo, demais
+
+    def _casamentos_dentro(self, termo, dentro):
+        """
+        _casamentos() restrito ao conjunto 'dentro' (candidatos das palavras
+        anteriores), sem montar a união de todos os produtos que casam com a
+        palavra (ex: '1' casa com '1kg' em boa parte do catálogo). Quando os
+        índices da palavra são maiores que os candidatos, confere candidato a
+        candidato no nome e no código.
+        """
+        tokens = self._tokens_ordenados
+        inicio = bisect.bisect_left(tokens, termo)
+        fim = bisect.bisect_left(tokens, termo + '\uffff', inicio)
+        faixas = []
+        for lista, chave in ((self._codigos, termo), (self._codigos_invertidos, termo[::-1])):
+            primeiro = bisect.bisect_left(lista, (chave,))
+            faixas.append((lista, primeiro, bisect.bisect_left(lista, (chave + '\uffff',), primeiro)))
+        if inicio == fim and all(a == b for _, a, b in faixas):
+            # Nada começa com a palavra: o último recurso depende do catálogo todo
+            # (e os conjuntos aqui são pequenos)
+            return tuple(conjunto & dentro for conjunto in self._casamentos(termo))
+
+        tamanho = len(dentro)
+        custo = sum(b - a for _, a, b in faixas)
+        for token in tokens[inicio:fim]:
+            if custo > tamanho * _CUSTO_CONFERENCIA:
+                return self._conferir_candidatos(termo, dentro)
+            custo += min(tamanho, len(self._tokens[token]))
+
+        (codigos, a, b), (invertidos, c, d) = faixas
+        exatos = dentro & self._tokens.get(termo, _VAZIO)
+        prefixo = set().union(*(dentro & self._tokens[t] for t in tokens[inicio:fim]))
+        prefixo.update(dentro.intersection(map(itemgetter(1), codigos[a:b])))
+        if a < b and codigos[a][0] == termo:
+            exatos = exatos.union(i for codigo, i in codigos[a:b] if codigo == termo and i in dentro)
+
+        demais = dentro.intersection(map(itemgetter(1), invertidos[c:d]))
+        if len(termo) >= 3:
+            conjuntos = sorted((self._trigramas.get(t, _VAZIO) for t in _trigramas(termo)), key=len)
+            textos = self._textos
+            candidatos = (dentro & conjuntos[0]).intersection(*conjuntos[1:]) - prefixo
+            demais.update(i for i in candidatos if termo in textos[i][0])
+        demais -= prefixo
+        return exatos, prefixo, demais
+
+    def _conferir_candidatos(self, termo, dentro):
+        """Mesma classificação de _casamentos(), testando cada candidato no nome e no código."""
+        inicio_palavra = re.compile(r'(?<![a-z0-9])' + re.escape(termo) + r'([a-z0-9]?)')
+        textos = self._textos
+        por_id = self._por_id
+        exatos, prefixo, demais = set(), set(), set()
+        for i in dentro:
+            texto = textos[i][0]
+            seguintes = inicio_palavra.findall(texto)
+            codigo = normalizar(por_id[i]['codigo_barras'])
+            if '' in seguintes or codigo == termo:
+                exatos.add(i)
+            if seguintes or codigo.startswith(termo):
+                prefixo.add(i)
+            elif codigo.endswith(termo) or (len(termo) >= 3 and termo in texto):
+                demais.add(i)
+        return exatos, prefixo, demais
+
+    def _estimativa(self, termo, teto):
+        """
+        Limite superior de quantos produtos casam com a palavra, sem montar os
+        conjuntos (para começar a busca pela palavra mais seletiva). Para de
+        somar ao passar de 'teto'.
+        """
+        inicio = bisect.bisect_left(self._tokens_ordenados, termo)
+        fim = bisect.bisect_left(self._tokens_ordenados, termo + '\uffff', inicio)
+        total = 0
+        for lista, chave in ((self._codigos, termo), (self._codigos_invertidos, termo[::-1])):
+            primeiro = bisect.bisect_left(lista, (chave,))
+            total += bisect.bisect_left(lista, (chave + '\uffff',), primeiro) - primeiro
+        if len(termo) >= 3:
+            total += min(len(self._trigramas.get(t, _VAZIO)) for t in _trigramas(termo))
+        for token in self._tokens_ordenados[inicio:fim]:
+            if total > teto:
+                break
+            total += len(self._tokens[token])
+        return total
+
+    def _primeiros(self, grupo, primeiro, limite):
+        """
+        Até 'limite' ids do grupo em ordem alfabética, mas com os nomes que
+        começam com 'primeiro' na frente.
+        """
+        ordem = self._ordem
+        textos = self._textos
+
+        if len(grupo) * len(grupo) <= limite * len(ordem):
+            # Grupo pequeno: ordena direto. Os nomes que começam com 'primeiro'
+            # formam um bloco contíguo de _ordem e vão na frente.
+            inicio = bisect.bisect_left(ordem, (primeiro,))
+            fim = bisect.bisect_left(ordem, (primeiro + '\uffff',), inicio)
+            frente = grupo.intersection(map(itemgetter(1), ordem[inicio:fim]))
+            achados = heapq.nsmallest(limite, frente, key=textos.__getitem__)
+            if len(achados) < limite:
+                achados += heapq.nsmallest(limite - len(achados), grupo - frente, key=textos.__getitem__)
+            return achados
+
+        # Grupo grande: percorre a ordem alfabética global até completar o limite.
+        # Os nomes que começam com 'primeiro' formam um bloco contíguo nela.
+        inicio = bisect.bisect_left(ordem, (primeiro,))
+        fim = bisect.bisect_left(ordem, (primeiro + '\uffff',), inicio)
+        achados = []
+        for trecho in (itertools.islice(ordem, inicio, fim), itertools.islice(ordem, inicio),
+                       itertools.islice(ordem, fim, None)):
+            for _, i in trecho:
+                if i in grupo:
+                    achados.append(i)
+                    if len(achados) == limite:
+                        return achados
+        return achados
+
+    def pesquisar(self, termo, limite=20):
+        """
+        Busca textual (modal F2) por nome ou código de barras.
+        Cada palavra digitada precisa casar com o produto, seja como início de
+        uma palavra ('caf' -> 'Café') ou como trecho ('ritos' -> 'Doritos').
+        Ignora acentos e maiúsculas. Retorna as entradas ordenadas por
+        relevância (palavra exata > início de palavra > trecho; nome que começa
+        com a primeira palavra vem antes) e depois por nome.
+        Trechos no meio do nome usam trigramas (3+ letras); uma palavra de 1-2
+        letras que não começa nenhuma palavra/código procura trecho no nome
+        percorrendo o catálogo. Com várias palavras, a mais seletiva monta os
+        candidatos e as outras só são conferidas neles.
+        """
+        termos = _RE_TOKEN.findall(normalizar(termo))
+        if not termos:
+            return []
+
+        self._garantir_carregado()
+        with self._lock:
+            # Começa pela palavra que casa com menos produtos (a soma não depende da ordem)
+            estimativas = {}
+            for t in termos:
+                if t not in estimativas:
+                    estimativas[t] = self._estimativa(t, min(estimativas.values(), default=float('inf')))
+            ordem = sorted(termos, key=estimativas.get)
+
+            # Pontua por operações de conjunto (sem laço Python por candidato):
+            # cada palavra soma 3 (exata), 2 (prefixo) ou 1 (trecho).
+            exatos, prefixo, demais = self._casamentos(ordem[0])
+            grupos = {3: exatos, 2: prefixo - exatos, 1: demais}
+            for termo_seguinte in ordem[1:]:
+                candidatos = set().union(*grupos.values())
+                if not candidatos:
+                    break
+                exatos, prefixo, demais = self._casamentos(termo_seguinte, candidatos)
+                novos = {}
+                for pontos, grupo in grupos.items():
+                    for extra, parte in ((3, grupo & exatos), (2, (grupo & prefixo) - exatos), (1, grupo & demais)):
+                        if parte:
+                            novos[pontos + extra] = novos.get(pontos + extra, _VAZIO) | parte
+                grupos = novos
+
+            resultado = []
+            for pontos in sorted(grupos, reverse=True):
+                if grupos[pontos]:
+                    resultado.extend(self._primeiros(grupos[pontos], termos[0], limite - len(resultado)))
+                if len(resultado) >= limite:
+                    break
+
+            return [self._por_id[i] for i in resultado]
+
+
+# Instância única do processo
+catalogo = CatalogoProdutos()
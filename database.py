@@ -1,4 +1,106 @@
+from functools import wraps
+
+from flask import current_app, g, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, text
+
+
+# =============================================================================
+# PERFIL DE DESEMPENHO DO SQLITE
+# PRAGMAs aplicados em toda conexão nova (evento 'connect' do engine) e um
+# engine somente leitura para os relatórios: com WAL, as leituras não
+# bloqueiam a gravação das vendas (e vice-versa).
+# =============================================================================
+
+# Perfil padrão (app.config['SQLITE_PRAGMAS'])
+PRAGMAS_SQLITE = {
+    'journal_mode': 'WAL',      # Leitores e um escritor ao mesmo tempo
+    'busy_timeout': 5000,       # ms esperando a trava de escrita antes de 'database is locked'
+    'synchronous': 'NORMAL',    # Com WAL: não corrompe em queda de energia; fsync só no checkpoint
+    'cache_size': -32000,       # Cache de páginas por conexão (negativo = KiB, ~32 MB)
+    'mmap_size': 268435456,     # Leitura por memória mapeada (256 MB)
+    'temp_store': 'MEMORY',     # Tabelas temporárias de ORDER BY/GROUP BY em memória
+}
+
+# Pool de conexões (app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+OPCOES_ENGINE = {
+    'pool_size': 10,
+    'max_overflow': 20,
+    'pool_timeout': 30,
+}
+
+# PRAGMAs persistentes no arquivo (não podem ser alterados pela conexão somente leitura)
+_PRAGMAS_DO_ARQUIVO = {'journal_mode'}
+
+
+class SessaoLoja(Session):
+    """
+    Sessão do Flask-SQLAlchemy que, nas rotas marcadas com @somente_leitura,
+    envia as consultas ao engine somente leitura.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context() and g.get('somente_leitura'):
+            motor = current_app.extensions.get('motor_leitura')
+            if motor is not None:
+                return motor
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
 
 # Inicialização do SQLAlchemy
-db = SQLAlchemy()
\ No newline at end of file
+db = SQLAlchemy(session_options={'class_': SessaoLoja})
+
+
+def somente_leitura(f):
+    """Decorator para rotas que só leem (relatórios): usam o engine somente leitura."""
+    @wraps(f)
+    def decorada(*args, **kwargs):
+        g.somente_leitura = True
+        return f(*args, **kwargs)
+    return decorada
+
+
+def _ao_conectar(pragmas):
+    def aplicar(conexao_dbapi, registro):
+        cursor = conexao_dbapi.cursor()
+        for nome, valor in pragmas.items():
+            cursor.execute(f'PRAGMA {nome} = {valor}')
+        cursor.close()
+    return aplicar
+
+
+def configurar_sqlite(app):
+    """
+    Aplica o perfil de PRAGMAs ao engine principal e cria o engine somente
+    leitura (app.extensions['motor_leitura']). Chamar depois de db.init_app().
+    Não faz nada para bancos que não sejam um arquivo SQLite.
+    """
+    with app.app_context():
+        motor = db.engine
+    caminho = motor.url.database
+    if motor.dialect.name != 'sqlite' or not caminho or caminho == ':memory:' or caminho.startswith('file:'):
+        return
+
+    pragmas = app.config['SQLITE_PRAGMAS']
+    event.listen(motor, 'connect', _ao_conectar(pragmas))
+
+    if app.config['SQLITE_LEITURA_SEPARADA']:
+        motor_leitura = create_engine(
+            f'sqlite:///file:{caminho}?mode=ro&uri=true',
+            **app.config['SQLALCHEMY_ENGINE_OPTIONS']
+        )
+        event.listen(motor_leitura, 'connect', _ao_conectar(
+            {nome: valor for nome, valor in pragmas.items() if nome not in _PRAGMAS_DO_ARQUIVO}
+        ))
+        app.extensions['motor_leitura'] = motor_leitura
+
+
+def descrever_pragmas():
+    """Texto com os PRAGMAs em vigor em uma conexão do engine principal (log de inicialização)."""
+    if db.engine.dialect.name != 'sqlite':
+        return f'banco {db.engine.dialect.name} (sem PRAGMAs do SQLite)'
+    with db.engine.connect() as conexao:
+        valores = [f'{nome}={conexao.execute(text(f"PRAGMA {nome}")).scalar()}' for nome in PRAGMAS_SQLITE]
+    leitura = 'com' if current_app.extensions.get('motor_leitura') is not None else 'sem'
+    return f"SQLite: {', '.join(valores)} ({leitura} conexão somente leitura para relatórios)"
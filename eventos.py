@@ -0,0 +1,201 @@
+import itertools
+import json
+import os
+import queue
+import socket
+import threading
+
+
+# =============================================================================
+# EVENTOS DO DASHBOARD (Server-Sent Events)
+# Publicação/assinatura em memória: as rotas que alteram vendas e caixas
+# publicam, DEPOIS do commit, o que mudou (deltas); cada tela de dashboard
+# aberta tem uma fila e recebe os eventos por /dashboard/stream.
+# Nenhuma consulta ao banco é feita por assinante.
+# Com vários processos (workers do pdv serve), cada um também repassa o que
+# publica aos outros por sockets Unix de datagrama (um por processo, na
+# mesma pasta): o dashboard ligado a um worker vê as vendas de todos.
+# Cada fluxo aberto ocupa uma thread do servidor enquanto a tela estiver
+# aberta: assinar() limita quantos um processo aceita, para sobrarem threads
+# ao PDV; acima do limite o dashboard consulta periodicamente.
+# =============================================================================
+
+# Eventos acumulados por assinante lento antes de ele ser desconectado
+TAMANHO_FILA = 100
+
+# Intervalo do comentário de keep-alive (mantém proxies/navegador conectados)
+INTERVALO_KEEPALIVE = 15
+
+_assinantes = set()
+_lock = threading.Lock()
+_sequencia = itertools.count(1)
+_encerrado = False
+
+# Repasse entre processos: pasta dos sockets, socket de recebimento deste processo e o de envio
+_pasta_canais = None
+_canal_proprio = None
+_envio = None
+
+
+def publicar(tipo, dados):
+    """Envia um evento a todos os dashboards conectados (chamar após o commit)."""
+    dados_json = json.dumps(dados, default=str)
+    _entregar(tipo, dados_json)
+    if _pasta_canais is not None:
+        _repassar(tipo, dados_json)
+
+
+def _entregar(tipo, dados_json):
+    evento = (next(_sequencia), tipo, dados_json)
+    with _lock:
+        assinantes = list(_assinantes)
+    for fila in assinantes:
+        try:
+            fila.put_nowait(evento)
+        except queue.Full:
+            # Assinante parado: descarta a fila; o navegador reconecta e recarrega
+            with _lock:
+                _assinantes.discard(fila)
+
+
+def _formatar(evento):
+    sequencia, tipo, dados = evento
+    return f'id: {sequencia}\nevent: {tipo}\ndata: {dados}\n\n'
+
+
+def assinar(maximo=None):
+    """
+    Reserva a fila de um novo dashboard. Retorna None se este processo já
+    tiver 'maximo' fluxos abertos (ou estiver encerrando).
+    """
+    with _lock:
+        if _encerrado or (maximo is not None and len(_assinantes) >= maximo):
+            return None
+        fila = queue.Queue(maxsize=TAMANHO_FILA)
+        _assinantes.add(fila)
+        return fila
+
+
+class Fluxo:
+    """
+    Corpo da resposta text/event-stream da fila reservada por assinar(). Não
+    usa o banco nem o contexto da requisição (roda depois que a requisição foi
+    encerrada). close() (chamado pelo servidor) libera a vaga mesmo se a
+    conexão cair antes do primeiro evento.
+    """
+
+    def __init__(self, fila):
+        self._fila = fila
+        self._gerador = _gerar(fila)
+
+    def __iter__(self):
+        return self._gerador
+
+    def close(self):
+        self._gerador.close()
+        with _lock:
+            _assinantes.discard(self._fila)
+
+
+def _gerar(fila):
+    try:
+        # Informa ao EventSource o tempo de espera antes de reconectar (ms)
+        yield 'retry: 3000\n\n'
+        while True:
+            with _lock:
+                if fila not in _assinantes:
+                    return
+            try:
+                evento = fila.get(timeout=INTERVALO_KEEPALIVE)
+            except queue.Empty:
+                yield ': keep-alive\n\n'
+                continue
+            if evento is None:
+                return  # encerrar(): o navegador reconecta em outro processo
+            yield _formatar(evento)
+    finally:
+        with _lock:
+            _assinantes.discard(fila)
+
+
+def encerrar():
+    """
+    Termina os fluxos abertos (desligamento do servidor): sem isso cada
+    dashboard conectado seguraria o processo até o fim do prazo de encerramento.
+    """
+    global _encerrado
+    with _lock:
+        _encerrado = True
+        filas = list(_assinantes)
+        _assinantes.clear()
+    for fila in filas:
+        try:
+            fila.put_nowait(None)
+        except queue.Full:
+            pass
+    if _canal_proprio is not None:
+        caminho = _canal_proprio.getsockname()
+        try:
+            _canal_proprio.shutdown(socket.SHUT_RDWR)  # Acorda a thread de recebimento
+        except OSError:
+            pass
+        _canal_proprio.close()
+        if os.path.exists(caminho):
+            os.remove(caminho)
+
+
+# =============================================================================
+# REPASSE ENTRE PROCESSOS
+# =============================================================================
+
+def ligar_processos(pasta):
+    """
+    Passa a trocar eventos com os outros processos que usam 'pasta' (chamar
+    em cada worker, depois do fork). Só em sistemas com sockets Unix.
+    """
+    global _pasta_canais, _canal_proprio, _envio
+    os.makedirs(pasta, exist_ok=True)
+    caminho = os.path.join(pasta, f'{os.getpid()}.sock')
+    if os.path.exists(caminho):
+        os.remove(caminho)  # De um processo antigo com o mesmo PID
+    canal = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    canal.bind(caminho)
+    envio = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    envio.setblocking(False)
+    _pasta_canais, _canal_proprio, _envio = pasta, canal, envio
+    threading.Thread(target=_receber, args=(canal,), name='eventos', daemon=True).start()
+
+
+def _receber(canal):
+    while True:
+        try:
+            mensagem = canal.recv(65536)
+        except OSError:
+            return
+        if not mensagem:
+            return  # Socket fechado em encerrar()
+        tipo, dados_json = json.loads(mensagem)
+        _entregar(tipo, dados_json)
+
+
+def _repassar(tipo, dados_json):
+    mensagem = json.dumps([tipo, dados_json]).encode()
+    proprio = f'{os.getpid()}.sock'
+    try:
+        nomes = os.listdir(_pasta_canais)
+    except OSError:
+        return
+    for nome in nomes:
+        if nome == proprio or not nome.endswith('.sock'):
+            continue
+        caminho = os.path.join(_pasta_canais, nome)
+        try:
+            _envio.sendto(mensagem, caminho)
+        except (ConnectionRefusedError, FileNotFoundError):
+            # Processo que terminou sem apagar o socket
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+        except OSError:
+            pass  # Fila do outro processo cheia: o evento se perde como para um assinante lento
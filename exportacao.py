@@ -0,0 +1,191 @@
+import csv
+import io
+from datetime import datetime
+
+from sqlalchemy import and_, exists, func, select
+
+from database import db
+from models import Usuario, Produto, Venda, ItemVenda, PagamentoVenda
+from tarefas import caminho_arquivo, informar_progresso
+
+
+# =============================================================================
+# EXPORTAÇÃO DO RELATÓRIO DETALHADO DE VENDAS (XLSX / CSV)
+# Uma única consulta (vendas + operador + pagamentos agregados + itens) lida
+# em lotes do cursor e escrita linha a linha: a memória não cresce com o
+# período exportado. Roda como tarefa em segundo plano (tarefas.py).
+# =============================================================================
+
+COLUNAS = [
+    'ID Venda', 'Nº Venda', 'Data Venda', 'Status Venda', 'Operador',
+    'Valor Total Venda (R$)', 'Valor Pago Total (R$)', 'Troco Venda (R$)',
+    'Dinheiro (R$)', 'Cartão (R$)', 'PIX (R$)', 'Outras Formas',
+    'ID Item', 'ID Produto', 'Cód. Barras Produto', 'Produto',
+    'Quantidade', 'Preço Unit. (R$)', 'Subtotal Item (R$)',
+]
+
+# Formas com coluna própria na planilha (as demais vão para "Outras Formas")
+FORMAS_COLUNAS = ('dinheiro', 'cartao', 'pix')
+
+LOTE_CURSOR = 1000          # Linhas buscadas do banco por vez
+TAMANHO_BLOCO = 64 * 1024   # Bytes escritos por vez no CSV
+PROGRESSO_A_CADA = 500      # Vendas processadas entre atualizações de andamento
+
+
+def _filtros(data_inicio, data_fim, caixa_id=0, forma_pgto='todos'):
+    """Condições (WHERE) da exportação sobre 'vendas'."""
+    filtros = [
+        Venda.status.in_(['finalizada', 'cancelada']),  # Inclui canceladas para relatório de itens
+        Venda.data_venda.between(data_inicio, data_fim),
+    ]
+    if caixa_id > 0:
+        filtros.append(Venda.usuario_id == caixa_id)
+    if forma_pgto != 'todos':
+        # EXISTS em vez de JOIN: não duplica a venda se houver dois pagamentos da mesma forma
+        filtros.append(exists().where(and_(PagamentoVenda.venda_id == Venda.id,
+                                           PagamentoVenda.forma_pagamento == forma_pgto)))
+    return filtros
+
+
+def contar_vendas(data_inicio, data_fim, caixa_id=0, forma_pgto='todos'):
+    """Quantidade de vendas que serão exportadas (base do percentual de andamento)."""
+    return db.session.execute(
+        select(func.count(Venda.id)).where(*_filtros(data_inicio, data_fim, caixa_id, forma_pgto))
+    ).scalar()
+
+
+def _pagamentos_da_venda():
+    """
+    Colunas de pagamento da venda (somas por forma e "forma:valor|..." das
+    demais) como subconsultas correlacionadas: cada uma é uma busca no índice
+    ix_pagamentos_venda_venda só para a venda da linha, nunca uma agregação
+    de todo o histórico de pagamentos.
+    """
+    forma = func.lower(PagamentoVenda.forma_pagamento)
+    da_venda = PagamentoVenda.venda_id == Venda.id
+    somas = [select(func.sum(PagamentoVenda.valor)).where(da_venda, forma == f).scalar_subquery().label(f)
+             for f in FORMAS_COLUNAS]
+    outras = select(
+        func.group_concat(PagamentoVenda.forma_pagamento + ':' + func.printf('%.2f', PagamentoVenda.valor), '|')
+    ).where(da_venda, forma.notin_(FORMAS_COLUNAS)).scalar_subquery().label('outras')
+    return somas + [outras]
+
+
+def _consulta(data_inicio, data_fim, caixa_id=0, forma_pgto='todos'):
+    """Monta a consulta única: uma linha por item (ou uma linha para venda sem itens)."""
+    consulta = select(
+        Venda.id, Venda.numero_venda, Venda.data_venda, Venda.status, Usuario.nome,
+        Venda.valor_total, Venda.valor_pago, Venda.troco,
+        *_pagamentos_da_venda(),
+        ItemVenda.id, ItemVenda.produto_id, Produto.codigo_barras, Produto.nome,
+        ItemVenda.quantidade, ItemVenda.preco_unitario, ItemVenda.subtotal,
+    ).join(Usuario, Usuario.id == Venda.usuario_id)\
+     .outerjoin(ItemVenda, ItemVenda.venda_id == Venda.id)\
+     .outerjoin(Produto, Produto.id == ItemVenda.produto_id)\
+     .where(*_filtros(data_inicio, data_fim, caixa_id, forma_pgto))
+
+    # Finalizadas e depois canceladas, cada grupo da mais recente para a mais
+    # antiga: é a ordem dos índices (status, data_venda) e (venda_id) dos itens,
+    # então o SQLite entrega as linhas em streaming, sem ordenar o resultado
+    return consulta.order_by(Venda.status.desc(), Venda.data_venda.desc(), Venda.id.desc(), ItemVenda.id)
+
+
+def _outras_formas(agregado):
+    """'transferencia:10.00|cheque:5.00' -> 'Transferencia: R$ 10.00, Cheque: R$ 5.00'"""
+    if not agregado:
+        return ''
+    partes = []
+    for par in agregado.split('|'):
+        forma, _, valor = par.rpartition(':')
+        partes.append(f"{forma.title()}: R$ {valor}")
+    return ", ".join(partes)
+
+
+def linhas_relatorio(data_inicio, data_fim, caixa_id=0, forma_pgto='todos', ao_mudar_venda=None):
+    """
+    Gera as linhas da planilha (listas na ordem de COLUNAS): para cada venda,
+    uma linha "cabeçalho" com os totais e pagamentos e uma linha por item.
+    'ao_mudar_venda(n)' é chamada a cada nova venda (n = vendas já lidas).
+    """
+    resultado = db.session.execute(
+        _consulta(data_inicio, data_fim, caixa_id, forma_pgto).execution_options(yield_per=LOTE_CURSOR)
+    )
+    venda_atual = None
+    num_vendas = 0
+    for (venda_id, numero, data_venda, status, operador, total, pago, troco,
+         dinheiro, cartao, pix, outras,
+         item_id, produto_id, codigo, produto, quantidade, preco, subtotal) in resultado:
+
+        venda = [venda_id, numero, data_venda.strftime('%Y-%m-%d %H:%M:%S'), status.title(), operador]
+        if venda_id != venda_atual:
+            venda_atual = venda_id
+            num_vendas += 1
+            if ao_mudar_venda:
+                ao_mudar_venda(num_vendas)
+            yield venda + [total, pago, troco, dinheiro or 0.0, cartao or 0.0, pix or 0.0,
+                           _outras_formas(outras), None, None, None, None, None, None, None]
+
+        if item_id is not None:
+            # Totais aparecem apenas na linha "cabeçalho" da venda
+            yield venda + [None] * 7 + [item_id, produto_id, codigo, produto, quantidade, preco, subtotal]
+
+
+def salvar_xlsx(linhas, caminho):
+    """Escreve as linhas em um XLSX com openpyxl em modo write-only (memória constante)."""
+    from openpyxl import Workbook
+
+    livro = Workbook(write_only=True)
+    planilha = livro.create_sheet('Relatorio_Vendas')
+    planilha.append(COLUNAS)
+    for linha in linhas:
+        planilha.append(linha)
+    livro.save(caminho)
+
+
+def salvar_csv(linhas, caminho):
+    """Escreve as linhas em um CSV, em blocos."""
+    with open(caminho, 'wb') as arquivo:
+        for bloco in gerar_csv(linhas):
+            arquivo.write(bloco)
+
+
+def gerar_csv(linhas):
+    """Gera o CSV (';' e BOM UTF-8, como o Excel em português espera) em blocos."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, delimiter=';')
+    buffer.write('\ufeff')
+    escritor.writerow(COLUNAS)
+    for linha in linhas:
+        escritor.writerow(['' if valor is None else valor for valor in linha])
+        if buffer.tell() >= TAMANHO_BLOCO:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def tarefa_exportar_vendas(tarefa_id, data_inicio, data_fim, caixa_id=0, forma_pgto='todos', formato='xlsx'):
+    """Tarefa em segundo plano: gera o arquivo do relatório detalhado de vendas."""
+    total = contar_vendas(data_inicio, data_fim, caixa_id, forma_pgto)
+    if total == 0:
+        return {'mensagem': 'Nenhum dado encontrado para exportar.', 'resultado': {'vendas': 0}}
+
+    def ao_mudar_venda(num_vendas):
+        if num_vendas % PROGRESSO_A_CADA == 0:
+            informar_progresso(tarefa_id, 95 * num_vendas / total, f'{num_vendas} de {total} vendas exportadas...')
+
+    linhas = linhas_relatorio(data_inicio, data_fim, caixa_id, forma_pgto, ao_mudar_venda)
+    extensao = 'csv' if formato == 'csv' else 'xlsx'
+    caminho = caminho_arquivo(tarefa_id, extensao)
+    if extensao == 'csv':
+        salvar_csv(linhas, caminho)
+    else:
+        salvar_xlsx(linhas, caminho)
+
+    data_formatada = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return {
+        'mensagem': f'Relatório gerado: {total} vendas.',
+        'resultado': {'vendas': total},
+        'arquivo': caminho,
+        'nome_arquivo': f"Relatorio_Det_Vendas_{data_formatada}.{extensao}",
+    }
@@ -0,0 +1,240 @@
+import math
+import os
+from datetime import datetime
+
+from sqlalchemy import bindparam, insert, update
+
+from catalogo import catalogo, proxima_versao, proxima_versao_estoque
+from database import db
+from models import Produto
+from tarefas import ErroTarefa, informar_progresso
+
+
+# =============================================================================
+# IMPORTAÇÃO DE PRODUTOS (.xlsx)
+# A planilha é lida em streaming (openpyxl em modo read-only, importado só
+# quando uma importação roda), validada linha a linha em memória, com uma
+# única consulta para os códigos de barras já cadastrados e gravação em
+# lote (executemany): o custo não depende de uma consulta/objeto ORM por linha.
+# =============================================================================
+
+COLUNAS_OBRIGATORIAS = ['codigo_barras', 'nome', 'preco_venda', 'preco_custo']
+COLUNAS_NUMERICAS_OPCIONAIS = ['estoque_atual', 'estoque_minimo']
+COLUNAS_TEXTO_OPCIONAIS = ['descricao', 'categoria']
+
+# Máximo de erros por linha devolvidos para exibição
+MAX_ERROS_EXIBIDOS = 200
+
+
+class ErroImportacao(ErroTarefa):
+    """Planilha inválida como um todo (ex: colunas obrigatórias ausentes)"""
+    pass
+
+
+def _texto(valor):
+    """Converte a célula para texto sem espaços nas pontas; vazia vira ''"""
+    if valor is None:
+        return ''
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)  # Código de barras digitado como número: 7891234567890.0 -> '7891234567890'
+    return str(valor).strip()
+
+
+def _numero(linha, coluna, valor, erros, obrigatoria):
+    """
+    Converte a célula para número. Valores não numéricos (e vazios, se a coluna
+    for obrigatória) viram erro da linha; vazios opcionais viram 0.
+    """
+    if isinstance(valor, str):
+        valor = valor.strip() or None
+    if valor is None:
+        if obrigatoria:
+            erros.append((linha, f"'{coluna}' inválido: vazio"))
+        return 0.0
+    try:
+        numero = float(valor)
+    except (TypeError, ValueError):
+        numero = math.nan
+    if not math.isfinite(numero):
+        erros.append((linha, f"'{coluna}' inválido: {valor}"))
+        return 0.0
+    return numero
+
+
+def _ler_planilha(arquivo):
+    """(cabeçalho, gerador de (número da linha no Excel, valores)) da primeira planilha"""
+    from openpyxl import load_workbook
+
+    livro = load_workbook(arquivo, read_only=True, data_only=True)
+    planilha = livro.worksheets[0]
+    linhas = planilha.iter_rows(values_only=True)
+    cabecalho = [str(titulo) if titulo is not None else '' for titulo in next(linhas, ())]
+
+    def dados():
+        try:
+            for numero, valores in enumerate(linhas, start=2):
+                if any(valor is not None for valor in valores):  # Linhas totalmente vazias são ignoradas
+                    yield numero, valores
+        finally:
+            livro.close()
+
+    return cabecalho, dados()
+
+
+def importar_produtos(arquivo, atualizar_existentes=False, progresso=None):
+    """
+    Importa a planilha de produtos. Códigos novos são cadastrados; os que já
+    existem são ignorados ou, com 'atualizar_existentes', têm preço de venda,
+    preço de custo e estoque atualizados (o estoque só se a coluna existir).
+    O estoque da planilha é uma contagem: substitui o do banco (a última
+    gravação vale, inclusive sobre vendas feitas durante a importação).
+    Um código de produto desativado é reativado no modo atualizar (contado em
+    'reativados'); sem ele, a linha vira um erro (o produto não voltaria ao PDV).
+    Faz o commit e retorna um dict com os contadores e a lista de erros
+    [(linha da planilha, mensagem)]. Linhas com erro não são gravadas.
+    'progresso(percentual, mensagem)' é chamada entre as etapas.
+    """
+    progresso = progresso or (lambda percentual, mensagem: None)
+
+    progresso(5, 'Lendo a planilha...')
+    cabecalho, linhas = _ler_planilha(arquivo)
+
+    # Verifica as colunas obrigatórias
+    faltando = [col for col in COLUNAS_OBRIGATORIAS if col not in cabecalho]
+    if faltando:
+        linhas.close()
+        raise ErroImportacao(f"Arquivo faltando colunas obrigatórias: {', '.join(faltando)}. Verifique o cabeçalho.")
+
+    # Posição de cada coluna conhecida (None se a planilha não a tiver)
+    posicoes = {col: (cabecalho.index(col) if col in cabecalho else None)
+                for col in COLUNAS_OBRIGATORIAS + COLUNAS_NUMERICAS_OPCIONAIS + COLUNAS_TEXTO_OPCIONAIS}
+
+    def celula(valores, coluna):
+        posicao = posicoes[coluna]
+        return valores[posicao] if posicao is not None and posicao < len(valores) else None
+
+    # --- 1. Leitura e validação, linha a linha ---
+    erros = []
+    produtos = []  # (linha, dict do produto), na ordem da planilha
+    primeira_linha = {}  # código -> linha em que apareceu primeiro
+    pulados_vazios = total_linhas = 0
+    for linha, valores in linhas:
+        total_linhas += 1
+        codigo = _texto(celula(valores, 'codigo_barras'))
+        if codigo == '' or codigo.lower() == 'nan':
+            pulados_vazios += 1
+            continue
+        erros_antes = len(erros)
+
+        nome = _texto(celula(valores, 'nome'))
+        if nome == '':
+            erros.append((linha, "'nome' vazio"))
+        produto = {
+            'codigo_barras': codigo,
+            'nome': nome,
+            'preco_venda': _numero(linha, 'preco_venda', celula(valores, 'preco_venda'), erros, obrigatoria=True),
+            'preco_custo': _numero(linha, 'preco_custo', celula(valores, 'preco_custo'), erros, obrigatoria=True),
+            'estoque_atual': int(_numero(linha, 'estoque_atual', celula(valores, 'estoque_atual'), erros, obrigatoria=False)),
+            'estoque_minimo': int(_numero(linha, 'estoque_minimo', celula(valores, 'estoque_minimo'), erros, obrigatoria=False)),
+            'descricao': _texto(celula(valores, 'descricao')),
+            'categoria': _texto(celula(valores, 'categoria')),
+            'ativo': True,
+        }
+        if codigo in primeira_linha:
+            erros.append((linha, f"código de barras {codigo} repetido na planilha"))
+        else:
+            primeira_linha[codigo] = linha
+        if len(erros) == erros_antes:
+            produtos.append((linha, produto))
+
+    progresso(50, f'{total_linhas} linhas validadas...')
+
+    # --- 2. Códigos já cadastrados: uma única consulta ---
+    progresso(70, 'Gravando produtos...')
+    existentes = {codigo: (produto_id, ativo) for codigo, produto_id, ativo
+                  in db.session.query(Produto.codigo_barras, Produto.id, Produto.ativo)}
+
+    # --- 3. Produtos novos: INSERT em lote ---
+    registros = [produto for _, produto in produtos if produto['codigo_barras'] not in existentes]
+    if registros:
+        db.session.execute(insert(Produto.__table__).values(versao=proxima_versao()), registros)
+
+    # --- 4. Produtos existentes: UPDATE em lote (modo atualizar) ---
+    ja_existentes = [(linha, produto) for linha, produto in produtos if produto['codigo_barras'] in existentes]
+    atualizados = reativados = 0
+    if not atualizar_existentes:
+        ativos = []
+        for linha, produto in ja_existentes:
+            if existentes[produto['codigo_barras']][1]:
+                ativos.append((linha, produto))
+            else:
+                erros.append((linha, f"código de barras {produto['codigo_barras']} é de um produto desativado "
+                                     "(marque 'Atualizar produtos existentes' para reativá-lo)"))
+        ja_existentes = ativos
+    else:
+        # Atualizar também reativa: o produto volta a aparecer no PDV
+        valores = {
+            'preco_venda': bindparam('b_preco_venda'),
+            'preco_custo': bindparam('b_preco_custo'),
+            'data_atualizacao': bindparam('b_agora'),
+            'ativo': True,
+            'versao': proxima_versao(),
+        }
+        if posicoes['estoque_atual'] is not None:
+            valores['estoque_atual'] = bindparam('b_estoque_atual')
+            valores['estoque_versao'] = proxima_versao_estoque()  # Índice dos outros processos
+
+        agora = datetime.now()
+        parametros = [{
+            'b_id': existentes[produto['codigo_barras']][0],
+            'b_preco_venda': produto['preco_venda'],
+            'b_preco_custo': produto['preco_custo'],
+            'b_estoque_atual': produto['estoque_atual'],
+            'b_agora': agora,
+        } for _, produto in ja_existentes]
+        reativados = sum(1 for _, produto in ja_existentes if not existentes[produto['codigo_barras']][1])
+
+        if parametros:
+            tabela = Produto.__table__
+            db.session.execute(update(tabela).where(tabela.c.id == bindparam('b_id')).values(**valores), parametros)
+        atualizados = len(parametros)
+
+    db.session.commit()
+
+    erros.sort()
+    return {
+        'cadastrados': len(registros),
+        'atualizados': atualizados,
+        'reativados': reativados,
+        'ignorados_existentes': 0 if atualizar_existentes else len(ja_existentes),
+        'pulados_vazios': pulados_vazios,
+        'num_erros': len(erros),
+        'erros': erros[:MAX_ERROS_EXIBIDOS],
+    }
+
+
+def tarefa_importar_produtos(tarefa_id, caminho, atualizar_existentes=False):
+    """Tarefa em segundo plano: importa a planilha enviada (e apaga o upload ao final)."""
+    try:
+        resultado = importar_produtos(
+            caminho, atualizar_existentes,
+            progresso=lambda percentual, mensagem: informar_progresso(tarefa_id, percentual, mensagem)
+        )
+    finally:
+        os.remove(caminho)
+
+    # Recarrega o índice do PDV no próximo uso (muitos produtos novos/alterados)
+    catalogo.invalidar()
+
+    mensagem = f"Importação concluída: {resultado['cadastrados']} produtos cadastrados"
+    if atualizar_existentes:
+        mensagem += f", {resultado['atualizados']} atualizados"
+        if resultado['reativados']:
+            mensagem += f" ({resultado['reativados']} estavam desativados e foram reativados)"
+    else:
+        mensagem += f", {resultado['ignorados_existentes']} já existiam"
+    mensagem += f", {resultado['pulados_vazios']} linhas puladas (cód. barras vazio)."
+    if resultado['num_erros']:
+        mensagem += f" {resultado['num_erros']} linha(s) com erro não foram importadas."
+
+    return {'mensagem': mensagem, 'resultado': resultado}
@@ -8,23 +8,23 @@ try:
     # (Use 'r' para 'raw string' e evitar problemas com barras invertidas)
     caminho_projeto = r"C:\CAIXA_NSG"
 
-    # 2. Defina os caminhos para o Python do venv e para o seu app.py
+    # 2. Defina os caminhos para o Python do venv e para o pdv.py
     # (Baseado na estrutura do seu .bat e app.py)
     caminho_python_venv = os.path.join(caminho_projeto, ".venv", "Scripts", "python.exe")
-    caminho_app_py = os.path.join(caminho_projeto, "app.py")
+    caminho_pdv_py = os.path.join(caminho_projeto, "pdv.py")
 
     # Verifica se os arquivos essenciais existem
     if not os.path.exists(caminho_python_venv):
         raise FileNotFoundError(f"Python do venv não encontrado em: {caminho_python_venv}")
-    if not os.path.exists(caminho_app_py):
-        raise FileNotFoundError(f"app.py não encontrado em: {caminho_app_py}")
+    if not os.path.exists(caminho_pdv_py):
+        raise FileNotFoundError(f"pdv.py não encontrado em: {caminho_pdv_py}")
 
-    # 3. Comando para iniciar o servidor Flask (usando o Python do venv)
-    comando = [caminho_python_venv, caminho_app_py]
+    # 3. Comando para iniciar o servidor de produção (waitress, usando o Python do venv)
+    comando = [caminho_python_venv, "-m", "pdv", "serve"]
 
-    print("Iniciando o servidor Flask...")
+    print("Iniciando o servidor...")
     # Inicia o servidor em um novo processo de console
-    # O 'cwd' garante que o app.py encontre o 'instance/loja.db'
+    # O 'cwd' garante que o 'pdv' seja encontrado e que o app.py use o 'instance/loja.db'
     servidor_processo = subprocess.Popen(
         comando, 
         cwd=caminho_projeto, 
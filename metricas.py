@@ -0,0 +1,180 @@
+import threading
+from bisect import bisect_left
+from time import perf_counter
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# =============================================================================
+# MÉTRICAS DE DESEMPENHO
+# Ganchos do Flask (início/fim de cada requisição) e do SQLAlchemy (cada
+# comando enviado ao banco, em qualquer engine) acumulam em memória, por
+# rota: histograma de duração, número de consultas e tempo total de SQL.
+# /metrics expõe tudo no formato texto do Prometheus. Consultas mais lentas
+# que METRICAS_SQL_LENTA_MS vão para o log com o SQL e os parâmetros.
+# Os valores são do processo (cada worker tem os seus) e zeram ao reiniciar.
+# =============================================================================
+
+# Limites (le) dos histogramas
+LIMITES_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LIMITES_CONSULTAS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+
+_lock = threading.Lock()
+_rotas = {}       # (rota, método) -> _Rota
+_respostas = {}   # (rota, método, status) -> quantidade
+_sql_fora = {'consultas': 0, 'segundos': 0.0}  # Comandos fora de requisições (tarefas, agendador)
+
+
+class _Histograma:
+    def __init__(self, limites):
+        self.limites = limites
+        self.contagens = [0] * (len(limites) + 1)  # Última posição: acima do maior limite (+Inf)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        self.contagens[bisect_left(self.limites, valor)] += 1
+        self.soma += valor
+        self.total += 1
+
+
+class _Rota:
+    def __init__(self):
+        self.duracao = _Histograma(LIMITES_SEGUNDOS)
+        self.consultas = _Histograma(LIMITES_CONSULTAS)
+        self.sql_segundos = 0.0
+
+
+def instalar(app):
+    """Registra os ganchos de requisição no app e os de SQL em todos os engines."""
+    if not app.config['METRICAS_ATIVAS']:
+        return
+
+    @app.before_request
+    def _iniciar_medicao():
+        g.metricas = {'inicio': perf_counter(), 'consultas': 0, 'sql_segundos': 0.0, 'status': 500}
+
+    @app.after_request
+    def _guardar_status(resposta):
+        if 'metricas' in g:
+            g.metricas['status'] = resposta.status_code
+        return resposta
+
+    @app.teardown_request
+    def _registrar_requisicao(erro=None):
+        medicao = g.pop('metricas', None)
+        if medicao is None:
+            return
+        duracao = perf_counter() - medicao['inicio']
+        chave = (request.endpoint or '<sem rota>', request.method)
+        with _lock:
+            rota = _rotas.get(chave)
+            if rota is None:
+                rota = _rotas[chave] = _Rota()
+            rota.duracao.observar(duracao)
+            rota.consultas.observar(medicao['consultas'])
+            rota.sql_segundos += medicao['sql_segundos']
+            chave_status = chave + (medicao['status'],)
+            _respostas[chave_status] = _respostas.get(chave_status, 0) + 1
+
+    limite_lenta = app.config['METRICAS_SQL_LENTA_MS'] / 1000.0
+    logger = app.logger
+
+    # O início fica no contexto de execução do comando (um por comando): se ele
+    # falhar, after_cursor_execute não roda e o início some junto com o contexto
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def _antes_do_sql(conexao, cursor, comando, parametros, contexto, executemany):
+        if contexto is not None:
+            contexto.metricas_inicio = perf_counter()
+
+    @event.listens_for(Engine, 'after_cursor_execute')
+    def _depois_do_sql(conexao, cursor, comando, parametros, contexto, executemany):
+        _medir(contexto, comando, parametros, executemany)
+
+    @event.listens_for(Engine, 'handle_error')
+    def _erro_no_sql(contexto_erro):
+        # Comando que falhou (ex: banco travado) também conta o tempo que levou
+        _medir(contexto_erro.execution_context, contexto_erro.statement, contexto_erro.parameters,
+               contexto_erro.execution_context is not None and contexto_erro.execution_context.executemany)
+
+    def _medir(contexto, comando, parametros, executemany):
+        inicio = getattr(contexto, 'metricas_inicio', None)
+        if inicio is None:
+            return
+        del contexto.metricas_inicio
+        duracao = perf_counter() - inicio
+
+        medicao = g.get('metricas') if has_request_context() else None
+        if medicao is not None:
+            medicao['consultas'] += 1
+            medicao['sql_segundos'] += duracao
+        else:
+            with _lock:
+                _sql_fora['consultas'] += 1
+                _sql_fora['segundos'] += duracao
+
+        if limite_lenta and duracao >= limite_lenta:
+            rota = request.endpoint if has_request_context() else '-'
+            if executemany:
+                parametros = f'{len(parametros)} linhas, a primeira: {parametros[0] if parametros else None}'
+            logger.warning('SQL lenta (%.1f ms, rota %s): %s | parâmetros: %s',
+                           duracao * 1000, rota, ' '.join(comando.split()), parametros)
+
+
+# =============================================================================
+# FORMATO TEXTO DO PROMETHEUS
+# =============================================================================
+
+def _rotulos(**rotulos):
+    def escapar(valor):
+        return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{nome}="{escapar(valor)}"' for nome, valor in rotulos.items()) + '}'
+
+
+def _linhas_histograma(nome, histograma, rotulos):
+    linhas = []
+    acumulado = 0
+    for limite, contagem in zip(histograma.limites + ('+Inf',), histograma.contagens):
+        acumulado += contagem
+        linhas.append(f'{nome}_bucket{_rotulos(**rotulos, le=limite)} {acumulado}')
+    linhas.append(f'{nome}_sum{_rotulos(**rotulos)} {histograma.soma}')
+    linhas.append(f'{nome}_count{_rotulos(**rotulos)} {histograma.total}')
+    return linhas
+
+
+def texto_prometheus():
+    """Todas as métricas do processo no formato de exposição do Prometheus (text/plain 0.0.4)."""
+    with _lock:
+        rotas = sorted(_rotas.items())
+        respostas = sorted(_respostas.items())
+        sql_fora = dict(_sql_fora)
+
+        linhas = ['# HELP pdv_requisicao_segundos Duração das requisições, por rota.',
+                  '# TYPE pdv_requisicao_segundos histogram']
+        for (rota, metodo), dados in rotas:
+            linhas += _linhas_histograma('pdv_requisicao_segundos', dados.duracao, {'rota': rota, 'metodo': metodo})
+
+        linhas += ['# HELP pdv_requisicao_consultas Comandos SQL executados por requisição, por rota.',
+                   '# TYPE pdv_requisicao_consultas histogram']
+        for (rota, metodo), dados in rotas:
+            linhas += _linhas_histograma('pdv_requisicao_consultas', dados.consultas, {'rota': rota, 'metodo': metodo})
+
+        linhas += ['# HELP pdv_requisicao_sql_segundos_total Tempo total gasto em SQL, por rota.',
+                   '# TYPE pdv_requisicao_sql_segundos_total counter']
+        for (rota, metodo), dados in rotas:
+            linhas.append(f'pdv_requisicao_sql_segundos_total{_rotulos(rota=rota, metodo=metodo)} {dados.sql_segundos}')
+
+    linhas += ['# HELP pdv_requisicoes_total Requisições atendidas, por rota e status HTTP.',
+               '# TYPE pdv_requisicoes_total counter']
+    for (rota, metodo, status), quantidade in respostas:
+        linhas.append(f'pdv_requisicoes_total{_rotulos(rota=rota, metodo=metodo, status=status)} {quantidade}')
+
+    linhas += ['# HELP pdv_sql_fora_de_requisicao_total Comandos SQL de tarefas em segundo plano e do agendador.',
+               '# TYPE pdv_sql_fora_de_requisicao_total counter',
+               f"pdv_sql_fora_de_requisicao_total {sql_fora['consultas']}",
+               '# HELP pdv_sql_fora_de_requisicao_segundos_total Tempo desses comandos SQL.',
+               '# TYPE pdv_sql_fora_de_requisicao_segundos_total counter',
+               f"pdv_sql_fora_de_requisicao_segundos_total {sql_fora['segundos']}"]
+    return '\n'.join(linhas) + '\n'
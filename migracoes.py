@@ -0,0 +1,150 @@
+from sqlalchemy import text
+
+from database import db
+
+
+# =============================================================================
+# MIGRAÇÕES DE ESQUEMA (SQLite)
+# O db.create_all() só cria tabelas novas; colunas e dados novos em tabelas
+# já existentes (bancos das lojas em produção) são tratados aqui.
+# Cada passo é idempotente e pode rodar em toda inicialização.
+# =============================================================================
+
+def _colunas(tabela):
+    """Retorna o conjunto de nomes de colunas de uma tabela."""
+    return {linha[1] for linha in db.session.execute(text(f'PRAGMA table_info({tabela})'))}
+
+
+def _adicionar_coluna(tabela, coluna, definicao):
+    """Adiciona a coluna se ela ainda não existir. Retorna True se adicionou."""
+    if coluna in _colunas(tabela):
+        return False
+    db.session.execute(text(f'ALTER TABLE {tabela} ADD COLUMN {coluna} {definicao}'))
+    return True
+
+
+def _migrar_totais_venda():
+    """Colunas de totais desnormalizados em 'vendas' + preenchimento do histórico."""
+    adicionadas = [
+        _adicionar_coluna('vendas', 'valor_total', 'FLOAT NOT NULL DEFAULT 0'),
+        _adicionar_coluna('vendas', 'valor_pago', 'FLOAT NOT NULL DEFAULT 0'),
+        _adicionar_coluna('vendas', 'troco', 'FLOAT NOT NULL DEFAULT 0'),
+        _adicionar_coluna('vendas', 'num_itens', 'INTEGER NOT NULL DEFAULT 0'),
+    ]
+    if not any(adicionadas):
+        return
+
+    db.session.execute(text("""
+        UPDATE vendas SET
+            valor_total = COALESCE((SELECT SUM(subtotal) FROM itens_venda WHERE venda_id = vendas.id), 0),
+            num_itens = COALESCE((SELECT SUM(quantidade) FROM itens_venda WHERE venda_id = vendas.id), 0),
+            valor_pago = COALESCE((SELECT SUM(valor) FROM pagamentos_venda WHERE venda_id = vendas.id), 0)
+    """))
+    db.session.execute(text("""
+        UPDATE vendas SET troco = MAX(0, valor_pago - valor_total)
+    """))
+    print("Migração: totais das vendas gravados em 'vendas'.")
+
+
+def _migrar_versao_usuario():
+    """Coluna 'versao' em 'usuarios' (invalidação do usuário guardado na sessão)."""
+    _adicionar_coluna('usuarios', 'versao', 'INTEGER NOT NULL DEFAULT 1')
+
+
+def _migrar_totais_caixa():
+    """Totais acumulados em 'movimento_caixa' + vínculo venda -> movimento, preenchidos a partir do histórico."""
+    from resumos import reconstruir_caixas
+
+    adicionadas = [
+        _adicionar_coluna('vendas', 'movimento_caixa_id', 'INTEGER REFERENCES movimento_caixa (id)'),
+        _adicionar_coluna('movimento_caixa', 'qtd_vendas', 'INTEGER NOT NULL DEFAULT 0'),
+        _adicionar_coluna('movimento_caixa', 'valor_vendas', 'FLOAT NOT NULL DEFAULT 0'),
+        _adicionar_coluna('movimento_caixa', 'total_dinheiro', 'FLOAT NOT NULL DEFAULT 0'),
+        _adicionar_coluna('movimento_caixa', 'total_cartao', 'FLOAT NOT NULL DEFAULT 0'),
+        _adicionar_coluna('movimento_caixa', 'total_pix', 'FLOAT NOT NULL DEFAULT 0'),
+        _adicionar_coluna('movimento_caixa', 'total_outros', 'FLOAT NOT NULL DEFAULT 0'),
+        _adicionar_coluna('movimento_caixa', 'total_geral', 'FLOAT NOT NULL DEFAULT 0'),
+    ]
+    if not any(adicionadas):
+        return
+
+    # A venda pertence ao movimento do operador aberto no momento da venda
+    db.session.execute(text("""
+        UPDATE vendas SET movimento_caixa_id = (
+            SELECT m.id FROM movimento_caixa m
+            WHERE m.usuario_id = vendas.usuario_id
+              AND m.data_abertura <= vendas.data_venda
+              AND (m.data_fechamento IS NULL OR m.data_fechamento >= vendas.data_venda)
+            ORDER BY m.data_abertura DESC LIMIT 1
+        )
+    """))
+    reconstruir_caixas()
+    print("Migração: totais dos movimentos de caixa gerados a partir do histórico.")
+
+
+def _migrar_sincronizacao_pdv():
+    """Versão do catálogo em 'produtos' e identificador da venda gerado pelo PDV em 'vendas'."""
+    _adicionar_coluna('produtos', 'versao', 'INTEGER NOT NULL DEFAULT 0')
+    if _adicionar_coluna('vendas', 'uuid', 'VARCHAR(36)'):
+        # UNIQUE não pode ir no ALTER TABLE do SQLite: vira um índice único
+        db.session.execute(text('CREATE UNIQUE INDEX IF NOT EXISTS uq_vendas_uuid ON vendas (uuid)'))
+
+
+def _migrar_versao_estoque():
+    """Versão das baixas de estoque em 'produtos' (estoque do índice do PDV entre processos)."""
+    _adicionar_coluna('produtos', 'estoque_versao', 'INTEGER NOT NULL DEFAULT 0')
+
+
+def _migrar_andamento_tarefas():
+    """Hora da última gravação do andamento em 'tarefas' (tarefas reservadas entre processos)."""
+    _adicionar_coluna('tarefas', 'data_andamento', 'DATETIME')
+
+
+def _migrar_sequencia_vendas():
+    """
+    Sequência 'vendas' (números das vendas) continuando do histórico: até aqui
+    o número de cada venda era o próprio ID.
+    """
+    db.session.execute(text(
+        "INSERT OR IGNORE INTO sequencias (nome, valor) SELECT 'vendas', COALESCE(MAX(id), 0) FROM vendas"
+    ))
+
+
+def _criar_indices():
+    """Cria os índices declarados nos modelos (__table_args__) que ainda não existem."""
+    conexao = db.session.connection()
+    for tabela in db.metadata.sorted_tables:
+        for indice in tabela.indexes:
+            indice.create(bind=conexao, checkfirst=True)
+
+
+def _preencher_resumos():
+    """Gera os resumos diários na primeira execução com vendas já existentes."""
+    from resumos import reconstruir_resumos
+
+    vazio = db.session.execute(text('SELECT 1 FROM resumo_vendas_dia LIMIT 1')).first() is None
+    tem_vendas = db.session.execute(text("SELECT 1 FROM vendas WHERE status = 'finalizada' LIMIT 1")).first() is not None
+    if vazio and tem_vendas:
+        reconstruir_resumos()
+        print("Migração: resumos diários de vendas gerados a partir do histórico.")
+
+
+# Ordem de execução das migrações
+MIGRACOES = [
+    _migrar_totais_venda,
+    _migrar_versao_usuario,
+    _migrar_totais_caixa,
+    _migrar_sincronizacao_pdv,
+    _migrar_versao_estoque,
+    _migrar_andamento_tarefas,
+    _migrar_sequencia_vendas,
+    _criar_indices,
+    _preencher_resumos,
+]
+
+
+def aplicar_migracoes():
+    """Executa todas as migrações pendentes (deve rodar dentro do app_context)."""
+    for migracao in MIGRACOES:
+        migracao()
+    db.session.commit()
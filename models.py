@@ -15,6 +15,8 @@ class Usuario(db.Model, UserMixin):
     perfil = db.Column(db.String(20), nullable=False)  # 'admin' ou 'caixa'
     ativo = db.Column(db.Boolean, default=True)
     data_criacao = db.Column(db.DateTime, default=datetime.now) # Era utcnow
+    # Incrementada a cada edição/desativação: invalida o usuário guardado nas sessões
+    versao = db.Column(db.Integer, nullable=False, default=1)
     
     # Relacionamento com vendas
     vendas = db.relationship('Venda', backref='operador', lazy=True)
@@ -36,6 +38,12 @@ class Produto(db.Model):
     Modelo para produtos do estoque
     """
     __tablename__ = 'produtos'
+    __table_args__ = (
+        # Sincronização do catálogo do PDV (alterações desde uma versão)
+        db.Index('ix_produtos_versao', 'versao'),
+        # Sincronização do estoque entre os processos (baixas e devoluções)
+        db.Index('ix_produtos_estoque_versao', 'estoque_versao'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     codigo_barras = db.Column(db.String(50), unique=True, nullable=False)
@@ -52,6 +60,12 @@ class Produto(db.Model):
     
     # NOVO CAMPO PARA IMAGEM
     imagem_url = db.Column(db.String(200), nullable=True) # Armazena o caminho relativo da imagem
+
+    # Versão do catálogo em que o produto foi alterado pela última vez (catalogo.proxima_versao).
+    # Baixas de estoque das vendas não mudam a versão.
+    versao = db.Column(db.Integer, nullable=False, default=0)
+    # Versão da última baixa/devolução de estoque por venda (catalogo.proxima_versao_estoque)
+    estoque_versao = db.Column(db.Integer, nullable=False, default=0)
     
     # Relacionamento com itens de venda
     itens_venda = db.relationship('ItemVenda', backref='produto', lazy=True)
@@ -63,6 +77,12 @@ class PagamentoVenda(db.Model):
     Permite múltiplos pagamentos por venda (Ex: Dinheiro + Pix).
     """
     __tablename__ = 'pagamentos_venda'
+    __table_args__ = (
+        # Pagamentos de uma venda (cobre forma/valor: somas sem ler a tabela)
+        db.Index('ix_pagamentos_venda_venda', 'venda_id', 'forma_pagamento', 'valor'),
+        # Relatórios de recebimento e fechamento de caixa por período
+        db.Index('ix_pagamentos_venda_data_forma', 'data_pagamento', 'forma_pagamento'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     venda_id = db.Column(db.Integer, db.ForeignKey('vendas.id'), nullable=False)
@@ -74,14 +94,31 @@ class PagamentoVenda(db.Model):
 
 class Venda(db.Model):
     __tablename__ = 'vendas'
+    __table_args__ = (
+        # Relatórios/dashboard: status + período
+        db.Index('ix_vendas_status_data', 'status', 'data_venda'),
+        # Fechamento de caixa e relatórios filtrados por operador
+        db.Index('ix_vendas_usuario_status_data', 'usuario_id', 'status', 'data_venda'),
+        # Detalhe de itens (todos os status) por período
+        db.Index('ix_vendas_data', 'data_venda'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     numero_venda = db.Column(db.String(20), unique=True, nullable=False)
     data_venda = db.Column(db.DateTime, default=datetime.now) # Era utcnow
-    # Os campos valor_total, valor_pago, troco, e forma_pagamento foram removidos 
-    # ou se tornaram propriedades calculadas.
     status = db.Column(db.String(20), default='finalizada')  # 'finalizada', 'cancelada'
     usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
+    # Identificador gerado pelo PDV: o reenvio da mesma venda (fila offline) não a duplica
+    uuid = db.Column(db.String(36), unique=True)
+    # Movimento de caixa em que a venda foi feita (totais acumulados em MovimentoCaixa)
+    movimento_caixa_id = db.Column(db.Integer, db.ForeignKey('movimento_caixa.id'))
+
+    # Totais desnormalizados: gravados em finalizar_venda e mantidos por editar_pagamento,
+    # para que os relatórios somem direto no SQL (SUM) sem carregar itens/pagamentos.
+    valor_total = db.Column(db.Float, nullable=False, default=0.0)   # Soma dos subtotais dos itens
+    valor_pago = db.Column(db.Float, nullable=False, default=0.0)    # Soma dos pagamentos
+    troco = db.Column(db.Float, nullable=False, default=0.0)         # max(0, valor_pago - valor_total)
+    num_itens = db.Column(db.Integer, nullable=False, default=0)     # Quantidade total de unidades
     
     # Relacionamento com itens de venda
     itens = db.relationship('ItemVenda', backref='venda', lazy=True, cascade='all, delete-orphan')
@@ -89,23 +126,12 @@ class Venda(db.Model):
     # NOVO: Relacionamento com múltiplos pagamentos
     pagamentos = db.relationship('PagamentoVenda', backref='venda', lazy=True, cascade='all, delete-orphan')
 
-    # Propriedade dinâmica para calcular o valor total da venda
-    @property
-    def valor_total(self):
-        # Soma todos os subtotais dos itens de venda
-        return sum(item.subtotal for item in self.itens)
-
-    # Propriedade dinâmica para calcular o valor total pago
-    @property
-    def valor_pago(self):
-        # Soma todos os valores dos pagamentos
-        return sum(pagamento.valor for pagamento in self.pagamentos)
-
-    # Propriedade dinâmica para calcular o troco
-    @property
-    def troco(self):
-        # O troco é a diferença entre o valor pago e o valor total
-        return max(0.0, self.valor_pago - self.valor_total)
+    def recalcular_totais(self):
+        """Recalcula os totais gravados a partir dos itens e pagamentos (ex: após editar um pagamento)."""
+        self.valor_total = sum(item.subtotal for item in self.itens)
+        self.num_itens = sum(item.quantidade for item in self.itens)
+        self.valor_pago = sum(pagamento.valor for pagamento in self.pagamentos)
+        self.troco = max(0.0, self.valor_pago - self.valor_total)
 
     # Propriedade para listar as formas de pagamento usadas (para exibição)
     @property
@@ -126,6 +152,10 @@ class Venda(db.Model):
 class ItemVenda(db.Model):
     # ... (código do ItemVenda existente - sem alteração) ...
     __tablename__ = 'itens_venda'
+    __table_args__ = (
+        db.Index('ix_itens_venda_venda', 'venda_id'),
+        db.Index('ix_itens_venda_produto', 'produto_id', 'venda_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     venda_id = db.Column(db.Integer, db.ForeignKey('vendas.id'), nullable=False)
@@ -137,6 +167,14 @@ class ItemVenda(db.Model):
 class MovimentoCaixa(db.Model):
     # ... (código do MovimentoCaixa existente - sem alteração) ...
     __tablename__ = 'movimento_caixa'
+    __table_args__ = (
+        # Caixa aberto do operador (get_caixa_aberto)
+        db.Index('ix_movimento_caixa_usuario_status', 'usuario_id', 'status'),
+        # Último movimento de cada operador (dashboard)
+        db.Index('ix_movimento_caixa_usuario_abertura', 'usuario_id', 'data_abertura'),
+        # Caixas esquecidos abertos (dashboard)
+        db.Index('ix_movimento_caixa_status_abertura', 'status', 'data_abertura'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     data_abertura = db.Column(db.DateTime, default=datetime.now) # Era utcnow
@@ -145,6 +183,87 @@ class MovimentoCaixa(db.Model):
     saldo_final = db.Column(db.Float)
     usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
     status = db.Column(db.String(20), default='aberto')  # 'aberto', 'fechado'
+
+    # Totais acumulados do movimento (mantidos por resumos.somar_no_caixa na mesma
+    # transação de cada venda, cancelamento e edição de pagamento): o fechamento
+    # e o cupom de fechamento leem daqui, sem percorrer as vendas do período.
+    qtd_vendas = db.Column(db.Integer, nullable=False, default=0)
+    valor_vendas = db.Column(db.Float, nullable=False, default=0.0)    # Soma de Venda.valor_total
+    total_dinheiro = db.Column(db.Float, nullable=False, default=0.0)  # Pagamentos por forma...
+    total_cartao = db.Column(db.Float, nullable=False, default=0.0)
+    total_pix = db.Column(db.Float, nullable=False, default=0.0)
+    total_outros = db.Column(db.Float, nullable=False, default=0.0)
+    total_geral = db.Column(db.Float, nullable=False, default=0.0)     # ...e de todas as formas
     
     # Relacionamento com usuário
-    usuario = db.relationship('Usuario', backref='movimentos_caixa')
\ No newline at end of file
+    usuario = db.relationship('Usuario', backref='movimentos_caixa')
+
+# =============================================================================
+# RESUMOS DIÁRIOS (ROLLUP) - mantidos por resumos.py
+# Totais por dia já agregados: os relatórios por período leem O(dias) linhas
+# em vez de percorrer todas as vendas, itens e pagamentos.
+# =============================================================================
+
+class ResumoVendaDia(db.Model):
+    """Vendas finalizadas por dia e operador"""
+    __tablename__ = 'resumo_vendas_dia'
+
+    dia = db.Column(db.Date, primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), primary_key=True)
+    num_vendas = db.Column(db.Integer, nullable=False, default=0)
+    valor_total = db.Column(db.Float, nullable=False, default=0.0)
+
+
+class ResumoPagamentoDia(db.Model):
+    """Valores recebidos por dia, operador e forma de pagamento"""
+    __tablename__ = 'resumo_pagamentos_dia'
+
+    dia = db.Column(db.Date, primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), primary_key=True)
+    forma_pagamento = db.Column(db.String(20), primary_key=True)
+    valor = db.Column(db.Float, nullable=False, default=0.0)
+
+
+class ResumoProdutoDia(db.Model):
+    """Quantidade e faturamento por dia, operador e produto"""
+    __tablename__ = 'resumo_produtos_dia'
+
+    dia = db.Column(db.Date, primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), primary_key=True)
+    produto_id = db.Column(db.Integer, db.ForeignKey('produtos.id'), primary_key=True)
+    quantidade = db.Column(db.Integer, nullable=False, default=0)
+    valor = db.Column(db.Float, nullable=False, default=0.0)
+
+
+class Sequencia(db.Model):
+    """
+    Contadores para numeração (ex: número da venda), reservados com um único
+    INSERT ... ON CONFLICT DO UPDATE ... RETURNING (sequencias.py).
+    """
+    __tablename__ = 'sequencias'
+
+    nome = db.Column(db.String(60), primary_key=True)  # 'vendas', 'vendas-20261017', 'vendas-caixa-12'
+    valor = db.Column(db.Integer, nullable=False, default=0)  # Último número entregue
+
+
+class Tarefa(db.Model):
+    """
+    Tarefa em segundo plano (importação de produtos, exportação de relatórios).
+    Aqui ficam o estado, o andamento (gravado periodicamente por tarefas.py),
+    o resultado e o arquivo gerado.
+    """
+    __tablename__ = 'tarefas'
+
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    tipo = db.Column(db.String(30), nullable=False)  # 'importacao_produtos', 'exportacao_vendas'
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pendente')  # 'pendente', 'executando', 'concluida', 'erro'
+    progresso = db.Column(db.Integer, nullable=False, default=0)  # 0 a 100
+    mensagem = db.Column(db.String(300))
+    resultado = db.Column(db.Text)  # JSON
+    arquivo = db.Column(db.String(300))  # Caminho do arquivo gerado (exportação)
+    nome_arquivo = db.Column(db.String(100))  # Nome sugerido no download
+    data_criacao = db.Column(db.DateTime, default=datetime.now)
+    data_conclusao = db.Column(db.DateTime)
+    # Última gravação do andamento: sinal de que o processo que a executa está vivo
+    data_andamento = db.Column(db.DateTime)
@@ -0,0 +1,198 @@
+"""
+Linha de comando do PDV.
+
+    python -m pdv serve                      # endereço, workers e threads da configuração (app.py)
+    python -m pdv serve --port 8000 --workers 4 --threads 8
+    python -m pdv serve -c BACKUP_INTERVALO_HORAS=0 -c BACKUP_MANTER=30
+
+'serve' atende com um servidor WSGI de produção: gunicorn (Linux: vários
+processos com threads, escala nos núcleos) ou waitress (Windows: um
+processo com threads). O app é carregado e aquecido (banco, migrações,
+índice de produtos, templates) uma vez antes de criar os workers; o
+processo principal só cuida dos workers (nenhuma thread dele é herdada).
+SIGTERM encerra com calma: os workers param de aceitar conexões e terminam
+as requisições em andamento (até SERVIDOR_ENCERRAMENTO_SEGUNDOS).
+"""
+import argparse
+import importlib.util
+import json
+import os
+import signal
+import sys
+
+
+def _aquecer(app):
+    """Prepara o que cada worker herdaria frio: banco, índice de produtos e templates compilados."""
+    from app import inicializar
+    from database import db
+
+    inicializar()
+    for nome in app.jinja_env.list_templates():
+        app.jinja_env.get_template(nome)
+    # As conexões abertas até aqui não passam para os workers
+    with app.app_context():
+        db.engine.dispose()
+        leitura = app.extensions.get('motor_leitura')
+        if leitura is not None:
+            leitura.dispose()
+
+
+# =============================================================================
+# GUNICORN (LINUX)
+# =============================================================================
+
+def _servir_gunicorn(app, host, porta, workers, threads, encerramento):
+    from gunicorn.app.base import BaseApplication
+
+    import eventos
+    from backup import iniciar_agendamento
+    from database import db
+
+    def post_fork(servidor, worker):
+        # Pools de conexões novos no worker (os herdados não são usados)
+        with app.app_context():
+            db.engine.dispose(close=False)
+            leitura = app.extensions.get('motor_leitura')
+            if leitura is not None:
+                leitura.dispose(close=False)
+        if workers > 1:
+            eventos.ligar_processos(os.path.join(app.instance_path, 'eventos'))
+        # Cada worker tem o seu agendador; a trava de arquivo do backup.py deixa um gerar por vez
+        iniciar_agendamento(app)
+
+    def post_worker_init(worker):
+        # No SIGTERM, fecha os fluxos do dashboard (SSE) antes de esperar as requisições
+        original = signal.getsignal(signal.SIGTERM)
+
+        def ao_encerrar(sinal, quadro):
+            eventos.encerrar()
+            original(sinal, quadro)
+
+        signal.signal(signal.SIGTERM, ao_encerrar)
+
+    class Servidor(BaseApplication):
+        def load_config(self):
+            opcoes = {
+                'bind': f'{host}:{porta}',
+                'workers': workers,
+                'threads': threads,
+                'worker_class': 'gthread',
+                'preload_app': True,
+                'graceful_timeout': encerramento,
+                'keepalive': 5,
+                'post_fork': post_fork,
+                'post_worker_init': post_worker_init,
+            }
+            for nome, valor in opcoes.items():
+                self.cfg.set(nome, valor)
+
+        def load(self):
+            return app
+
+    print(f'Atendendo em http://{host}:{porta} (gunicorn: {workers} worker(s) x {threads} thread(s))')
+    Servidor().run()
+
+
+# =============================================================================
+# WAITRESS (WINDOWS)
+# =============================================================================
+
+def _servir_waitress(app, host, porta, threads):
+    from waitress import create_server
+
+    import eventos
+    from backup import iniciar_agendamento
+
+    servidor = create_server(app, host=host, port=porta, threads=threads)
+    parar = iniciar_agendamento(app)
+
+    def ao_encerrar(sinal, quadro):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGINT, ao_encerrar)
+    signal.signal(signal.SIGTERM, ao_encerrar)
+    print(f'Atendendo em http://{host}:{porta} (waitress: {threads} thread(s))')
+    try:
+        servidor.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        eventos.encerrar()
+        if parar is not None:
+            parar.set()
+        # Para de aceitar conexões e espera (alguns segundos) as requisições em andamento
+        servidor.close()
+
+
+# =============================================================================
+# LINHA DE COMANDO
+# =============================================================================
+
+def _servidor_padrao():
+    if os.name != 'nt' and importlib.util.find_spec('gunicorn'):
+        return 'gunicorn'
+    return 'waitress'
+
+
+def _valor_config(texto):
+    """'CHAVE=valor' -> (chave, valor); o valor é lido como JSON (números, true/false) ou fica texto."""
+    chave, separador, valor = texto.partition('=')
+    if not separador:
+        raise argparse.ArgumentTypeError(f"use CHAVE=valor: '{texto}'")
+    try:
+        return chave.strip(), json.loads(valor)
+    except ValueError:
+        return chave.strip(), valor
+
+
+def serve(args):
+    # As alterações (-c) entram em create_app(), antes de o banco e as métricas lerem a configuração
+    if args.config:
+        os.environ['PDV_CONFIG'] = json.dumps(dict(args.config))
+    try:
+        from app import app
+    except ValueError as erro:
+        sys.exit(str(erro))
+
+    host = args.host or app.config['SERVIDOR_HOST']
+    porta = args.port or app.config['SERVIDOR_PORTA']
+    workers = args.workers or app.config['SERVIDOR_WORKERS']
+    threads = args.threads or app.config['SERVIDOR_THREADS']
+    servidor = args.servidor or _servidor_padrao()
+    if servidor == 'gunicorn' and os.name == 'nt':
+        sys.exit('O gunicorn não roda no Windows: use --servidor waitress.')
+    if servidor == 'waitress' and workers > 1 and args.workers:
+        print('Aviso: o waitress atende em um único processo; --workers ignorado.')
+    # Cada dashboard em tempo real prende uma thread: sempre sobra ao menos uma para o PDV
+    if app.config['DASHBOARD_FLUXOS_MAXIMO'] >= threads:
+        app.config['DASHBOARD_FLUXOS_MAXIMO'] = threads - 1
+        print(f'Aviso: DASHBOARD_FLUXOS_MAXIMO reduzido a {threads - 1} ({threads} thread(s) por processo).')
+
+    _aquecer(app)
+    if servidor == 'gunicorn':
+        _servir_gunicorn(app, host, porta, workers, threads, app.config['SERVIDOR_ENCERRAMENTO_SEGUNDOS'])
+    else:
+        _servir_waitress(app, host, porta, threads)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pdv', description=__doc__.strip().splitlines()[0])
+    comandos = parser.add_subparsers(dest='comando', required=True)
+
+    servir = comandos.add_parser('serve', help='Atende o PDV com um servidor WSGI de produção')
+    servir.add_argument('--host', help='Endereço (padrão: SERVIDOR_HOST)')
+    servir.add_argument('--port', type=int, help='Porta (padrão: SERVIDOR_PORTA)')
+    servir.add_argument('--workers', type=int, help='Processos (padrão: SERVIDOR_WORKERS; só gunicorn)')
+    servir.add_argument('--threads', type=int, help='Threads por processo (padrão: SERVIDOR_THREADS)')
+    servir.add_argument('--servidor', choices=['gunicorn', 'waitress'],
+                        help='Padrão: gunicorn se instalado (fora do Windows), senão waitress')
+    servir.add_argument('-c', '--config', type=_valor_config, action='append', default=[], metavar='CHAVE=VALOR',
+                        help='Altera uma configuração do app.py ao criar o app (pode repetir)')
+    servir.set_defaults(funcao=serve)
+
+    args = parser.parse_args(argv)
+    args.funcao(args)
+
+
+if __name__ == '__main__':
+    main()
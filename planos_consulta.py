@@ -0,0 +1,139 @@
+import re
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from database import db
+from models import Usuario, Produto, Venda, ItemVenda, MovimentoCaixa
+from models import ResumoVendaDia, ResumoPagamentoDia, ResumoProdutoDia
+
+
+# =============================================================================
+# VERIFICAÇÃO DOS PLANOS DE EXECUÇÃO (EXPLAIN QUERY PLAN)
+# Garante que as consultas de relatório e de caixa usam os índices de
+# models.py. Uma varredura completa ('SCAN <tabela>') em uma das tabelas que
+# crescem com o histórico de vendas é tratada como falha. Sempre que a rota
+# monta a consulta em uma função, o plano verificado é o dessa função (o SQL
+# que roda em produção), não uma cópia simplificada.
+# =============================================================================
+
+# Tabelas que crescem com o tempo (as demais são pequenas e podem ser varridas)
+TABELAS_GRANDES = {'vendas', 'pagamentos_venda', 'itens_venda', 'movimento_caixa',
+                   'resumo_vendas_dia', 'resumo_pagamentos_dia', 'resumo_produtos_dia'}
+
+# SQLite >= 3.36 escreve 'SCAN vendas'; versões anteriores, 'SCAN TABLE vendas'
+_RE_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)')
+
+# Consultas lidas em streaming (exportação): ordenar o resultado inteiro em
+# uma B-tree temporária também é falha, pois a memória cresceria com o período
+CONSULTAS_EM_STREAMING = ('exportação de vendas',)
+_ORDENACAO_TEMPORARIA = 'USE TEMP B-TREE FOR ORDER BY'
+
+
+def consultas_monitoradas():
+    """
+    Retorna [(nome, consulta)] com as consultas quentes de relatórios, dashboard
+    e caixa, montadas com os mesmos filtros usados nas rotas.
+    """
+    # As funções que montam as consultas das rotas e da exportação
+    from app import _consulta_cupons, _consulta_produtos_por_forma, _consulta_status_caixas, _filtros_cupons
+    import exportacao
+
+    fim = datetime.now()
+    inicio = fim - timedelta(days=30)
+    usuario_id = 1
+
+    return [
+        ('caixa aberto do operador',
+         select(MovimentoCaixa).where(MovimentoCaixa.usuario_id == usuario_id,
+                                      MovimentoCaixa.status == 'aberto').limit(1)),
+
+        ('dashboard: total do dia (resumo)',
+         select(func.sum(ResumoVendaDia.valor_total)).where(ResumoVendaDia.dia == fim.date())),
+
+        ('dashboard: caixas esquecidos',
+         select(MovimentoCaixa).where(MovimentoCaixa.status == 'aberto',
+                                      MovimentoCaixa.data_abertura < inicio)
+         .order_by(MovimentoCaixa.data_abertura.desc())),
+
+        ('dashboard: último movimento de cada operador',
+         _consulta_status_caixas().statement),
+
+        ('relatorios: total e número de vendas (resumo)',
+         select(func.sum(ResumoVendaDia.num_vendas), func.sum(ResumoVendaDia.valor_total))
+         .where(ResumoVendaDia.dia.between(inicio.date(), fim.date()),
+                ResumoVendaDia.usuario_id == usuario_id)),
+
+        ('relatorios: pagamentos agrupados (resumo)',
+         select(ResumoPagamentoDia.forma_pagamento, func.sum(ResumoPagamentoDia.valor))
+         .where(ResumoPagamentoDia.dia.between(inicio.date(), fim.date()))
+         .group_by(ResumoPagamentoDia.forma_pagamento)),
+
+        ('relatorios: produtos mais vendidos (resumo)',
+         select(Produto.nome, func.sum(ResumoProdutoDia.quantidade), func.sum(ResumoProdutoDia.valor))
+         .join(ResumoProdutoDia, ResumoProdutoDia.produto_id == Produto.id)
+         .where(ResumoProdutoDia.dia.between(inicio.date(), fim.date()))
+         .group_by(Produto.id).order_by(func.sum(ResumoProdutoDia.quantidade).desc()).limit(10)),
+
+        ('relatorios: produtos mais vendidos (filtro por forma)',
+         _consulta_produtos_por_forma(inicio, fim, 0, 'pix').statement),
+
+        ('relatorios: itens vendidos (detalhe)',
+         select(ItemVenda).join(Venda, Venda.id == ItemVenda.venda_id)
+         .join(Produto, Produto.id == ItemVenda.produto_id)
+         .where(Venda.data_venda.between(inicio, fim))
+         .order_by(Venda.data_venda.desc())),
+
+        ('recebimentos consolidados (resumo)',
+         select(ResumoPagamentoDia.forma_pagamento, Usuario.nome, func.sum(ResumoPagamentoDia.valor))
+         .join(Usuario, Usuario.id == ResumoPagamentoDia.usuario_id)
+         .where(ResumoPagamentoDia.dia.between(inicio.date(), fim.date()))
+         .group_by(ResumoPagamentoDia.forma_pagamento, Usuario.nome)),
+
+        ('relatorio de cupons (página, filtro por forma)',
+         _consulta_cupons(_filtros_cupons(inicio, fim, 0, 'pix')).statement),
+
+        ('relatorio de cupons (página seguinte, por caixa)',
+         _consulta_cupons(_filtros_cupons(inicio, fim, usuario_id, 'todos'), cursor=(fim, 1000)).statement),
+
+        ('total da exportação (andamento)',
+         select(func.count(Venda.id)).where(*exportacao._filtros(inicio, fim))),
+
+        ('exportação de vendas',
+         exportacao._consulta(inicio, fim)),
+
+        ('exportação de vendas (por caixa)',
+         exportacao._consulta(inicio, fim, caixa_id=usuario_id)),
+
+        ('exportação de vendas (filtro por forma)',
+         exportacao._consulta(inicio, fim, forma_pgto='pix')),
+    ]
+
+
+def plano(consulta):
+    """Executa EXPLAIN QUERY PLAN e retorna a lista de linhas 'detail' do plano."""
+    conexao = db.session.connection()
+    compilada = consulta.compile(dialect=conexao.dialect, compile_kwargs={'render_postcompile': True})
+    parametros = tuple(compilada.params[nome] for nome in compilada.positiontup)
+    linhas = conexao.exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compilada), parametros)
+    return [linha[-1] for linha in linhas]
+
+
+def verificar_planos(exibir=print):
+    """
+    Verifica o plano de cada consulta monitorada.
+    Retorna a lista de falhas [(nome, detalhe)]; vazia se tudo usar índice.
+    """
+    falhas = []
+    for nome, consulta in consultas_monitoradas():
+        detalhes = plano(consulta)
+        em_streaming = nome.startswith(CONSULTAS_EM_STREAMING)
+        exibir(f'- {nome}')
+        for detalhe in detalhes:
+            scan = _RE_SCAN.match(detalhe)
+            falhou = (bool(scan) and scan.group(1) in TABELAS_GRANDES) or \
+                     (em_streaming and detalhe.startswith(_ORDENACAO_TEMPORARIA))
+            exibir(f"    {'FALHA ' if falhou else ''}{detalhe}")
+            if falhou:
+                falhas.append((nome, detalhe))
+    return falhas
@@ -0,0 +1,297 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, func, insert, select, update
+
+from catalogo import proxima_versao_estoque
+from database import db
+from models import Produto, Venda, ItemVenda, PagamentoVenda
+from resumos import registrar_vendas, somar_no_caixa
+from sequencias import numeros_de_venda
+
+
+# =============================================================================
+# GRAVAÇÃO DE VENDAS DO PDV
+# Núcleo comum de /vendas/finalizar (uma venda) e /vendas/finalizar_lote
+# (várias vendas: reenvio da fila offline, caixas com muito movimento).
+# preparar_venda() valida contra um saldo de estoque em memória, que vai sendo
+# descontado venda a venda; gravar_vendas() grava qualquer número de vendas
+# com um comando por tabela. Nenhuma das funções faz commit.
+# =============================================================================
+
+FORMAS_PAGAMENTO_PDV = ['dinheiro', 'cartao', 'pix']
+
+
+class VendaRecusada(Exception):
+    """Venda que não pode ser gravada; 'status' é o código HTTP da resposta."""
+
+    def __init__(self, mensagem, status=400):
+        super().__init__(mensagem)
+        self.status = status
+
+
+class EstoqueAlterado(VendaRecusada):
+    """Outra venda baixou o estoque entre a leitura e a gravação (o UPDATE condicional falhou)."""
+
+    def __init__(self):
+        super().__init__('Estoque alterado por outra venda. Tente novamente.', 409)
+
+
+def uuid_da_venda(dados):
+    """Identificador gerado pelo PDV (None se não veio); recusa valores inválidos."""
+    uuid_venda = dados.get('uuid') or None
+    if uuid_venda is not None and (not isinstance(uuid_venda, str) or len(uuid_venda) > 36):
+        raise VendaRecusada('Identificador da venda inválido.')
+    return uuid_venda
+
+
+def ler_horario(texto):
+    """
+    Data/hora ISO 8601 enviada pelo PDV -> datetime local sem fuso (como as
+    colunas do banco). Com fuso ('Z' do toISOString), converte para o horário local.
+    """
+    if not isinstance(texto, str):
+        raise VendaRecusada('Horário da venda inválido.')
+    try:
+        horario = datetime.fromisoformat(texto.replace('Z', '+00:00'))
+    except ValueError:
+        raise VendaRecusada('Horário da venda inválido.')
+    if horario.tzinfo is not None:
+        horario = horario.astimezone().replace(tzinfo=None)
+    return horario
+
+
+def momento_da_venda(dados, diferenca_relogio, abertura_caixa, agora):
+    """
+    Horário em que a venda foi feita no PDV ('criada_em'; vendas da fila
+    offline chegam depois), no relógio do servidor: somado à diferença entre
+    os relógios do servidor e do PDV e limitado ao período do caixa (da
+    abertura até agora). Sem 'criada_em', a venda é de agora.
+    """
+    if dados.get('criada_em') is None:
+        return agora
+    momento = ler_horario(dados['criada_em']) + diferenca_relogio
+    return min(max(momento, abertura_caixa), agora)
+
+
+def diferenca_relogio(enviado_em, agora):
+    """Quanto o relógio do servidor está à frente do PDV ('enviado_em' do lote; sem ele, zero)"""
+    if enviado_em is None:
+        return timedelta(0)
+    return agora - ler_horario(enviado_em)
+
+
+def vendas_por_uuid(uuids):
+    """{uuid: Venda} das vendas já gravadas com esses identificadores (uma consulta)."""
+    if not uuids:
+        return {}
+    return {venda.uuid: venda for venda in Venda.query.filter(Venda.uuid.in_(list(uuids)))}
+
+
+def carregar_produtos(lista_dados):
+    """
+    Carrega em uma única consulta (IN) os produtos citados nas vendas.
+    Retorna ({id: linha (id, nome, preco_venda)}, {id: estoque_atual}).
+    """
+    ids = set()
+    for dados in lista_dados:
+        for item_json in (dados.get('itens') or []) if isinstance(dados, dict) else []:
+            try:
+                ids.add(int(item_json['id']))
+            except (KeyError, TypeError, ValueError):
+                pass  # preparar_venda() recusa o item
+    if not ids:
+        return {}, {}
+    linhas = db.session.execute(
+        select(Produto.id, Produto.nome, Produto.preco_venda, Produto.estoque_atual)
+        .where(Produto.id.in_(ids))
+    ).all()
+    return {linha.id: linha for linha in linhas}, {linha.id: linha.estoque_atual or 0 for linha in linhas}
+
+
+def preparar_venda(dados, produtos, estoque):
+    """
+    Valida uma venda ({'itens': [{'id', 'quantidade'}], 'pagamentos': [{'forma_pagamento', 'valor'}]})
+    e monta as linhas a gravar, com o preço do banco.
+    Desconta as quantidades de 'estoque', para que as próximas vendas do mesmo
+    lote sejam validadas com o saldo que sobrou.
+    """
+    if not isinstance(dados, dict) or not dados.get('itens'):
+        raise VendaRecusada('Carrinho vazio')
+    if not dados.get('pagamentos'):
+        raise VendaRecusada('Nenhuma forma de pagamento informada.')
+
+    try:
+        # 1. Agrupa as quantidades por produto (o mesmo produto pode vir em mais de uma linha)
+        quantidades = {}
+        linhas_itens = []
+        for item_json in dados['itens']:
+            produto_id = int(item_json['id'])
+            quantidade = int(item_json['quantidade'])
+            if quantidade <= 0:
+                raise VendaRecusada(f'Quantidade inválida para o produto ID {produto_id}.')
+            quantidades[produto_id] = quantidades.get(produto_id, 0) + quantidade
+            linhas_itens.append((produto_id, quantidade))
+
+        for produto_id, quantidade in quantidades.items():
+            produto = produtos.get(produto_id)
+            if not produto:
+                raise VendaRecusada(f'Produto ID {produto_id} não encontrado.')
+            if estoque[produto_id] < quantidade:
+                raise VendaRecusada(f'Estoque insuficiente para {produto.nome}. (Disponível: {estoque[produto_id]})')
+
+        # 2. Itens com o preço do banco e total da venda
+        valor_total = 0
+        itens = []
+        for produto_id, quantidade in linhas_itens:
+            preco_unitario = produtos[produto_id].preco_venda
+            subtotal = preco_unitario * quantidade
+            valor_total += subtotal
+            itens.append({
+                'produto_id': produto_id,
+                'quantidade': quantidade,
+                'preco_unitario': preco_unitario,
+                'subtotal': subtotal
+            })
+
+        # 3. Pagamentos (só as formas permitidas no PDV)
+        pagamentos = []
+        valor_pago = 0.0
+        for pagamento_json in dados['pagamentos']:
+            forma = pagamento_json['forma_pagamento']
+            if forma not in FORMAS_PAGAMENTO_PDV:
+                raise VendaRecusada(f"Forma de pagamento '{forma}' não é permitida no PDV.")
+            valor = float(pagamento_json['valor'])
+            valor_pago += valor
+            pagamentos.append({'forma_pagamento': forma, 'valor': valor})
+    except (KeyError, TypeError, ValueError):
+        raise VendaRecusada('Dados da venda inválidos.')
+
+    if round(valor_pago, 2) < round(valor_total, 2):
+        raise VendaRecusada('Valor total pago insuficiente para o valor total da venda.')
+
+    for produto_id, quantidade in quantidades.items():
+        estoque[produto_id] -= quantidade
+
+    return {
+        'uuid': dados.get('uuid') or None,
+        'quantidades': quantidades,
+        'itens': itens,
+        'pagamentos': pagamentos,
+        'valor_total': valor_total,
+        'valor_pago': valor_pago,
+        'troco': max(0.0, valor_pago - valor_total),
+    }
+
+
+def estoque_insuficiente(quantidades):
+    """Depois de um EstoqueAlterado (e do rollback): mensagem do produto que ficou sem saldo, ou None."""
+    linhas = db.session.execute(
+        select(Produto.id, Produto.nome, Produto.estoque_atual).where(Produto.id.in_(list(quantidades)))
+    ).all()
+    for linha in linhas:
+        if (linha.estoque_atual or 0) < quantidades[linha.id]:
+            return f'Estoque insuficiente para {linha.nome}. (Disponível: {linha.estoque_atual or 0})'
+    return None
+
+
+def gravar_vendas(vendas, usuario_id, movimento_caixa_id, momento, numeracao='global'):
+    """
+    Grava as vendas preparadas (mesmo operador e caixa) e preenche 'venda_id',
+    'numero_venda' e 'data_venda' em cada uma. A venda que já trouxer
+    'data_venda' (feita offline, ver momento_da_venda) é gravada com ela; as
+    demais, com 'momento'. O número de comandos não depende do número de vendas
+    nem de itens (só do número de dias). 'numeracao': ver sequencias.numeros_de_venda.
+    Levanta VendaRecusada (403) se o caixa foi fechado e EstoqueAlterado se o
+    estoque de algum produto acabou; nos dois casos o chamador faz o rollback.
+    """
+    por_dia = {}
+    for venda in vendas:
+        venda['data_venda'] = venda.get('data_venda') or momento
+        por_dia.setdefault(venda['data_venda'].date(), []).append(venda)
+
+    # 1. Totais do movimento de caixa (UPDATE só se ele ainda estiver aberto:
+    #    o cache pode não ter visto um fechamento em outro processo)
+    todos_pagamentos = [pagamento for venda in vendas for pagamento in venda['pagamentos']]
+    if not somar_no_caixa(movimento_caixa_id, len(vendas), sum(venda['valor_total'] for venda in vendas),
+                          todos_pagamentos, exigir_aberto=True):
+        raise VendaRecusada('Caixa está fechado!', 403)
+
+    # 2. Baixa de estoque ATÔMICA: um único executemany de
+    #    UPDATE ... SET estoque_atual = estoque_atual - :qtd WHERE id = :id AND estoque_atual >= :qtd
+    #    Se algum produto não tiver mais saldo (outro caixa vendeu antes), o rowcount denuncia.
+    #    A versão de estoque leva a baixa ao índice dos outros processos.
+    quantidades = {}
+    for venda in vendas:
+        for produto_id, quantidade in venda['quantidades'].items():
+            quantidades[produto_id] = quantidades.get(produto_id, 0) + quantidade
+    tabela_produtos = Produto.__table__
+    baixa = db.session.execute(
+        update(tabela_produtos)
+        .where(tabela_produtos.c.id == bindparam('b_id'),
+               tabela_produtos.c.estoque_atual >= bindparam('b_qtd'))
+        .values(estoque_atual=tabela_produtos.c.estoque_atual - bindparam('b_qtd'),
+                estoque_versao=proxima_versao_estoque()),
+        [{'b_id': produto_id, 'b_qtd': quantidade} for produto_id, quantidade in quantidades.items()]
+    )
+    if baixa.rowcount != len(quantidades):
+        raise EstoqueAlterado()
+
+    # 3. Números das vendas reservados antes do INSERT (um comando por dia do lote)
+    for vendas_do_dia in por_dia.values():
+        numeros = numeros_de_venda(len(vendas_do_dia), vendas_do_dia[0]['data_venda'], movimento_caixa_id, numeracao)
+        for venda, numero in zip(vendas_do_dia, numeros):
+            venda['numero_venda'] = numero
+
+    # 4. Vendas em um único INSERT (RETURNING dá os IDs na ordem das linhas)
+    tabela_vendas = Venda.__table__
+    ids = db.session.execute(
+        insert(tabela_vendas).returning(tabela_vendas.c.id, sort_by_parameter_order=True),
+        [{
+            'numero_venda': venda['numero_venda'],
+            'data_venda': venda['data_venda'],
+            'status': 'finalizada',
+            'usuario_id': usuario_id,
+            'uuid': venda['uuid'],
+            'movimento_caixa_id': movimento_caixa_id,
+            # Totais gravados uma única vez (usados pelos relatórios via SUM)
+            'valor_total': venda['valor_total'],
+            'valor_pago': venda['valor_pago'],
+            'troco': venda['troco'],
+            'num_itens': sum(venda['quantidades'].values()),
+        } for venda in vendas]
+    ).scalars().all()
+    for venda, venda_id in zip(vendas, ids):
+        venda['venda_id'] = venda_id
+
+    # 5. Itens e pagamentos em um executemany cada
+    db.session.execute(insert(ItemVenda.__table__), [
+        dict(item, venda_id=venda['venda_id']) for venda in vendas for item in venda['itens']
+    ])
+    db.session.execute(insert(PagamentoVenda.__table__), [
+        dict(pagamento, venda_id=venda['venda_id'], data_pagamento=venda['data_venda'])
+        for venda in vendas for pagamento in venda['pagamentos']
+    ])
+
+    # 6. Resumos diários (mesma transação), no dia em que cada venda foi feita
+    for vendas_do_dia in por_dia.values():
+        registrar_vendas(vendas_do_dia[0]['data_venda'], usuario_id, vendas_do_dia)
+
+
+def devolver_estoque(quantidades):
+    """
+    Estorno (cancelamento): soma {produto_id: quantidade} ao estoque com um
+    único executemany de UPDATE ... SET estoque_atual = estoque_atual + :qtd,
+    relativo ao valor do banco no momento da escrita. Não faz commit: roda na
+    transação do estorno. Uma baixa gravada por outro caixa entre a leitura da
+    venda e o commit não é sobrescrita.
+    """
+    if not quantidades:
+        return
+    tabela_produtos = Produto.__table__
+    db.session.execute(
+        update(tabela_produtos)
+        .where(tabela_produtos.c.id == bindparam('b_id'))
+        .values(estoque_atual=func.coalesce(tabela_produtos.c.estoque_atual, 0) + bindparam('b_qtd'),
+                estoque_versao=proxima_versao_estoque()),
+        [{'b_id': produto_id, 'b_qtd': quantidade} for produto_id, quantidade in quantidades.items()]
+    )
@@ -0,0 +1,189 @@
+from sqlalchemy import bindparam, delete, func, insert, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database import db
+from models import (Venda, ItemVenda, PagamentoVenda, MovimentoCaixa,
+                    ResumoVendaDia, ResumoPagamentoDia, ResumoProdutoDia)
+
+
+# =============================================================================
+# RESUMOS DIÁRIOS (ROLLUP)
+# Mantidos na MESMA transação das rotas que alteram vendas: finalizar (+),
+# cancelar (-) e editar pagamento (troca de forma). O dia é o da data_venda,
+# e só vendas finalizadas entram nos totais.
+# Os totais de cada movimento de caixa (MovimentoCaixa.qtd_vendas, total_*)
+# seguem a mesma regra, pela venda.movimento_caixa_id.
+# reconstruir_resumos() refaz tudo a partir do histórico.
+# =============================================================================
+
+# Coluna de MovimentoCaixa para cada forma de pagamento (as demais vão em 'total_outros')
+COLUNAS_FORMA_CAIXA = {'dinheiro': 'total_dinheiro', 'cartao': 'total_cartao', 'pix': 'total_pix'}
+
+def _somar(modelo, linhas):
+    """
+    UPSERT acumulando os valores de 'linhas' (executemany):
+    INSERT ... ON CONFLICT (chave primária) DO UPDATE SET col = col + excluded.col
+    """
+    if not linhas:
+        return
+    tabela = modelo.__table__
+    chaves = [coluna.name for coluna in tabela.primary_key]
+    valores = [nome for nome in linhas[0] if nome not in chaves]
+    comando = sqlite_insert(tabela)
+    comando = comando.on_conflict_do_update(
+        index_elements=chaves,
+        set_={nome: tabela.c[nome] + comando.excluded[nome] for nome in valores}
+    )
+    db.session.execute(comando, linhas)
+
+
+def registrar_venda(data_venda, usuario_id, valor_total, itens, pagamentos, sinal=1):
+    """
+    Soma uma venda nos resumos do dia (sinal=-1 estorna, no cancelamento).
+    itens: [{'produto_id', 'quantidade', 'subtotal'}]
+    pagamentos: [{'forma_pagamento', 'valor'}]
+    """
+    registrar_vendas(data_venda, usuario_id,
+                     [{'valor_total': valor_total, 'itens': itens, 'pagamentos': pagamentos}], sinal)
+
+
+def registrar_vendas(data_venda, usuario_id, vendas, sinal=1):
+    """
+    Soma várias vendas do mesmo dia e operador (lote do PDV) com um comando por resumo.
+    vendas: [{'valor_total', 'itens', 'pagamentos'}] (itens e pagamentos como em registrar_venda)
+    """
+    dia = data_venda.date()
+    _somar(ResumoVendaDia, [{
+        'dia': dia, 'usuario_id': usuario_id,
+        'num_vendas': sinal * len(vendas), 'valor_total': sinal * sum(venda['valor_total'] for venda in vendas),
+    }])
+    _somar(ResumoProdutoDia, [{
+        'dia': dia, 'usuario_id': usuario_id, 'produto_id': item['produto_id'],
+        'quantidade': sinal * item['quantidade'], 'valor': sinal * item['subtotal'],
+    } for venda in vendas for item in venda['itens']])
+    _somar(ResumoPagamentoDia, [{
+        'dia': dia, 'usuario_id': usuario_id, 'forma_pagamento': pagamento['forma_pagamento'],
+        'valor': sinal * pagamento['valor'],
+    } for venda in vendas for pagamento in venda['pagamentos']])
+
+
+def _valores_caixa(pagamentos):
+    """Soma os pagamentos nas colunas de MovimentoCaixa: {coluna: valor}"""
+    valores = {'total_dinheiro': 0.0, 'total_cartao': 0.0, 'total_pix': 0.0, 'total_outros': 0.0, 'total_geral': 0.0}
+    for pagamento in pagamentos:
+        coluna = COLUNAS_FORMA_CAIXA.get(pagamento['forma_pagamento'], 'total_outros')
+        valores[coluna] += pagamento['valor']
+        valores['total_geral'] += pagamento['valor']
+    return valores
+
+
+def somar_no_caixa(movimento_caixa_id, num_vendas, valor_total, pagamentos, exigir_aberto=False):
+    """
+    Soma nos totais do movimento de caixa (valores negativos estornam), com um
+    único UPDATE atômico (coluna = coluna + valor).
+    pagamentos: [{'forma_pagamento', 'valor'}]
+    Com 'exigir_aberto', só altera se o caixa ainda estiver aberto: retorna
+    False se ele foi fechado (a venda não deve ser gravada).
+    """
+    tabela = MovimentoCaixa.__table__
+    valores = {coluna: tabela.c[coluna] + valor for coluna, valor in _valores_caixa(pagamentos).items()}
+    valores['qtd_vendas'] = tabela.c.qtd_vendas + num_vendas
+    valores['valor_vendas'] = tabela.c.valor_vendas + valor_total
+
+    comando = update(tabela).where(tabela.c.id == movimento_caixa_id)
+    if exigir_aberto:
+        comando = comando.where(tabela.c.status == 'aberto')
+    return db.session.execute(comando.values(**valores)).rowcount == 1
+
+
+def estornar_venda(venda):
+    """Retira dos resumos (e do movimento de caixa) uma venda finalizada (cancelamento)."""
+    pagamentos = [{'forma_pagamento': p.forma_pagamento, 'valor': p.valor} for p in venda.pagamentos]
+    registrar_venda(
+        venda.data_venda, venda.usuario_id, venda.valor_total,
+        [{'produto_id': i.produto_id, 'quantidade': i.quantidade, 'subtotal': i.subtotal} for i in venda.itens],
+        pagamentos,
+        sinal=-1
+    )
+    if venda.movimento_caixa_id is not None:
+        somar_no_caixa(venda.movimento_caixa_id, -1, -venda.valor_total,
+                       [{'forma_pagamento': p['forma_pagamento'], 'valor': -p['valor']} for p in pagamentos])
+
+
+def trocar_pagamento(venda, forma_antiga, valor_antigo, forma_nova, valor_novo):
+    """Move o valor de um pagamento corrigido (editar_pagamento) para a nova forma."""
+    dia = venda.data_venda.date()
+    _somar(ResumoPagamentoDia, [
+        {'dia': dia, 'usuario_id': venda.usuario_id, 'forma_pagamento': forma_antiga, 'valor': -valor_antigo},
+        {'dia': dia, 'usuario_id': venda.usuario_id, 'forma_pagamento': forma_nova, 'valor': valor_novo},
+    ])
+    if venda.movimento_caixa_id is not None:
+        # Mesmo valor_total e quantidade de vendas: só a distribuição por forma muda
+        somar_no_caixa(venda.movimento_caixa_id, 0, 0.0, [
+            {'forma_pagamento': forma_antiga, 'valor': -valor_antigo},
+            {'forma_pagamento': forma_nova, 'valor': valor_novo},
+        ])
+
+
+def reconstruir_resumos():
+    """Apaga e recalcula todos os resumos (e os totais dos caixas) a partir das vendas finalizadas (não faz commit)."""
+    dia = func.date(Venda.data_venda)
+    finalizada = Venda.status == 'finalizada'
+
+    for modelo in (ResumoVendaDia, ResumoPagamentoDia, ResumoProdutoDia):
+        db.session.execute(delete(modelo))
+
+    db.session.execute(insert(ResumoVendaDia).from_select(
+        ['dia', 'usuario_id', 'num_vendas', 'valor_total'],
+        select(dia, Venda.usuario_id, func.count(Venda.id), func.coalesce(func.sum(Venda.valor_total), 0.0))
+        .where(finalizada).group_by(dia, Venda.usuario_id)
+    ))
+    db.session.execute(insert(ResumoPagamentoDia).from_select(
+        ['dia', 'usuario_id', 'forma_pagamento', 'valor'],
+        select(dia, Venda.usuario_id, PagamentoVenda.forma_pagamento, func.coalesce(func.sum(PagamentoVenda.valor), 0.0))
+        .join(Venda, Venda.id == PagamentoVenda.venda_id)
+        .where(finalizada).group_by(dia, Venda.usuario_id, PagamentoVenda.forma_pagamento)
+    ))
+    db.session.execute(insert(ResumoProdutoDia).from_select(
+        ['dia', 'usuario_id', 'produto_id', 'quantidade', 'valor'],
+        select(dia, Venda.usuario_id, ItemVenda.produto_id,
+               func.coalesce(func.sum(ItemVenda.quantidade), 0), func.coalesce(func.sum(ItemVenda.subtotal), 0.0))
+        .join(Venda, Venda.id == ItemVenda.venda_id)
+        .where(finalizada).group_by(dia, Venda.usuario_id, ItemVenda.produto_id)
+    ))
+
+    reconstruir_caixas()
+
+
+def reconstruir_caixas():
+    """Recalcula os totais de todos os movimentos de caixa a partir das vendas finalizadas (não faz commit)."""
+    tabela = MovimentoCaixa.__table__
+    finalizada = Venda.status == 'finalizada'
+
+    totais = {}
+    for movimento_id, qtd, valor in db.session.execute(
+        select(Venda.movimento_caixa_id, func.count(Venda.id), func.coalesce(func.sum(Venda.valor_total), 0.0))
+        .where(finalizada, Venda.movimento_caixa_id.isnot(None)).group_by(Venda.movimento_caixa_id)
+    ):
+        totais[movimento_id] = {'qtd_vendas': qtd, 'valor_vendas': valor, 'pagamentos': []}
+    for movimento_id, forma, valor in db.session.execute(
+        select(Venda.movimento_caixa_id, PagamentoVenda.forma_pagamento, func.sum(PagamentoVenda.valor))
+        .join(Venda, Venda.id == PagamentoVenda.venda_id)
+        .where(finalizada, Venda.movimento_caixa_id.isnot(None))
+        .group_by(Venda.movimento_caixa_id, PagamentoVenda.forma_pagamento)
+    ):
+        totais[movimento_id]['pagamentos'].append({'forma_pagamento': forma, 'valor': valor or 0.0})
+
+    zerados = {coluna: 0.0 for coluna in _valores_caixa([])}
+    db.session.execute(update(tabela).values(qtd_vendas=0, valor_vendas=0.0, **zerados))
+    if totais:
+        db.session.execute(
+            update(tabela).where(tabela.c.id == bindparam('b_id')).values(
+                qtd_vendas=bindparam('b_qtd_vendas'),
+                valor_vendas=bindparam('b_valor_vendas'),
+                **{coluna: bindparam(f'b_{coluna}') for coluna in zerados}
+            ),
+            [{'b_id': movimento_id, 'b_qtd_vendas': t['qtd_vendas'], 'b_valor_vendas': t['valor_vendas'],
+              **{f'b_{coluna}': valor for coluna, valor in _valores_caixa(t['pagamentos']).items()}}
+             for movimento_id, t in totais.items()]
+        )
@@ -0,0 +1,55 @@
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database import db
+from models import Sequencia
+
+
+# =============================================================================
+# SEQUÊNCIAS DE NUMERAÇÃO
+# Números legíveis (ex: número da venda) reservados ANTES do INSERT da linha
+# que os usa, sem marcador provisório nem UPDATE posterior. A reserva é um
+# único comando na transação do chamador: se ela for desfeita, o número
+# volta a ficar livre, e duas transações nunca recebem o mesmo número
+# (o SQLite só admite um escritor por vez).
+# =============================================================================
+
+# Formas de numerar as vendas (app.config['NUMERACAO_VENDAS'])
+NUMERACOES_VENDA = ('global', 'dia', 'caixa')
+
+
+def reservar(nome, quantidade=1):
+    """
+    Reserva 'quantidade' números seguidos da sequência 'nome' (criada na
+    primeira reserva). Retorna o primeiro; os demais são os seguintes.
+    """
+    tabela = Sequencia.__table__
+    comando = sqlite_insert(tabela).values(nome=nome, valor=quantidade)
+    comando = comando.on_conflict_do_update(
+        index_elements=[tabela.c.nome],
+        set_={'valor': tabela.c.valor + comando.excluded.valor}
+    ).returning(tabela.c.valor)
+    ultimo = db.session.execute(comando).scalar_one()
+    return ultimo - quantidade + 1
+
+
+def numeros_de_venda(quantidade, momento, movimento_caixa_id, numeracao='global'):
+    """
+    Números para 'quantidade' vendas novas:
+    'global' -> 1, 2, 3... (mesma sequência de sempre, continua do histórico)
+    'dia'    -> 20261017-0001, 20261017-0002... (recomeça a cada dia)
+    'caixa'  -> 12-0001, 12-0002... (recomeça a cada abertura de caixa; 12 = movimento)
+    """
+    if numeracao == 'dia':
+        prefixo = f'{momento:%Y%m%d}'
+        nome = f'vendas-{prefixo}'
+    elif numeracao == 'caixa':
+        prefixo = str(movimento_caixa_id)
+        nome = f'vendas-caixa-{prefixo}'
+    elif numeracao == 'global':
+        primeiro = reservar('vendas', quantidade)
+        return [str(numero) for numero in range(primeiro, primeiro + quantidade)]
+    else:
+        raise ValueError(f"Numeração de vendas desconhecida: '{numeracao}' (use {', '.join(NUMERACOES_VENDA)}).")
+
+    primeiro = reservar(nome, quantidade)
+    return [f'{prefixo}-{numero:04d}' for numero in range(primeiro, primeiro + quantidade)]
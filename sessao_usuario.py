@@ -0,0 +1,129 @@
+import threading
+from time import monotonic
+
+from flask import session
+from flask_login import UserMixin
+from sqlalchemy import func
+
+from database import db
+from models import Usuario
+
+
+# =============================================================================
+# USUÁRIO NA SESSÃO
+# O Flask-Login chama load_user em TODA requisição autenticada (inclusive cada
+# leitura do scanner). Com USUARIO_NA_SESSAO ligado, o essencial do usuário
+# (id, nome, perfil, versão) vai no cookie de sessão assinado, e só a versão e
+# o 'ativo' de cada usuário são conferidos em um cache em memória.
+# Editar/desativar um usuário incrementa 'usuarios.versao': a sessão antiga é
+# recarregada do banco (ou encerrada, se o usuário foi desativado).
+# =============================================================================
+
+# Com vários processos (workers do pdv serve), cada um confere a cada tantos
+# segundos se a tabela de usuários mudou (soma das versões e quantidade, uma
+# linha de resposta): uma alteração feita em outro processo vale em até:
+CONFERENCIA_USUARIOS_SEGUNDOS = 2
+
+CHAVE_SESSAO = 'usuario'
+
+
+class UsuarioSessao(UserMixin):
+    """Usuário logado montado a partir da sessão (sem objeto ORM)."""
+
+    def __init__(self, dados):
+        self.id = dados['id']
+        self.nome = dados['nome']
+        self.perfil = dados['perfil']
+        self.versao = dados['versao']
+        self.ativo = True
+
+    def is_admin(self):
+        """Verifica se o usuário é administrador"""
+        return self.perfil == 'admin'
+
+
+class CacheUsuarios:
+    """
+    Versão e situação (ativo) de todos os usuários, em memória.
+    A cada CONFERENCIA_USUARIOS_SEGUNDOS compara a assinatura da tabela
+    (SUM(versao), COUNT(*)): as versões só aumentam, então qualquer edição,
+    desativação ou cadastro a muda. Só então (ou após invalidar()) uma
+    única consulta recarrega todos os usuários.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versoes = {}  # id -> (versao, ativo)
+        self._assinatura = None
+        self._conferir_em = 0.0
+
+    def invalidar(self):
+        with self._lock:
+            self._assinatura = None
+            self._conferir_em = 0.0
+
+    def versao(self, usuario_id):
+        """Retorna (versao, ativo) do usuário, ou None se ele não existir."""
+        with self._lock:
+            # ID desconhecido: pode ser um usuário criado em outro processo
+            if usuario_id not in self._versoes:
+                self._recarregar()
+            elif self._conferir_em <= monotonic():
+                assinatura = tuple(db.session.query(func.coalesce(func.sum(Usuario.versao), 0),
+                                                    func.count(Usuario.id)).one())
+                if assinatura != self._assinatura:
+                    self._recarregar()
+                self._conferir_em = monotonic() + CONFERENCIA_USUARIOS_SEGUNDOS
+            return self._versoes.get(usuario_id)
+
+    def _recarregar(self):
+        self._versoes = {
+            id_: (versao, bool(ativo))
+            for id_, versao, ativo in db.session.query(Usuario.id, Usuario.versao, Usuario.ativo)
+        }
+        self._assinatura = (sum(versao for versao, _ in self._versoes.values()), len(self._versoes))
+        self._conferir_em = monotonic() + CONFERENCIA_USUARIOS_SEGUNDOS
+
+
+cache_usuarios = CacheUsuarios()
+
+
+def guardar_na_sessao(usuario):
+    """Grava o essencial do usuário na sessão (no login e quando a versão muda)."""
+    session[CHAVE_SESSAO] = {
+        'id': usuario.id,
+        'nome': usuario.nome,
+        'perfil': usuario.perfil,
+        'versao': usuario.versao,
+    }
+
+
+def carregar_usuario(usuario_id):
+    """
+    user_loader do modo USUARIO_NA_SESSAO. Sem acesso ao banco enquanto a
+    versão da sessão bater com a do cache; usuário desativado é deslogado.
+    """
+    situacao = cache_usuarios.versao(usuario_id)
+    if situacao is None or not situacao[1]:
+        session.pop(CHAVE_SESSAO, None)
+        return None
+
+    dados = session.get(CHAVE_SESSAO)
+    if not dados or dados.get('id') != usuario_id or dados.get('versao') != situacao[0]:
+        # Sessão antiga (ou de antes deste modo): relê o usuário uma vez
+        usuario = db.session.get(Usuario, usuario_id)
+        if usuario is None or not usuario.ativo:
+            session.pop(CHAVE_SESSAO, None)
+            return None
+        guardar_na_sessao(usuario)
+        dados = session[CHAVE_SESSAO]
+
+    return UsuarioSessao(dados)
+
+
+def usuario_alterado(usuario):
+    """
+    Chamado ao editar/desativar, antes do commit: as sessões abertas do usuário
+    ficam desatualizadas. Depois do commit, chamar cache_usuarios.invalidar().
+    """
+    usuario.versao = (usuario.versao or 0) + 1
@@ -0,0 +1,366 @@
+/*
+ * PDV offline: cópia local do catálogo de produtos e fila de envio das vendas.
+ *
+ * - O catálogo (/api/catalogo) fica no IndexedDB e em memória (Map por código
+ *   de barras e por ID). Na abertura do PDV e periodicamente, só o que mudou
+ *   desde a versão local é baixado (?desde=<versão>, ETag/304).
+ * - Cada venda finalizada recebe um UUID e entra em uma fila persistente, enviada
+ *   em ordem e em lotes a /vendas/finalizar_lote. O servidor ignora UUIDs já
+ *   gravados, então um reenvio (queda de conexão no meio da resposta) nunca
+ *   duplica a venda.
+ * - A fila é do navegador, não do operador: cada venda guarda o operador, o
+ *   caixa (movimento) e a hora em que foi feita, e só as vendas do caixa aberto
+ *   nesta tela são enviadas. As de outro operador/caixa ficam na fila para ele.
+ */
+const PdvOffline = (function () {
+    const NOME_BANCO = 'pdv_caixa';
+    const VERSAO_BANCO = 2;
+    const VENDAS_POR_LOTE = 50;
+
+    let banco = null;
+    const porId = new Map();
+    const porCodigo = new Map();
+    const textos = new Map();  // id -> {nome, palavras, codigo} normalizados (busca F2)
+    let versaoCatalogo = null; // null = ainda não há cópia local
+    let etagCatalogo = null;
+    let enviando = null;       // Promise do envio em andamento (um de cada vez)
+    let sessao = null;         // {usuarioId, movimentoId, chave} do caixa aberto nesta tela
+
+    // -------------------------------------------------------------------------
+    // IndexedDB
+    // -------------------------------------------------------------------------
+    function pedido(req) {
+        return new Promise((resolve, reject) => {
+            req.onsuccess = () => resolve(req.result);
+            req.onerror = () => reject(req.error);
+        });
+    }
+
+    function concluida(tx) {
+        return new Promise((resolve, reject) => {
+            tx.oncomplete = () => resolve();
+            tx.onerror = () => reject(tx.error);
+            tx.onabort = () => reject(tx.error);
+        });
+    }
+
+    function abrirBanco() {
+        const req = indexedDB.open(NOME_BANCO, VERSAO_BANCO);
+        req.onupgradeneeded = (evento) => {
+            const db = req.result;
+            if (evento.oldVersion < 1) {
+                db.createObjectStore('produtos', { keyPath: 'id' });
+                db.createObjectStore('meta');
+                db.createObjectStore('fila', { autoIncrement: true });
+            }
+            if (evento.oldVersion < 2) {
+                // Vendas por caixa ('usuario:movimento'). As da versão 1 não têm
+                // caixa e nunca são enviadas: não há como saber onde foram feitas
+                req.transaction.objectStore('fila').createIndex('sessao', 'sessao');
+            }
+        };
+        return pedido(req);
+    }
+
+    // -------------------------------------------------------------------------
+    // Catálogo
+    // -------------------------------------------------------------------------
+    // Mesma normalização e mesmas palavras de catalogo.py (normalizar e _RE_TOKEN)
+    function normalizar(texto) {
+        return (texto || '').normalize('NFKD').replace(/[\u0300-\u036f]/g, '').toLowerCase();
+    }
+
+    function palavras(texto) {
+        return texto.match(/[a-z0-9]+/g) || [];
+    }
+
+    function indexar(produto) {
+        desindexar(produto.id);
+        const nome = normalizar(produto.nome);
+        textos.set(produto.id, { nome: nome, palavras: palavras(nome), codigo: normalizar(produto.codigo_barras) });
+        porId.set(produto.id, produto);
+        porCodigo.set(produto.codigo_barras, produto);
+    }
+
+    function desindexar(id) {
+        const antigo = porId.get(id);
+        if (!antigo) return;
+        porId.delete(id);
+        textos.delete(id);
+        if (porCodigo.get(antigo.codigo_barras) === antigo) porCodigo.delete(antigo.codigo_barras);
+    }
+
+    /** caixa: {usuarioId, movimentoId} do caixa aberto nesta tela (dono das vendas enfileiradas) */
+    async function iniciar(caixa) {
+        sessao = Object.assign({ chave: `${caixa.usuarioId}:${caixa.movimentoId}` }, caixa);
+        banco = await abrirBanco();
+        const tx = banco.transaction(['produtos', 'meta'], 'readonly');
+        const [produtos, meta] = await Promise.all([
+            pedido(tx.objectStore('produtos').getAll()),
+            pedido(tx.objectStore('meta').get('catalogo'))
+        ]);
+        produtos.forEach(indexar);
+        if (meta && produtos.length) {
+            versaoCatalogo = meta.versao;
+            etagCatalogo = meta.etag;
+        }
+    }
+
+    async function sincronizarCatalogo(urlCatalogo) {
+        const url = versaoCatalogo === null ? urlCatalogo : `${urlCatalogo}?desde=${versaoCatalogo}`;
+        const headers = (versaoCatalogo !== null && etagCatalogo) ? { 'If-None-Match': etagCatalogo } : {};
+        const response = await fetch(url, { headers: headers });
+        if (response.status === 304) return false;
+        if (!response.ok || !(response.headers.get('Content-Type') || '').includes('json')) {
+            throw new Error('Falha ao baixar o catálogo.');
+        }
+        const dados = await response.json();
+
+        const tx = banco.transaction(['produtos', 'meta'], 'readwrite');
+        const loja = tx.objectStore('produtos');
+        if (dados.completo) {
+            loja.clear();
+            porId.clear();
+            porCodigo.clear();
+            textos.clear();
+        }
+        dados.produtos.forEach(linha => {
+            const produto = {};
+            dados.colunas.forEach((coluna, i) => { produto[coluna] = linha[i]; });
+            loja.put(produto);
+            indexar(produto);
+        });
+        dados.removidos.forEach(id => {
+            loja.delete(id);
+            desindexar(id);
+        });
+        tx.objectStore('meta').put({ versao: dados.versao, etag: response.headers.get('ETag') }, 'catalogo');
+        await concluida(tx);
+
+        versaoCatalogo = dados.versao;
+        etagCatalogo = response.headers.get('ETag');
+        return true;
+    }
+
+    /** Produto pelo código de barras ou pelo ID (mesma regra de /api/produto/<codigo>) */
+    function buscar(codigo) {
+        let produto = porCodigo.get(codigo);
+        if (!produto && /^\d+$/.test(codigo)) produto = porId.get(parseInt(codigo, 10));
+        return produto || null;
+    }
+
+    /**
+     * Pontos de uma palavra da busca em um produto, como em catalogo.py
+     * (CatalogoProdutos._casamentos): 3 = igual a uma palavra do nome ou ao
+     * código; 2 = início de uma palavra ou do código; 1 = final do código ou
+     * trecho do nome (3+ letras); 0 = não casa.
+     */
+    function pontosDaPalavra(termo, texto) {
+        if (texto.palavras.includes(termo) || texto.codigo === termo) return 3;
+        if (texto.palavras.some(p => p.startsWith(termo)) || texto.codigo.startsWith(termo)) return 2;
+        if (texto.codigo.endsWith(termo) || (termo.length >= 3 && texto.nome.includes(termo))) return 1;
+        return 0;
+    }
+
+    /**
+     * Busca por nome/código (F2) com a mesma regra e a mesma ordem de
+     * /api/produtos/buscar (CatalogoProdutos.pesquisar): todas as palavras
+     * precisam casar; ordena pela soma dos pontos, depois os nomes que começam
+     * com a primeira palavra, depois por nome.
+     */
+    function pesquisar(termo, limite) {
+        const termos = palavras(normalizar(termo));
+        if (!termos.length) return [];
+
+        let pontosPorId = null;  // id -> soma dos pontos das palavras já vistas
+        termos.forEach(palavra => {
+            const casados = new Map();
+            textos.forEach((texto, id) => {
+                const pontos = pontosDaPalavra(palavra, texto);
+                if (pontos) casados.set(id, pontos);
+            });
+            // Como no servidor: se nenhum produto casar, números procuram trecho no meio do
+            // código e palavras de 1-2 letras (sem trigramas no servidor), no meio do nome
+            if (!casados.size) {
+                const numero = /^\d+$/.test(palavra), curta = palavra.length < 3;
+                textos.forEach((texto, id) => {
+                    if ((numero && texto.codigo.includes(palavra)) || (curta && texto.nome.includes(palavra))) casados.set(id, 1);
+                });
+            }
+            if (pontosPorId === null) {
+                pontosPorId = casados;
+            } else {
+                const soma = new Map();
+                pontosPorId.forEach((pontos, id) => {
+                    if (casados.has(id)) soma.set(id, pontos + casados.get(id));
+                });
+                pontosPorId = soma;
+            }
+        });
+        const candidatos = [...pontosPorId].map(([id, pontos]) => ({ id: id, pontos: pontos }));
+
+        const primeira = termos[0];
+        const chave = c => {
+            const nome = textos.get(c.id).nome;
+            return [-c.pontos, nome.startsWith(primeira) ? 0 : 1, nome, c.id];
+        };
+        candidatos.sort((a, b) => {
+            const ka = chave(a), kb = chave(b);
+            for (let i = 0; i < ka.length; i++) {
+                if (ka[i] < kb[i]) return -1;
+                if (ka[i] > kb[i]) return 1;
+            }
+            return 0;
+        });
+        return candidatos.slice(0, limite).map(c => porId.get(c.id));
+    }
+
+    /** Desconta do estoque local os itens de uma venda ([{id, quantidade}]) */
+    async function baixarEstoque(itens) {
+        const tx = banco.transaction('produtos', 'readwrite');
+        itens.forEach(item => {
+            const produto = porId.get(item.id);
+            if (!produto) return;
+            produto.estoque_atual -= item.quantidade;
+            tx.objectStore('produtos').put(produto);
+        });
+        await concluida(tx);
+    }
+
+    // -------------------------------------------------------------------------
+    // Fila de vendas
+    // -------------------------------------------------------------------------
+    function novoUuid() {
+        if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+        return 'xxxxxxxx-xxxx-4xxx-yxxx-xxxxxxxxxxxx'.replace(/[xy]/g, c => {
+            const r = Math.random() * 16 | 0;
+            return (c === 'x' ? r : (r & 0x3 | 0x8)).toString(16);
+        });
+    }
+
+    /** Grava a venda na fila (antes de qualquer envio), com o caixa e a hora, e retorna o UUID dela */
+    async function enfileirarVenda(venda) {
+        venda.uuid = venda.uuid || novoUuid();
+        const tx = banco.transaction('fila', 'readwrite');
+        tx.objectStore('fila').add({
+            venda: venda,
+            criada_em: new Date().toISOString(),
+            usuario_id: sessao.usuarioId,
+            movimento_id: sessao.movimentoId,
+            sessao: sessao.chave
+        });
+        await concluida(tx);
+        return venda.uuid;
+    }
+
+    /** Vendas deste caixa aguardando envio */
+    async function pendentes() {
+        const indice = banco.transaction('fila', 'readonly').objectStore('fila').index('sessao');
+        return pedido(indice.count(IDBKeyRange.only(sessao.chave)));
+    }
+
+    /** Vendas de outros operadores/caixas guardadas neste navegador (não são enviadas daqui) */
+    async function deOutrosCaixas() {
+        const total = await pedido(banco.transaction('fila', 'readonly').objectStore('fila').count());
+        return total - await pendentes();
+    }
+
+    /** Primeiras 'limite' vendas deste caixa na fila, em ordem: [{chave, venda}] (venda como é enviada) */
+    async function inicioDaFila(limite) {
+        const indice = banco.transaction('fila', 'readonly').objectStore('fila').index('sessao');
+        const faixa = IDBKeyRange.only(sessao.chave);
+        const [chaves, valores] = await Promise.all([
+            pedido(indice.getAllKeys(faixa, limite)),
+            pedido(indice.getAll(faixa, limite))
+        ]);
+        return chaves.map((chave, i) => ({
+            chave: chave,
+            venda: Object.assign({}, valores[i].venda, {
+                movimento_id: valores[i].movimento_id,
+                criada_em: valores[i].criada_em
+            })
+        }));
+    }
+
+    async function removerDaFila(chaves) {
+        const tx = banco.transaction('fila', 'readwrite');
+        chaves.forEach(chave => tx.objectStore('fila').delete(chave));
+        await concluida(tx);
+    }
+
+    /**
+     * Envia as vendas da fila, em ordem e em lotes, até esvaziá-la ou perder a conexão.
+     * Retorna { enviadas: {uuid: resposta}, rejeitadas: {uuid: erro}, pendentes: n }.
+     * Vendas recusadas pelo servidor (ex: estoque insuficiente) saem da fila e
+     * vão em 'rejeitadas'; falhas de rede/servidor, caixa fechado ou de outro
+     * caixa (403) e conflitos (409) deixam a venda, e as seguintes, para depois.
+     * Só as vendas do caixa desta tela são enviadas; 'enviado_em' deixa o
+     * servidor corrigir a diferença entre o relógio dele e o deste computador.
+     */
+    function enviarFila(urlLote) {
+        if (!enviando) {
+            enviando = enviarFilaAgora(urlLote).finally(() => { enviando = null; });
+        }
+        return enviando;
+    }
+
+    function tentarDepois(status) {
+        return status >= 500 || status === 403 || status === 409;
+    }
+
+    async function enviarFilaAgora(urlLote) {
+        const resultado = { enviadas: {}, rejeitadas: {}, pendentes: 0 };
+        let lote;
+        while ((lote = await inicioDaFila(VENDAS_POR_LOTE)).length) {
+            let response;
+            try {
+                response = await fetch(urlLote, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({
+                        enviado_em: new Date().toISOString(),
+                        vendas: lote.map(item => item.venda)
+                    })
+                });
+            } catch (erro) {
+                break; // Sem conexão: tenta de novo mais tarde
+            }
+            // Sessão expirada (redireciona para o login) ou erro do servidor: tenta mais tarde
+            if (!response.ok || !(response.headers.get('Content-Type') || '').includes('json')) {
+                break;
+            }
+            const dados = await response.json();
+
+            // Resultados na ordem do lote: para na primeira venda que deve ser reenviada
+            const processadas = [];
+            for (let i = 0; i < lote.length; i++) {
+                const venda = lote[i].venda;
+                const resposta = dados.resultados[i];
+                if (resposta.error && tentarDepois(resposta.status)) break;
+                if (resposta.error) {
+                    resultado.rejeitadas[venda.uuid] = resposta.error;
+                } else {
+                    resultado.enviadas[venda.uuid] = resposta;
+                }
+                processadas.push(lote[i].chave);
+            }
+            await removerDaFila(processadas);
+            if (processadas.length < lote.length) break;
+        }
+        resultado.pendentes = await pendentes();
+        return resultado;
+    }
+
+    return {
+        iniciar: iniciar,
+        sincronizarCatalogo: sincronizarCatalogo,
+        buscar: buscar,
+        pesquisar: pesquisar,
+        baixarEstoque: baixarEstoque,
+        enfileirarVenda: enfileirarVenda,
+        enviarFila: enviarFila,
+        pendentes: pendentes,
+        deOutrosCaixas: deOutrosCaixas,
+        get carregado() { return versaoCatalogo !== null; }
+    };
+})();
@@ -0,0 +1,251 @@
+import json
+import os
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy.orm import aliased
+
+from database import db
+from models import Tarefa
+
+
+# =============================================================================
+# TAREFAS EM SEGUNDO PLANO
+# Importações e exportações rodam em um pool de threads próprio, fora das
+# threads que atendem as requisições (o PDV não espera um relatório).
+# O estado fica na tabela 'tarefas', compartilhada pelos processos (workers
+# do pdv serve): uma tarefa só começa depois de reservada nela (_reservar),
+# e o andamento é gravado na linha a cada INTERVALO_ANDAMENTO segundos (o
+# worker que atende /jobs/<id> pode não ser o que executa a tarefa). Entre
+# uma gravação e outra, o processo que executa responde com o andamento em
+# memória.
+# =============================================================================
+
+# Uma tarefa por vez em todos os processos: importação/exportação/backup usam
+# muito disco, memória e CPU, tirados do atendimento dos caixas. O pool de
+# cada processo tem essa quantidade de threads, e a reserva na tabela
+# 'tarefas' faz valer o limite entre os processos
+MAX_TAREFAS_SIMULTANEAS = 1
+
+# Segundos entre as gravações do andamento na tabela (também o sinal de vida da tarefa)
+INTERVALO_ANDAMENTO = 2
+
+# Tarefa 'executando' sem gravar andamento há mais que isso: o processo morreu
+TEMPO_SEM_SINAL = timedelta(minutes=2)
+
+# Segundos até tentar de novo a reserva de uma tarefa que esperava outra terminar
+INTERVALO_RESERVA = 1
+
+# Arquivos de tarefas concluídas há mais tempo que isso são apagados
+RETENCAO_ARQUIVOS = timedelta(days=1)
+
+_executor = ThreadPoolExecutor(max_workers=MAX_TAREFAS_SIMULTANEAS, thread_name_prefix='tarefa')
+_andamento = {}  # id -> (percentual, mensagem)
+_lock = threading.Lock()
+
+
+class ErroTarefa(Exception):
+    """Falha prevista (ex: planilha inválida): só a mensagem vai para o usuário, sem traceback no log"""
+    pass
+
+
+def pasta_tarefas():
+    """Pasta (dentro de 'instance') para uploads e arquivos gerados pelas tarefas."""
+    pasta = os.path.join(current_app.instance_path, 'tarefas')
+    os.makedirs(pasta, exist_ok=True)
+    return pasta
+
+
+def caminho_arquivo(tarefa_id, extensao):
+    return os.path.join(pasta_tarefas(), f'{tarefa_id}.{extensao}')
+
+
+def novo_id():
+    return uuid.uuid4().hex
+
+
+def informar_progresso(tarefa_id, percentual, mensagem=None):
+    """
+    Chamado pela função da tarefa para atualizar o andamento (em memória; vai
+    para a tabela na próxima gravação periódica).
+    """
+    with _lock:
+        _andamento[tarefa_id] = (int(percentual), mensagem)
+
+
+def enfileirar(tipo, usuario_id, funcao, *args, tarefa_id=None):
+    """
+    Registra a tarefa e a envia ao pool deste processo. 'funcao(tarefa_id, *args)'
+    roda no worker, dentro do app_context, e retorna um dict com:
+      'mensagem', 'resultado' (serializável em JSON), e opcionalmente
+      'arquivo' e 'nome_arquivo' (download).
+    Retorna o ID da tarefa.
+    """
+    _limpar_antigas()
+
+    tarefa = Tarefa(id=tarefa_id or novo_id(), tipo=tipo, usuario_id=usuario_id,
+                    status='pendente', mensagem='Aguardando na fila...')
+    db.session.add(tarefa)
+    db.session.commit()
+
+    app = current_app._get_current_object()
+    _executor.submit(_executar, app, tarefa.id, funcao, args)
+    return tarefa.id
+
+
+def _executar(app, tarefa_id, funcao, args):
+    with app.app_context():
+        try:
+            reservada = _reservar(tarefa_id)
+        except Exception:
+            db.session.rollback()
+            traceback.print_exc()
+            reservada = False
+        if not reservada:
+            db.session.remove()
+            _tentar_depois(app, tarefa_id, funcao, args)
+            return
+
+        informar_progresso(tarefa_id, 0, 'Processando...')
+        parar = threading.Event()
+        threading.Thread(target=_gravar_andamento, args=(app, tarefa_id, parar),
+                         name=f'andamento-{tarefa_id[:8]}', daemon=True).start()
+        try:
+            saida = funcao(tarefa_id, *args) or {}
+            _atualizar(tarefa_id,
+                       status='concluida',
+                       progresso=100,
+                       mensagem=saida.get('mensagem', 'Concluída.'),
+                       resultado=json.dumps(saida.get('resultado'), default=str),
+                       arquivo=saida.get('arquivo'),
+                       nome_arquivo=saida.get('nome_arquivo'),
+                       data_conclusao=datetime.now())
+        except Exception as e:
+            db.session.rollback()
+            if not isinstance(e, ErroTarefa):
+                traceback.print_exc()
+            _atualizar(tarefa_id, status='erro', mensagem=f'Erro: {e}', data_conclusao=datetime.now())
+        finally:
+            parar.set()
+            with _lock:
+                _andamento.pop(tarefa_id, None)
+            db.session.remove()
+
+
+def _reservar(tarefa_id):
+    """
+    Passa a tarefa de 'pendente' a 'executando' se nenhuma outra estiver
+    executando (em qualquer processo). É um único UPDATE ... WHERE
+    status = 'pendente' AND NOT EXISTS (executando): a trava de escrita do
+    SQLite impede duas reservas ao mesmo tempo. Antes, encerra as tarefas
+    cujo processo parou de gravar o andamento. Retorna True se reservou.
+    """
+    agora = datetime.now()
+    db.session.query(Tarefa).filter(
+        Tarefa.status == 'executando', Tarefa.data_andamento < agora - TEMPO_SEM_SINAL
+    ).update({'status': 'erro', 'mensagem': 'Interrompida (o processo que a executava parou).',
+              'data_conclusao': agora}, synchronize_session=False)
+
+    outra = aliased(Tarefa)
+    reservadas = db.session.query(Tarefa).filter(
+        Tarefa.id == tarefa_id,
+        Tarefa.status == 'pendente',
+        ~db.session.query(outra).filter(outra.status == 'executando').exists()
+    ).update({'status': 'executando', 'mensagem': 'Processando...', 'data_andamento': agora},
+             synchronize_session=False)
+    db.session.commit()
+    return reservadas == 1
+
+
+def _tentar_depois(app, tarefa_id, funcao, args):
+    """
+    Outra tarefa está executando: devolve esta ao pool em INTERVALO_RESERVA
+    segundos, sem prender a thread do pool enquanto espera.
+    """
+    def reenviar():
+        try:
+            _executor.submit(_executar, app, tarefa_id, funcao, args)
+        except RuntimeError:
+            pass  # Processo encerrando: fica pendente e é marcada como interrompida na próxima inicialização
+
+    espera = threading.Timer(INTERVALO_RESERVA, reenviar)
+    espera.daemon = True
+    espera.start()
+
+
+def _gravar_andamento(app, tarefa_id, parar):
+    """Thread de cada tarefa em execução: grava o andamento em memória na tabela até 'parar'."""
+    with app.app_context():
+        while not parar.wait(INTERVALO_ANDAMENTO):
+            with _lock:
+                progresso, mensagem = _andamento.get(tarefa_id, (None, None))
+            campos = {'data_andamento': datetime.now()}
+            if progresso is not None:
+                campos['progresso'] = progresso
+            if mensagem:
+                campos['mensagem'] = mensagem
+            try:
+                db.session.query(Tarefa).filter(Tarefa.id == tarefa_id, Tarefa.status == 'executando').update(
+                    campos, synchronize_session=False)
+                db.session.commit()
+            except Exception:
+                # Ex: banco ocupado por uma escrita longa; tenta de novo no próximo intervalo
+                db.session.rollback()
+        db.session.remove()
+
+
+def _atualizar(tarefa_id, **campos):
+    db.session.query(Tarefa).filter_by(id=tarefa_id).update(campos)
+    db.session.commit()
+
+
+def situacao(tarefa):
+    """
+    Estado da tarefa para a API (/jobs/<id>): o andamento gravado na tabela,
+    ou o em memória se ela estiver rodando neste processo.
+    """
+    progresso, mensagem = tarefa.progresso, tarefa.mensagem
+    if tarefa.status == 'executando':
+        with _lock:
+            progresso, mensagem_atual = _andamento.get(tarefa.id, (progresso, None))
+        mensagem = mensagem_atual or mensagem
+
+    return {
+        'id': tarefa.id,
+        'tipo': tarefa.tipo,
+        'status': tarefa.status,
+        'progresso': progresso,
+        'mensagem': mensagem,
+        'resultado': json.loads(tarefa.resultado) if tarefa.resultado else None,
+        'tem_arquivo': bool(tarefa.arquivo),
+        'data_criacao': tarefa.data_criacao.strftime('%Y-%m-%d %H:%M:%S') if tarefa.data_criacao else None,
+        'data_conclusao': tarefa.data_conclusao.strftime('%Y-%m-%d %H:%M:%S') if tarefa.data_conclusao else None,
+    }
+
+
+def marcar_interrompidas():
+    """Na inicialização: tarefas que estavam na fila/rodando morreram com o processo anterior."""
+    db.session.query(Tarefa).filter(Tarefa.status.in_(['pendente', 'executando'])).update(
+        {'status': 'erro', 'mensagem': 'Interrompida (o sistema foi reiniciado).', 'data_conclusao': datetime.now()},
+        synchronize_session=False
+    )
+    db.session.commit()
+
+
+def _limpar_antigas():
+    """Apaga os arquivos (e os registros) de tarefas encerradas há mais de RETENCAO_ARQUIVOS."""
+    limite = datetime.now() - RETENCAO_ARQUIVOS
+    antigas = Tarefa.query.filter(Tarefa.status.in_(['concluida', 'erro']),
+                                  Tarefa.data_conclusao < limite).all()
+    pasta = pasta_tarefas()
+    for tarefa in antigas:
+        # Só os arquivos gerados na pasta das tarefas (um backup, por exemplo, tem rotação própria)
+        if tarefa.arquivo and os.path.dirname(tarefa.arquivo) == pasta and os.path.exists(tarefa.arquivo):
+            os.remove(tarefa.arquivo)
+        db.session.delete(tarefa)
+    if antigas:
+        db.session.commit()